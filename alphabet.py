@@ -0,0 +1,196 @@
+import bisect
+import math
+import os
+import threading
+from functools import reduce
+
+from randomness import SYSTEM_RANDOMNESS
+from settings import CHAR_DISTRIBUTION, RANDOM_BUFFER_SIZE, USE_NUMPY
+
+# 'groups' picks a list of usable_chars first and then a character from it, 'uniform' picks any character.
+DISTRIBUTIONS = ['groups', 'uniform']
+
+# Largest lookup table built; beyond it, characters are found by binary search over their cumulative weights.
+TABLE_LIMIT = 1 << 20
+
+
+class Alphabet:
+	"""
+	Draws characters from usable_chars in bulk, from one large os.urandom() buffer at a time.
+
+	Every character gets an integer weight, proportional to its probability. With the 'groups' distribution a
+	character's weight is the least common multiple of the group sizes divided by the size of its group, which is
+	the same as picking a group and then one of its characters. With the 'uniform' distribution every distinct
+	character weighs the same. The characters are laid out in a flat table, each repeated as many times as its
+	weight, and indexed with random integers below the size of the table. The integers are read from the buffer
+	by rejection sampling: values at or above the largest multiple of the table size that fits are skipped, so
+	every index is equally likely.
+
+	Drawn characters are kept in a reservoir, so a single os.urandom() call serves many passwords. NumPy is only
+	imported when the reservoir is refilled a second time, so generating a few passwords doesn't pay for its import.
+	"""
+
+	def __init__(self, usable_chars, distribution=CHAR_DISTRIBUTION, buffer_size=RANDOM_BUFFER_SIZE,
+				 use_numpy=USE_NUMPY, randomness=SYSTEM_RANDOMNESS):
+		"""
+		Args:
+			usable_chars (list): List of lists of characters to be used in password generation.
+			distribution (str): One of DISTRIBUTIONS.
+			buffer_size (int): Number of characters drawn into the reservoir at a time.
+			use_numpy (bool): Determines if NumPy, when it is installed, is used to map the random buffer.
+			randomness (SystemRandomness): Source the random buffers are read from (see randomness.py).
+		"""
+		if distribution not in DISTRIBUTIONS:
+			raise ValueError(f"Unknown distribution '{distribution}', expected one of {DISTRIBUTIONS}.")
+
+		groups = [group for group in usable_chars if group]
+		if not groups:
+			raise ValueError('No usable characters.')
+
+		weights = {}
+		if distribution == 'groups':
+			multiple = reduce(lambda a, b: a * b // math.gcd(a, b), map(len, groups))
+			for group in groups:
+				for char in group:
+					weights[char] = weights.get(char, 0) + multiple // len(group)
+		else:
+			weights = dict.fromkeys((char for group in groups for char in group), 1)
+
+		self.distribution = distribution
+		self.chars = list(weights)
+		self.weights = list(weights.values())
+
+		self.cumulative = []
+		total = 0
+		for weight in self.weights:
+			total += weight
+			self.cumulative.append(total)
+
+		# Number of equally likely outcomes of a draw.
+		self.size = total
+		self.table = [char for char, weight in weights.items() for _ in range(weight)] if total <= TABLE_LIMIT else None
+
+		# Random values are read as unsigned integers of 1, 2, 4 or 8 bytes. Larger totals, from many groups of coprime
+		# sizes, are drawn one value at a time with randomness.randbelow().
+		self.width = next((width for width in (1, 2, 4, 8) if total <= 1 << 8 * width), None)
+		self.typecode = {1: 'B', 2: 'H', 4: 'I', 8: 'Q', None: None}[self.width]
+		self.limit = (1 << 8 * self.width) // total * total if self.width is not None else None
+
+		self.buffer_size = buffer_size
+		self.randomness = randomness
+		self.use_numpy = use_numpy
+		self._numpy = None
+		self._draws = 0
+
+		self._reservoir = []
+		self._pid = os.getpid()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.chars)
+
+	def probability(self, char):
+		"""
+		Returns the probability of drawing char.
+		"""
+		if char not in self.chars:
+			return 0.0
+		return self.weights[self.chars.index(char)] / self.size
+
+	def sample(self, count):
+		"""
+		Returns a list of count random characters.
+
+		Args:
+			count (int): Number of characters.
+		"""
+		if count <= 0:
+			return []
+
+		with self._lock:
+			if self._pid != os.getpid():
+				# A forked process would otherwise hand out the same characters as its parent.
+				self._reservoir = []
+				self._pid = os.getpid()
+
+			reservoir = self._reservoir
+			if len(reservoir) < count:
+				reservoir.extend(self._draw(max(count - len(reservoir), self.buffer_size)))
+
+			chars = reservoir[-count:]
+			del reservoir[-count:]
+
+		return chars
+
+	def choice(self):
+		"""
+		Returns a single random character.
+		"""
+		return self.sample(1)[0]
+
+	def _draw(self, count):
+		"""
+		Returns a list of count random characters, read from as few os.urandom() buffers as possible.
+		"""
+		if self.width is None:
+			chars = self.chars
+			cumulative = self.cumulative
+			return [chars[bisect.bisect_right(cumulative, self.randomness.randbelow(self.size))] for _ in range(count)]
+
+		chars = []
+
+		if self.use_numpy and self._numpy is None and self._draws:
+			self._load_numpy()
+		self._draws += 1
+
+		while len(chars) < count:
+			# Reading enough values to be left with the missing characters after rejection, on average.
+			values = (count - len(chars)) * (1 << 8 * self.width) // self.limit + 16
+			buffer = self.randomness.token_bytes(values * self.width)
+
+			if self._numpy is not None:
+				chars.extend(self._map_numpy(buffer))
+			else:
+				chars.extend(self._map(buffer))
+
+		del chars[count:]
+		return chars
+
+	def _load_numpy(self):
+		# Values of 8 bytes don't fit NumPy's int64.
+		if self.width == 8:
+			self.use_numpy = False
+			return
+
+		try:
+			import numpy
+		except ImportError:
+			self.use_numpy = False
+			return
+
+		self._numpy_chars = numpy.array(self.table if self.table is not None else self.chars, dtype=object)
+		self._numpy_cumulative = numpy.array(self.cumulative)
+		self._numpy = numpy
+
+	def _map(self, buffer):
+		size = self.size
+		limit = self.limit
+		values = memoryview(buffer).cast(self.typecode)
+
+		if self.table is not None:
+			table = self.table
+			return [table[value % size] for value in values if value < limit]
+
+		chars = self.chars
+		cumulative = self.cumulative
+		return [chars[bisect.bisect_right(cumulative, value % size)] for value in values if value < limit]
+
+	def _map_numpy(self, buffer):
+		numpy = self._numpy
+		values = numpy.frombuffer(buffer, dtype=f'u{self.width}').astype(numpy.int64)
+		values = values[values < self.limit] % self.size
+
+		if self.table is None:
+			values = numpy.searchsorted(self._numpy_cumulative, values, side='right')
+
+		return self._numpy_chars[values].tolist()
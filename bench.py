@@ -0,0 +1,475 @@
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import threading
+import timeit
+from argparse import ArgumentParser
+
+from password import PyPass
+from randomness import SeededRandomness
+from entropy import count_passwords
+from trigram import CompactTrigramModel
+from breach import BucketCache, HIBPRangeChecker, LocalIndexChecker, BloomFilterChecker, build_index, build_filter
+from text_for_testing import TEST_TEXT
+from settings import USABLE_CHARS
+
+# Version of the format of the results and of the measured work, stored with them so results of different formats
+# aren't compared. Version 2 draws the generators' random choices from the seed.
+RESULTS_VERSION = 2
+
+# Alphabets the generation stages are measured with, from the smallest to the largest.
+ALPHABETS = {
+	'digits': [list(string.digits)],
+	'default': USABLE_CHARS,
+	'extended': USABLE_CHARS + [[chr(code) for code in range(0xc0, 0x100) if chr(code).isalpha()]],
+}
+
+LENGTHS = [8, 16, 32]
+EXCLUSION_SIZES = [0, 100, 10000]
+
+# Parameters of a quick run, used to check for regressions without waiting for the full grid.
+QUICK_LENGTHS = [16]
+QUICK_ALPHABETS = ['default']
+QUICK_EXCLUSION_SIZES = [100]
+
+# Number of inputs each stage cycles through, and number of hashes in the stub breach index.
+INPUT_COUNT = 256
+INDEX_SIZE = 100000
+
+# Number of passwords generated or checked by each call of the batch benchmarks.
+BATCH_SIZE = 100
+
+# Largest exclusion list the entropy is computed for. Counting costs the size of the excluded words automaton, so
+# the largest list would take minutes per case.
+ENTROPY_MAX_EXCLUDED = 100
+
+# Command line script whose startup is measured, and the arguments of each measured mode. The interpreter alone is
+# measured as well, as the floor of every startup time.
+PYPASS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pypass.py')
+STARTUP_MODES = {
+	'simple': ['-pn', '1', '-sm'],
+	'default': ['-pn', '1'],
+	'human': ['-pn', '1', '-hu'],
+}
+
+
+def measure(function, count=1, repeat=5):
+	"""
+	Times function with timeit, in loops of at least 0.2 seconds, and returns the number of items handled per second
+	and the latency of each item in microseconds, from the median loop.
+
+	Args:
+		function (callable): Function to be timed, called without arguments.
+		count (int): Number of items (passwords, characters, checks) handled by each call.
+		repeat (int): Number of loops.
+	"""
+	timer = timeit.Timer(function)
+	number, _ = timer.autorange()
+	times = sorted(time / number / count for time in timer.repeat(repeat, number))
+
+	return {
+		'per_sec': 1 / times[len(times) // 2],
+		'median_us': times[len(times) // 2] * 1e6,
+		'min_us': times[0] * 1e6,
+		'max_us': times[-1] * 1e6,
+	}
+
+
+def case_key(name, params):
+	# Identifies a case across runs, e.g. 'remove_excluded[alphabet=default,excluded=100,length=16]'.
+	return name + '[' + ','.join(f'{key}={value}' for key, value in sorted(params.items())) + ']'
+
+
+def start_range_stub(suffixes):
+	"""
+	Starts serving the range API of haveibeenpwned locally, in a daemon thread, answering every prefix with
+	suffixes. Returns the server. http.server is only imported here, as pypass.py imports this module on every run.
+
+	Args:
+		suffixes (bytes): Body of every response.
+	"""
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+
+	class StubRangeHandler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def do_GET(self):
+			body = self.server.suffixes
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, *args):
+			pass
+
+	server = HTTPServer(('127.0.0.1', 0), StubRangeHandler)
+	server.suffixes = suffixes
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+class Benchmark:
+	"""
+	Measures each stage of password generation, the complete generation modes, the breach checkers and sentence
+	generation, over a grid of password lengths, alphabets and numbers of excluded words, and how long pypass.py
+	takes to start and print a password in each mode.
+
+	Inputs, and every random choice of the measured generators, are drawn from random generators seeded with seed, so
+	every run measures the same work: the same passwords, repairs and retries. The breach checks run against a local
+	index and a local stub of the range API, so results don't depend on the network.
+	"""
+
+	def __init__(self, quick=False, seed=0, pattern=None, repeat=5, directory=None):
+		"""
+		Args:
+			quick (bool): Determines if only QUICK_LENGTHS, QUICK_ALPHABETS and QUICK_EXCLUSION_SIZES are measured.
+			seed (int): Seed of the inputs.
+			pattern (str): Regular expression; only cases whose key matches it are measured.
+			repeat (int): Number of timed loops of each case.
+			directory (str): Directory for the stub breach index and filter.
+		"""
+		self.lengths = QUICK_LENGTHS if quick else LENGTHS
+		self.alphabets = QUICK_ALPHABETS if quick else list(ALPHABETS)
+		self.exclusion_sizes = QUICK_EXCLUSION_SIZES if quick else EXCLUSION_SIZES
+		self.quick = quick
+		self.seed = seed
+		self.pattern = re.compile(pattern) if pattern else None
+		self.repeat = repeat
+		self.directory = directory
+		self.results = {}
+
+	def rng(self, *params):
+		# Separate generator for each case, so selecting cases doesn't change their inputs.
+		return random.Random(f'{self.seed}:{params}')
+
+	def randomness(self, *params):
+		# Test-only randomness of a measured generator, also separate for each case.
+		return SeededRandomness(f'{self.seed}:{params}')
+
+	def excluded_words(self, size):
+		rng = self.rng('excluded', size)
+		return [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 8))) for _ in range(size)]
+
+	def inputs(self, alphabet, length, words=()):
+		"""
+		Returns INPUT_COUNT random passwords, as lists of characters. A quarter of them contain one of the words.
+		"""
+		rng = self.rng('inputs', alphabet, length, len(words))
+		chars = [char for group in ALPHABETS[alphabet] for char in group]
+		inputs = []
+
+		for number in range(INPUT_COUNT):
+			password = [rng.choice(chars) for _ in range(length)]
+			if words and number % 4 == 0:
+				word = rng.choice(words)[:length]
+				start = rng.randrange(length - len(word) + 1)
+				password[start:start + len(word)] = word
+			inputs.append(password)
+
+		return inputs
+
+	def generator(self, alphabet, words=(), **options):
+		return PyPass(usable_chars=ALPHABETS[alphabet], excluded_chars=[], excluded_words=list(words),
+					  breach_checker=self.index_checker,
+					  randomness=self.randomness('generator', alphabet, len(words), sorted(options.items())), **options)
+
+	def run_case(self, name, params, function, count=1):
+		"""
+		Measures a single case and stores its result. Cases which need resources that aren't available, like the
+		nltk WordNet corpus, are recorded as skipped, as are startup cases whose command fails for the same reason.
+		"""
+		key = case_key(name, params)
+		if self.pattern is not None and not self.pattern.search(key):
+			return
+
+		try:
+			result = measure(function, count=count, repeat=self.repeat)
+		except (ImportError, LookupError, OSError, subprocess.CalledProcessError) as error:
+			result = {'skipped': f'{type(error).__name__}: {error}'}
+
+		self.add_result(key, name, params, result)
+
+	def add_result(self, key, name, params, result):
+		self.results[key] = dict(name=name, params=params, **result)
+		print(format_result(key, self.results[key]), file=sys.stderr)
+
+	def cycle(self, inputs):
+		# Returns a function returning the inputs in turn, as fresh copies, since some stages modify them.
+		iterator = iter(range(sys.maxsize))
+		return lambda: list(inputs[next(iterator) % len(inputs)])
+
+	def run(self):
+		"""
+		Runs all the cases and returns the results, with a description of the environment they were measured in.
+		"""
+		# Only needed here, while pypass.py imports this module on every run.
+		import datetime
+		import platform
+		import tempfile
+
+		with tempfile.TemporaryDirectory(dir=self.directory) as directory:
+			self.make_index(directory)
+			try:
+				self.run_stages()
+				self.run_modes()
+				self.run_entropy()
+				self.run_breach_checks()
+				self.run_sentences()
+				self.run_startup()
+			finally:
+				self.index_checker.close()
+				self.filter_checker.close()
+
+		return {
+			'version': RESULTS_VERSION,
+			'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'cpu_count': os.cpu_count(),
+			'quick': self.quick,
+			'seed': self.seed,
+			'results': self.results,
+		}
+
+	def make_index(self, directory):
+		# Hashes of INDEX_SIZE made up passwords, as a sorted dump like the ones of Pwned Passwords.
+		dump = os.path.join(directory, 'dump.txt')
+		self.breached = [f'breached{number}' for number in range(INDEX_SIZE)]
+		hashes = sorted(hashlib.sha1(password.encode()).hexdigest().upper() for password in self.breached)
+
+		with open(dump, 'w') as f:
+			f.writelines(f'{sha1}:1\n' for sha1 in hashes)
+
+		build_index(dump, os.path.join(directory, 'index.bin'))
+		build_filter(dump, os.path.join(directory, 'filter.bin'), capacity=INDEX_SIZE).close()
+
+		self.index_path = os.path.join(directory, 'index.bin')
+		self.index_checker = LocalIndexChecker(self.index_path)
+		self.filter_checker = BloomFilterChecker(os.path.join(directory, 'filter.bin'), checker=self.index_checker)
+
+	def run_stages(self):
+		for alphabet in self.alphabets:
+			for length in self.lengths:
+				params = dict(alphabet=alphabet, length=length)
+				p = self.generator(alphabet)
+				next_input = self.cycle(self.inputs(alphabet, length))
+
+				self.run_case('generate_random', params, lambda: p.generate_random(length), count=length)
+				self.run_case('remove_touching_duplicates', params,
+							  lambda: p.remove_touching_duplicates(next_input()))
+				self.run_case('find_letter_sequences', params, lambda: p.find_letter_sequences(next_input()))
+				self.run_case('remove_english', params, lambda: p.remove_english(next_input(), False))
+				self.run_case('filter_words', params, lambda: p.filter_words(next_input()))
+				self.run_case('ensure_proportions', params, lambda: p.ensure_proportions(next_input()))
+
+				for size in self.exclusion_sizes:
+					words = self.excluded_words(size)
+					p = self.generator(alphabet, words)
+					next_input = self.cycle(self.inputs(alphabet, length, words))
+					self.run_case('remove_excluded', dict(params, excluded=size),
+								  lambda: p.remove_excluded(next_input(), False))
+
+	def batch(self, p, generate, **rules):
+		# Returns a function generating BATCH_SIZE passwords. The passwords stored by the previous call are dropped
+		# first, so they are only kept for as long as a single call takes, and lists don't grow across repeats.
+		def call():
+			p.passwords.clear()
+			p.human_passwords.clear()
+			generate(BATCH_SIZE, **rules)
+		return call
+
+	def run_modes(self):
+		for alphabet in self.alphabets:
+			for length in self.lengths:
+				for size in self.exclusion_sizes:
+					params = dict(alphabet=alphabet, length=length, excluded=size)
+					words = self.excluded_words(size)
+					p = self.generator(alphabet, words)
+					direct = self.generator(alphabet, words, direct_sampling=True)
+					rules = dict(remove_repeating=True, remove_english=True, check_proportions=True, fixed_len=length)
+
+					self.run_case('generate_password', params,
+								  self.batch(p, p.generate_password, fixed_len=length), count=BATCH_SIZE)
+					self.run_case('generate_password_all_rules', params,
+								  self.batch(p, p.generate_password, **rules), count=BATCH_SIZE)
+					self.run_case('generate_human_password', params,
+								  self.batch(p, p.generate_human_password, fixed_len=length), count=BATCH_SIZE)
+					self.run_case('direct_sampling_all_rules', params,
+								  self.batch(direct, direct.generate_password, **rules), count=BATCH_SIZE)
+
+	def run_entropy(self):
+		# Each computation starts with an empty cache, like the first generator of a policy when a service starts.
+		def compute(p, human):
+			count_passwords.cache_clear()
+			return p.entropy(human=human)
+
+		for alphabet in self.alphabets:
+			for size in self.exclusion_sizes:
+				if size > ENTROPY_MAX_EXCLUDED:
+					continue
+
+				words = self.excluded_words(size)
+				for direct_sampling in (False, True):
+					p = self.generator(alphabet, words, direct_sampling=direct_sampling)
+					for human in (False, True):
+						params = dict(alphabet=alphabet, excluded=size, direct=direct_sampling, human=human)
+						self.run_case('entropy', params, lambda: compute(p, human))
+
+	def run_breach_checks(self):
+		rng = self.rng('breach')
+		# Half of the checked passwords are breached.
+		batch = [rng.choice(self.breached) if number % 2 else f'fresh{rng.random()}' for number in range(BATCH_SIZE)]
+
+		self.run_case('breach_local_index', {}, lambda: self.index_checker.check_batch(batch), count=BATCH_SIZE)
+		self.run_case('breach_bloom_filter', {}, lambda: self.filter_checker.check_batch(batch), count=BATCH_SIZE)
+
+		# HIBPRangeChecker imports requests once it makes its first request.
+		if importlib.util.find_spec('requests') is None:
+			self.add_result(case_key('breach_range_stub', {}), 'breach_range_stub', {},
+							{'skipped': "ModuleNotFoundError: No module named 'requests'"})
+			return
+
+		# About as many suffixes as the real API returns for a prefix, with padding.
+		server = start_range_stub('\r\n'.join(f'{rng.getrandbits(140):035X}:{rng.randint(0, 9)}'
+											  for _ in range(800)).encode())
+
+		# Without a cache, every password is a round trip to the stub.
+		checker = HIBPRangeChecker(api_url=f'http://127.0.0.1:{server.server_port}/range/',
+								   cache=BucketCache(maxsize=0))
+		try:
+			self.run_case('breach_range_stub', {}, lambda: checker.check_batch(batch[:10]), count=10)
+		finally:
+			checker.close()
+			server.shutdown()
+			server.server_close()
+
+	def run_sentences(self):
+		from language import Language
+
+		# The model is built in memory from the test text, so nothing is read from or written to MODEL_DIR.
+		sentences = [sentence.split() for sentence in re.split(r'[.!?;]', TEST_TEXT) if sentence.strip()]
+		model = CompactTrigramModel.from_sentences(sentences)
+
+		for include_whitespace in (True, False):
+			language = Language(check_breached=False, include_whitespace=include_whitespace,
+								randomness=self.randomness('sentences', include_whitespace))
+			language.get_model = lambda library_name=None: model
+			self.run_case('form_sentece', dict(whitespace=include_whitespace), language.form_sentece)
+
+
+	def run_startup(self):
+		# Each call starts a new interpreter, which generates a single password checked against the local index.
+		def start(*arguments):
+			return lambda: subprocess.run([sys.executable, *arguments], stdout=subprocess.DEVNULL,
+										  stderr=subprocess.DEVNULL, check=True)
+
+		self.run_case('startup', dict(mode='interpreter'), start('-c', 'pass'))
+		for mode, arguments in STARTUP_MODES.items():
+			self.run_case('startup', dict(mode=mode), start(PYPASS_SCRIPT, *arguments, '-bi', self.index_path))
+
+
+def format_result(key, result):
+	if 'skipped' in result:
+		return f'{key:<70} skipped ({result["skipped"]})'
+	return f'{key:<70} {result["per_sec"]:>14,.0f}/s {result["median_us"]:>12.3f} us'
+
+
+def compare(baseline, current, threshold=0.1):
+	"""
+	Compares two runs and returns (key, baseline per second, current per second, relative change) for each case
+	measured in both, and the keys of the cases which got slower by more than threshold.
+
+	Args:
+		baseline (dict): Results of an earlier run.
+		current (dict): Results of this run.
+		threshold (float): Largest acceptable relative slowdown, e.g. 0.1 for 10%.
+	"""
+	if baseline.get('version') != current.get('version'):
+		raise ValueError('Results were saved in different formats and cannot be compared.')
+
+	changes = []
+	regressions = []
+
+	for key, result in current['results'].items():
+		before = baseline['results'].get(key)
+		if before is None or 'per_sec' not in before or 'per_sec' not in result:
+			continue
+
+		change = result['per_sec'] / before['per_sec'] - 1
+		changes.append((key, before['per_sec'], result['per_sec'], change))
+		if change < -threshold:
+			regressions.append(key)
+
+	return changes, regressions
+
+
+def add_arguments(parser):
+	"""
+	Adds the options of the benchmark to an argparse parser, used by 'python3 bench.py' and 'python3 pypass.py bench'.
+	"""
+	parser.add_argument("--json", "-j", metavar='PATH',
+						action="store", dest="json", default=None,
+						help="Path of a file the results are written to, as JSON."
+						)
+
+	parser.add_argument("--compare", "-cm", metavar='BASELINE',
+						action="store", dest="compare", default=None,
+						help="Path of the JSON results of an earlier run. Exits with status 1 if a case got slower."
+						)
+
+	parser.add_argument("--threshold", "-t", metavar='THRESHOLD',
+						action="store", dest="threshold", type=float, default=0.1,
+						help="Largest acceptable relative slowdown when comparing runs, 0.1 for 10%%."
+						)
+
+	parser.add_argument("--quick", "-q",
+						action="store_true", dest="quick",
+						help="Measures a single length, alphabet and exclusion list size."
+						)
+
+	parser.add_argument("--cases", "-k", metavar='PATTERN',
+						action="store", dest="cases", default=None,
+						help="Regular expression; only cases whose name and parameters match it are measured."
+						)
+
+	parser.add_argument("--seed", "-sd", metavar='SEED',
+						action="store", dest="seed", type=int, default=0,
+						help="Seed of the benchmark inputs. Only runs with the same seed should be compared."
+						)
+
+
+def main(args):
+	"""
+	Runs the benchmark described by parsed command line arguments. Returns the exit status.
+	"""
+	results = Benchmark(quick=args.quick, seed=args.seed, pattern=args.cases).run()
+
+	if args.json is not None:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+
+	if args.compare is None:
+		return 0
+
+	with open(args.compare, 'r') as f:
+		baseline = json.load(f)
+
+	changes, regressions = compare(baseline, results, args.threshold)
+	for key, before, after, change in changes:
+		flag = '  REGRESSION' if key in regressions else ''
+		print(f'{key:<70} {before:>14,.0f}/s -> {after:>14,.0f}/s {change:>+8.1%}{flag}')
+
+	return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+	parser = ArgumentParser(description="Benchmarks every generation mode and filter stage of PyPass.")
+	add_arguments(parser)
+	sys.exit(main(parser.parse_args()))
@@ -0,0 +1,293 @@
+import hashlib
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import weakref
+
+# Each block is a single 64 byte cache line, so a lookup touches one block, whatever the number of hashes.
+BLOCK_BYTES = 64
+BLOCK_BITS = BLOCK_BYTES * 8
+
+# Bit positions within a block are read from the key, 9 bits at a time, after the 64 bits used for the block index.
+POSITION_BITS = 9
+MAX_HASH_COUNT = 10
+
+FILTER_MAGIC = b'PYPASSBF'
+FILTER_VERSION = 1
+
+# Magic, format version, number of hashes, key type code, number of blocks and the number of keys added.
+FILTER_HEADER = struct.Struct('<8sBBB5xQQ')
+DATA_OFFSET = 64
+
+
+class BlockedBloomFilter:
+	"""
+	Blocked Bloom filter, a probabilistic set which can tell that a key was never added, or that it was
+	(probably) added, with a configurable rate of false positives.
+
+	Keys are bytes. Digests of at least 20 bytes (like SHA-1) are used directly, shorter keys are hashed first.
+	"""
+
+	def __init__(self, block_count, hash_count, data=None, key_count=0, key_type=0):
+		"""
+		Args:
+			block_count (int): Number of 64 byte blocks in the filter.
+			hash_count (int): Number of bits set for each key, at most 10.
+			data (bytearray, mmap): Buffer with the filter bits. A new one is allocated if not defined.
+			key_count (int): Number of keys already added to data.
+			key_type (int): Code describing the keys, stored alongside the filter.
+		"""
+		if not 1 <= hash_count <= MAX_HASH_COUNT:
+			raise ValueError(f'Number of hashes must be between 1 and {MAX_HASH_COUNT}.')
+
+		self.block_count = block_count
+		self.hash_count = hash_count
+		self.key_count = key_count
+		self.key_type = key_type
+		self.data = data if data is not None else bytearray(block_count * BLOCK_BYTES)
+		self._offset = DATA_OFFSET if isinstance(data, mmap.mmap) else 0
+
+	@staticmethod
+	def dimensions(capacity, false_positive_rate):
+		"""
+		Returns the number of blocks and hashes needed to hold capacity keys with the given false positive rate.
+
+		Args:
+			capacity (int): Expected number of keys.
+			false_positive_rate (float): Highest acceptable probability that a key which wasn't added is reported.
+		"""
+		if not 0 < false_positive_rate < 1:
+			raise ValueError('False positive rate must be between 0 and 1.')
+
+		capacity = max(capacity, 1)
+		bits_per_key = -math.log(false_positive_rate) / math.log(2) ** 2
+		hash_count = min(max(round(bits_per_key * math.log(2)), 1), MAX_HASH_COUNT)
+
+		# Blocking makes the filter a little less accurate than the textbook formula, so it is grown until
+		# the expected rate, computed for the uneven number of keys per block, is low enough.
+		block_count = math.ceil(capacity * bits_per_key / BLOCK_BITS)
+		while expected_false_positive_rate(capacity, block_count, hash_count) > false_positive_rate:
+			block_count = math.ceil(block_count * 1.05)
+
+		return block_count, hash_count
+
+	@classmethod
+	def for_capacity(cls, capacity, false_positive_rate=0.001):
+		"""
+		Returns an empty, in-memory filter sized for the given number of keys.
+		"""
+		return cls(*cls.dimensions(capacity, false_positive_rate))
+
+	@classmethod
+	def create(cls, path, capacity, false_positive_rate=0.001, key_type=0):
+		"""
+		Returns an empty filter backed by a new, memory-mapped file. Used when the filter doesn't fit into memory.
+		Call flush() once all keys are added.
+		"""
+		block_count, hash_count = cls.dimensions(capacity, false_positive_rate)
+
+		with open(path, 'wb') as f:
+			f.truncate(DATA_OFFSET + block_count * BLOCK_BYTES)
+
+		with open(path, 'r+b') as f:
+			data = mmap.mmap(f.fileno(), 0)
+
+		return cls(block_count, hash_count, data=data, key_type=key_type)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Memory-maps a filter saved with save() or flush(). Nothing is read until the filter is queried.
+		"""
+		with open(path, 'rb') as f:
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, hash_count, key_type, block_count, key_count = FILTER_HEADER.unpack_from(data, 0)
+
+		if magic != FILTER_MAGIC or version != FILTER_VERSION:
+			data.close()
+			raise ValueError(f'{path} is not a PyPass Bloom filter.')
+
+		return cls(block_count, hash_count, data=data, key_count=key_count, key_type=key_type)
+
+	def _header(self):
+		return FILTER_HEADER.pack(FILTER_MAGIC, FILTER_VERSION, self.hash_count, self.key_type,
+								  self.block_count, self.key_count).ljust(DATA_OFFSET, b'\0')
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			f.write(self._header())
+			f.write(self.data)
+
+	def flush(self):
+		self.data[:DATA_OFFSET] = self._header()
+		self.data.flush()
+
+	def close(self):
+		if isinstance(self.data, mmap.mmap):
+			self.data.close()
+
+	def _bits(self, key):
+		"""
+		Yields byte indexes and bit masks of the bits belonging to a key.
+		"""
+		if len(key) < 20:
+			key = hashlib.blake2b(key, digest_size=20).digest()
+
+		start = self._offset + (int.from_bytes(key[:8], 'little') % self.block_count) * BLOCK_BYTES
+		positions = int.from_bytes(key[8:20], 'little')
+
+		for _ in range(self.hash_count):
+			position = positions & (BLOCK_BITS - 1)
+			positions >>= POSITION_BITS
+			yield start + (position >> 3), 1 << (position & 7)
+
+	def add(self, key):
+		"""
+		Adds a key to the filter. Returns True if the key was (probably) already present.
+
+		Every added key is counted: a new key whose bits were all set already can't be told from a duplicate, so the
+		count, and the false positive rate derived from it, never fall below the real load of the filter. Duplicates
+		are left to the caller, which shouldn't add keys it knows were added before.
+		"""
+		data = self.data
+		present = True
+
+		for index, mask in self._bits(key):
+			if not data[index] & mask:
+				present = False
+				data[index] |= mask
+
+		self.key_count += 1
+		return present
+
+	def __contains__(self, key):
+		data = self.data
+		return all(data[index] & mask for index, mask in self._bits(key))
+
+	def __len__(self):
+		return self.key_count
+
+	@property
+	def size(self):
+		# Size of the filter bits in bytes.
+		return self.block_count * BLOCK_BYTES
+
+	@property
+	def false_positive_rate(self):
+		return expected_false_positive_rate(self.key_count, self.block_count, self.hash_count)
+
+
+def expected_false_positive_rate(key_count, block_count, hash_count):
+	"""
+	Computes the expected false positive rate of a blocked Bloom filter. The number of keys in a block follows
+	a Poisson distribution, and the rate of each block depends on how many keys it holds.
+
+	Args:
+		key_count (int): Number of keys in the filter.
+		block_count (int): Number of blocks in the filter.
+		hash_count (int): Number of bits set for each key.
+	"""
+	mean = key_count / block_count
+	if mean == 0:
+		return 0.0
+
+	# Blocks holding far fewer keys than the mean are left out. The first probability is computed from its logarithm,
+	# as exp(-mean) underflows for crowded blocks.
+	rate = 0.0
+	keys = max(0, int(mean - 12 * math.sqrt(mean) - 20))
+	probability = math.exp(keys * math.log(mean) - mean - math.lgamma(keys + 1))
+	limit = mean + 12 * math.sqrt(mean) + 20
+
+	while keys <= limit:
+		rate += probability * (1 - (1 - 1 / BLOCK_BITS) ** (hash_count * keys)) ** hash_count
+		keys += 1
+		probability *= mean / keys
+
+	return rate
+
+
+class ScalableBloomFilter:
+	"""
+	Bloom filter which grows as keys are added, for sets of unknown size.
+
+	Keys are added to the newest of a series of BlockedBloomFilters. Once it holds the number of keys it was sized
+	for, a filter for twice as many keys is started, with half the false positive rate, so that the rates of all the
+	filters add up to at most false_positive_rate.
+	"""
+
+	def __init__(self, initial_capacity=1 << 16, false_positive_rate=0.001, size_limit=None, directory=None):
+		"""
+		Args:
+			initial_capacity (int): Number of keys the first filter is sized for.
+			false_positive_rate (float): Highest acceptable probability that a key which wasn't added is reported.
+			size_limit (int): Largest total size of the filters in bytes. If not defined, the filters grow freely.
+			directory (str): Directory the filters are memory-mapped from, for sets which don't fit into memory.
+							 Each filter keeps its files in a directory of its own inside it, removed when the filter
+							 is closed or collected. If not defined, the filters are kept in memory.
+		"""
+		self.initial_capacity = initial_capacity
+		self.false_positive_rate = false_positive_rate
+		self.size_limit = size_limit
+		self.directory = directory
+
+		# Other filters, e.g. of other processes or services, may use the same directory.
+		self.path = None
+		if directory is not None:
+			self.path = tempfile.mkdtemp(prefix='pypass-', dir=directory)
+			self._remove = weakref.finalize(self, shutil.rmtree, self.path, True)
+		self.filters = []
+		self.capacities = []
+		self._grow()
+
+	def _grow(self):
+		index = len(self.filters)
+		capacity = self.initial_capacity << index
+		false_positive_rate = self.false_positive_rate / 2 ** (index + 1)
+		block_count, hash_count = BlockedBloomFilter.dimensions(capacity, false_positive_rate)
+
+		if self.size_limit is not None and self.size + block_count * BLOCK_BYTES > self.size_limit:
+			raise RuntimeError(f'Bloom filter of {len(self)} keys would grow past its size limit of '
+							   f'{self.size_limit} bytes.')
+
+		if self.path is not None:
+			bloom_filter = BlockedBloomFilter.create(os.path.join(self.path, f'filter-{index}.bf'), capacity,
+													 false_positive_rate)
+		else:
+			bloom_filter = BlockedBloomFilter(block_count, hash_count)
+
+		self.filters.append(bloom_filter)
+		self.capacities.append(capacity)
+
+	def add(self, key):
+		"""
+		Adds a key to the filter. Returns True if the key was (probably) already present.
+		"""
+		if any(key in bloom_filter for bloom_filter in self.filters[:-1]):
+			return True
+
+		present = self.filters[-1].add(key)
+		if len(self.filters[-1]) >= self.capacities[-1]:
+			self._grow()
+
+		return present
+
+	def __contains__(self, key):
+		return any(key in bloom_filter for bloom_filter in self.filters)
+
+	def __len__(self):
+		return sum(map(len, self.filters))
+
+	def close(self):
+		for bloom_filter in self.filters:
+			bloom_filter.close()
+		if self.path is not None:
+			self._remove()
+
+	@property
+	def size(self):
+		# Total size of the filters in bytes.
+		return sum(bloom_filter.size for bloom_filter in self.filters)
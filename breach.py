@@ -0,0 +1,465 @@
+import hashlib
+import mmap
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from bloom import BlockedBloomFilter
+from settings import BREACH_INDEX, BREACH_FILTER, BREACH_FILTER_FP_RATE, HIBP_RANGE_URL, BREACH_CACHE_SIZE, \
+	BREACH_CACHE_TTL
+
+USER_AGENT = "PyPass Python password generator. Demo version."
+
+
+class BreachChecker:
+	"""
+	Base class for objects which check passwords against databases of breached passwords.
+
+	Subclasses implement is_password_breached(), which mirrors pyhibp.pwnedpasswords.is_password_breached():
+	it returns the number of times a password was found in breaches, or 0 if it was never found.
+	"""
+
+	def is_password_breached(self, password):
+		raise NotImplementedError
+
+	def check_batch(self, passwords):
+		"""
+		Checks several passwords at once. Returns a list with the result of is_password_breached() for each password.
+		Subclasses which can share work between passwords override this.
+
+		Args:
+			passwords (list): Passwords to be checked.
+		"""
+		return [self.is_password_breached(password) for password in passwords]
+
+
+class HIBPChecker(BreachChecker):
+	"""
+	Checks passwords online, against 'https://haveibeenpwned.com/Passwords', using the pyhibp module.
+	"""
+
+	def __init__(self, user_agent=USER_AGENT):
+		"""
+		Args:
+			user_agent (str): User agent reported to the haveibeenpwned API.
+		"""
+		from pyhibp import set_user_agent
+
+		self.user_agent = user_agent
+		set_user_agent(ua=user_agent)
+
+	def __reduce__(self):
+		# The user agent is set per process, so it is set again when the checker is unpickled, e.g. in worker processes.
+		return (self.__class__, (self.user_agent,))
+
+	def is_password_breached(self, password):
+		from pyhibp import pwnedpasswords as pw
+
+		return pw.is_password_breached(password=password)
+
+
+class BucketCache:
+	"""
+	Thread safe LRU cache, holding at most maxsize items, each for at most ttl seconds.
+	"""
+
+	def __init__(self, maxsize=BREACH_CACHE_SIZE, ttl=BREACH_CACHE_TTL, clock=time.monotonic):
+		"""
+		Args:
+			maxsize (int): Maximum number of cached items. The least recently used item is dropped first.
+			ttl (float): Number of seconds after which an item expires.
+			clock (callable): Returns the current time in seconds.
+		"""
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.clock = clock
+		self._items = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._items)
+
+	def get(self, key):
+		"""
+		Returns the cached item, or None if it is missing or expired.
+		"""
+		with self._lock:
+			item = self._items.get(key)
+			if item is None:
+				return None
+
+			expires, value = item
+			if expires <= self.clock():
+				del self._items[key]
+				return None
+
+			self._items.move_to_end(key)
+			return value
+
+	def put(self, key, value):
+		with self._lock:
+			self._items[key] = (self.clock() + self.ttl, value)
+			self._items.move_to_end(key)
+
+			while len(self._items) > self.maxsize:
+				self._items.popitem(last=False)
+
+
+class HIBPRangeChecker(BreachChecker):
+	"""
+	Checks passwords online, using the k-anonymity range API of 'https://haveibeenpwned.com/Passwords'.
+
+	Only the first 5 hexadecimal characters of the SHA-1 hash of a password are sent. The API answers with the
+	suffixes of all breached hashes sharing that prefix, which are cached, so each prefix is fetched once for a
+	whole batch of passwords and again only after it expires. Requests reuse the connections of a single session.
+	"""
+
+	def __init__(self, api_url=HIBP_RANGE_URL, cache=None, user_agent=USER_AGENT, timeout=10, pool_size=10):
+		"""
+		Args:
+			api_url (str): URL of the range API, to which the hash prefix is appended.
+			cache (BucketCache): Cache for the fetched ranges. If not defined, one is made from settings.py.
+			user_agent (str): User agent reported to the API.
+			timeout (float): Number of seconds to wait for a response.
+			pool_size (int): Number of connections kept alive.
+		"""
+		self.api_url = api_url
+		self.cache = cache if cache is not None else BucketCache()
+		self.user_agent = user_agent
+		self.timeout = timeout
+		self.pool_size = pool_size
+		self.requests_made = 0
+		self._session = None
+		# The checker is shared by generation threads and server handlers, which would otherwise each make a session.
+		self._lock = threading.Lock()
+
+	def __reduce__(self):
+		# Sessions and cache locks can't be pickled, so a fresh checker is made instead.
+		return (self.__class__, (self.api_url, None, self.user_agent, self.timeout, self.pool_size))
+
+	@property
+	def session(self):
+		with self._lock:
+			if self._session is None:
+				import requests
+
+				adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+				session = requests.Session()
+				session.mount('http://', adapter)
+				session.mount('https://', adapter)
+				session.headers.update({'User-Agent': self.user_agent, 'Add-Padding': 'true'})
+				self._session = session
+
+			return self._session
+
+	def close(self):
+		with self._lock:
+			if self._session is not None:
+				self._session.close()
+				self._session = None
+
+	def get_range(self, prefix):
+		"""
+		Returns a dictionary of breached hash suffixes starting with prefix, mapped to the number of breaches.
+
+		Args:
+			prefix (str): First 5 characters of an upper case hexadecimal SHA-1 hash.
+		"""
+		suffixes = self.cache.get(prefix)
+		if suffixes is not None:
+			return suffixes
+
+		response = self.session.get(self.api_url + prefix, timeout=self.timeout)
+		response.raise_for_status()
+		with self._lock:
+			self.requests_made += 1
+
+		suffixes = {}
+		for line in response.text.splitlines():
+			suffix, _, count = line.partition(':')
+			# Padding entries, added so the response size doesn't reveal the prefix, have a count of 0.
+			if int(count or 0) > 0:
+				suffixes[suffix.strip().upper()] = int(count)
+
+		self.cache.put(prefix, suffixes)
+		return suffixes
+
+	def check_batch(self, passwords):
+		hashes = [hashlib.sha1(password.encode('utf-8')).hexdigest().upper() for password in passwords]
+
+		# Passwords are grouped by prefix, so each range is requested once per batch.
+		ranges = {}
+		for sha1 in hashes:
+			if sha1[:5] not in ranges:
+				ranges[sha1[:5]] = self.get_range(sha1[:5])
+
+		return [ranges[sha1[:5]].get(sha1[5:], 0) for sha1 in hashes]
+
+	def is_password_breached(self, password):
+		return self.check_batch([password])[0]
+
+
+class LocalIndexChecker(BreachChecker):
+	"""
+	Checks passwords against a local, memory-mapped index of breached password hashes, built with build_index().
+
+	The index file consists of a header, a table of record offsets for each 2-byte hash prefix and the sorted
+	binary hashes themselves. A lookup reads two table entries and binary searches a single prefix bucket,
+	so only the pages touched by the search are ever loaded into memory.
+	"""
+
+	def __init__(self, path):
+		"""
+		Args:
+			path (str): Path to the index file.
+		"""
+		self.path = path
+
+		with open(path, 'rb') as f:
+			self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, hash_code, self.record_count = INDEX_HEADER.unpack_from(self._mm, 0)
+
+		if magic != INDEX_MAGIC or version != INDEX_VERSION:
+			self._mm.close()
+			raise ValueError(f'{path} is not a PyPass breach index.')
+
+		self.hash_type = HASH_CODES[hash_code]
+		self.digest_size = HASH_TYPES[self.hash_type][1]
+		self._records_offset = INDEX_HEADER.size + PREFIX_TABLE.size
+
+	def __reduce__(self):
+		# Memory maps can't be pickled, so the index is simply reopened, e.g. in worker processes.
+		return (self.__class__, (self.path,))
+
+	def close(self):
+		self._mm.close()
+
+	def __len__(self):
+		return self.record_count
+
+	def __contains__(self, digest):
+		"""
+		Binary searches the prefix bucket of a raw hash digest.
+
+		Args:
+			digest (bytes): Raw digest, of the same hash type as the index.
+		"""
+		prefix = int.from_bytes(digest[:2], 'big')
+		low, high = struct.unpack_from('<2Q', self._mm, INDEX_HEADER.size + prefix * 8)
+
+		size = self.digest_size
+		offset = self._records_offset
+
+		while low < high:
+			middle = (low + high) // 2
+			start = offset + middle * size
+			record = self._mm[start:start + size]
+
+			if record < digest:
+				low = middle + 1
+			elif record > digest:
+				high = middle
+			else:
+				return True
+
+		return False
+
+	def is_password_breached(self, password):
+		# The index only stores hashes, so a breached password is reported as found once.
+		return int(hash_password(password, self.hash_type) in self)
+
+
+class BloomFilterChecker(BreachChecker):
+	"""
+	Pre-screens passwords with a compact Bloom filter of breached password hashes, built with build_filter().
+
+	A password missing from the filter was never breached. A password found in the filter was most likely
+	breached, but could be a false positive, so it is either reported as breached, which only costs generating
+	another password, or confirmed with another checker.
+	"""
+
+	def __init__(self, path, checker=None):
+		"""
+		Args:
+			path (str): Path to the filter file.
+			checker (BreachChecker): Optional checker used to confirm passwords found in the filter.
+		"""
+		self.path = path
+		self.checker = checker
+		self.filter = BlockedBloomFilter.load(path)
+		self.hash_type = HASH_CODES[self.filter.key_type]
+
+	def __reduce__(self):
+		return (self.__class__, (self.path, self.checker))
+
+	def close(self):
+		self.filter.close()
+
+	def is_password_breached(self, password):
+		if hash_password(password, self.hash_type) not in self.filter:
+			return 0
+
+		if self.checker is not None:
+			return self.checker.is_password_breached(password)
+
+		return 1
+
+
+def _ntlm(data):
+	try:
+		return hashlib.new('md4', data)
+	except ValueError:
+		raise ValueError('NTLM indexes require MD4 support in the hashlib/OpenSSL build.')
+
+
+# Supported hash types, mapped to the hash function and the digest size in bytes.
+HASH_TYPES = {
+	'sha1': (lambda password: hashlib.sha1(password.encode('utf-8')), 20),
+	'ntlm': (lambda password: _ntlm(password.encode('utf-16-le')), 16),
+}
+
+HASH_CODES = {1: 'sha1', 2: 'ntlm'}
+
+INDEX_MAGIC = b'PYPASSIX'
+INDEX_VERSION = 1
+
+# Magic, format version, hash type code and the number of records.
+INDEX_HEADER = struct.Struct('<8sBB6xQ')
+
+# Record offsets for each of the 65536 2-byte prefixes, plus the total number of records.
+PREFIX_TABLE = struct.Struct('<65537Q')
+
+
+def hash_password(password, hash_type='sha1'):
+	"""
+	Returns the raw digest of a password, as stored in the breach index.
+
+	Args:
+		password (str): Password to be hashed.
+		hash_type (str): Either 'sha1' or 'ntlm'.
+	"""
+	return HASH_TYPES[hash_type][0](password).digest()
+
+
+def read_dump(source, hash_type='sha1'):
+	"""
+	Yields raw digests from a Pwned Passwords dump, one line at a time. Each line must contain a hexadecimal hash,
+	optionally followed by ':' and a count.
+
+	Args:
+		source (str): Path to the text file with the hashes.
+		hash_type (str): Type of hashes in the dump, either 'sha1' or 'ntlm'.
+	"""
+	digest_size = HASH_TYPES[hash_type][1]
+
+	with open(source, 'r') as f:
+		for line in f:
+			line = line.strip()
+			if not line:
+				continue
+
+			digest = bytes.fromhex(line.split(':', 1)[0])
+
+			if len(digest) != digest_size:
+				raise ValueError(f'Unexpected hash length in line {line!r}, is the hash type {hash_type}?')
+
+			yield digest
+
+
+def build_index(source, destination, hash_type='sha1'):
+	"""
+	Builds a local breach index from a Pwned Passwords dump.
+
+	The dump is read line by line, so its size is not limited by available memory. The lines must be ordered
+	by hash, as they are in the 'ordered by hash' downloads from 'https://haveibeenpwned.com/Passwords'.
+
+	Args:
+		source (str): Path to the text file with the hashes.
+		destination (str): Path of the index file to be written.
+		hash_type (str): Type of hashes in the dump, either 'sha1' or 'ntlm'.
+
+	Returns the number of hashes written to the index.
+	"""
+	hash_code = {v: k for k, v in HASH_CODES.items()}[hash_type]
+
+	prefix_starts = [0] * 65537
+	next_prefix = 0
+	count = 0
+	previous = b''
+
+	with open(destination, 'wb') as dst:
+		dst.write(b'\0' * (INDEX_HEADER.size + PREFIX_TABLE.size))
+
+		for digest in read_dump(source, hash_type):
+			if digest < previous:
+				raise ValueError('Hashes in the source file must be ordered by hash.')
+			if digest == previous:
+				continue
+
+			# Every prefix up to and including this one starts at the current record.
+			prefix = int.from_bytes(digest[:2], 'big')
+			while next_prefix <= prefix:
+				prefix_starts[next_prefix] = count
+				next_prefix += 1
+
+			dst.write(digest)
+			previous = digest
+			count += 1
+
+		while next_prefix <= 65536:
+			prefix_starts[next_prefix] = count
+			next_prefix += 1
+
+		dst.seek(0)
+		dst.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, hash_code, count))
+		dst.write(PREFIX_TABLE.pack(*prefix_starts))
+
+	return count
+
+
+def build_filter(source, destination, false_positive_rate=BREACH_FILTER_FP_RATE, hash_type='sha1', capacity=None):
+	"""
+	Builds a Bloom filter from a Pwned Passwords dump. The filter is written through a memory-mapped file,
+	so it doesn't have to fit into memory. Its size is about 1.44 * log2(1 / false_positive_rate) bits per hash,
+	e.g. roughly 1.8 bytes per hash for a rate of 0.001.
+
+	Args:
+		source (str): Path to the text file with the hashes.
+		destination (str): Path of the filter file to be written.
+		false_positive_rate (float): Probability that a password which was never breached is reported.
+		hash_type (str): Type of hashes in the dump, either 'sha1' or 'ntlm'.
+		capacity (int): Number of hashes in the dump. If not defined, the dump is read once to count them.
+
+	Returns the built filter.
+	"""
+	if capacity is None:
+		capacity = sum(1 for _ in read_dump(source, hash_type))
+
+	hash_code = {v: k for k, v in HASH_CODES.items()}[hash_type]
+	bloom_filter = BlockedBloomFilter.create(destination, capacity, false_positive_rate, key_type=hash_code)
+
+	for digest in read_dump(source, hash_type):
+		bloom_filter.add(digest)
+
+	bloom_filter.flush()
+	return bloom_filter
+
+
+def get_breach_checker(breach_index=BREACH_INDEX, breach_filter=BREACH_FILTER):
+	"""
+	Returns the breach checker described by the settings. A Bloom filter, if one is set, is consulted first and
+	the local index, if set, only confirms its hits. Without a filter, the local index is used if one is set,
+	and the range API of haveibeenpwned otherwise.
+
+	Args:
+		breach_index (str): Path to a local breach index built with build_index().
+		breach_filter (str): Path to a Bloom filter built with build_filter().
+	"""
+	checker = LocalIndexChecker(breach_index) if breach_index else None
+
+	if breach_filter:
+		return BloomFilterChecker(breach_filter, checker=checker)
+
+	return checker or HIBPRangeChecker()
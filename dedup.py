@@ -0,0 +1,101 @@
+import hashlib
+import sys
+
+from bloom import ScalableBloomFilter
+from settings import DEDUP_METHOD, DEDUP_MEMORY_LIMIT, DEDUP_FALSE_POSITIVE_RATE, DEDUP_DIRECTORY
+
+# 'digest' remembers an 8 byte digest of each password, 'bloom' a few bits of it in a ScalableBloomFilter.
+DEDUP_METHODS = ['digest', 'bloom']
+
+
+class DigestSet:
+	"""
+	Set of seen passwords, holding a fixed-size 8 byte digest of each password instead of the password itself.
+
+	Two passwords share a digest with a negligible probability (about 3% over a billion passwords), in which case
+	the second one is reported as seen and is simply replaced by another password.
+	"""
+
+	def __init__(self, memory_limit=None):
+		"""
+		Args:
+			memory_limit (int): Largest size of the set in bytes. If not defined, the set grows freely.
+		"""
+		self.digests = set()
+		self.memory_limit = memory_limit
+
+	def add(self, password):
+		"""
+		Adds a password to the set. Returns True if it was already seen.
+		"""
+		digest = int.from_bytes(hashlib.blake2b(password.encode('utf-8'), digest_size=8).digest(), 'little')
+
+		if digest in self.digests:
+			return True
+
+		self.digests.add(digest)
+
+		# The size is only checked once in a while, it changes slowly.
+		if self.memory_limit is not None and not len(self.digests) & 1023 and self.size > self.memory_limit:
+			raise RuntimeError(f"Seen passwords take more than {self.memory_limit} bytes. Use the 'bloom' method "
+							   f"for larger batches.")
+
+		return False
+
+	def __len__(self):
+		return len(self.digests)
+
+	@property
+	def size(self):
+		# Approximate size in bytes: the hash table and an integer object for each digest.
+		return sys.getsizeof(self.digests) + len(self.digests) * sys.getsizeof(1 << 63)
+
+
+class BloomSet:
+	"""
+	Set of seen passwords, kept in a ScalableBloomFilter, which takes about 2 bytes per password at the default
+	false positive rate. Passwords which were never seen are reported as seen with a probability of at most
+	false_positive_rate, in which case they are simply replaced by other passwords.
+	"""
+
+	def __init__(self, memory_limit=None, false_positive_rate=DEDUP_FALSE_POSITIVE_RATE, directory=DEDUP_DIRECTORY):
+		"""
+		Args:
+			memory_limit (int): Largest size of the filters in bytes. If not defined, the filters grow freely.
+			false_positive_rate (float): Highest acceptable probability that a new password is reported as seen.
+			directory (str): Directory the filters are memory-mapped from, for batches which don't fit into memory.
+		"""
+		self.filter = ScalableBloomFilter(false_positive_rate=false_positive_rate, size_limit=memory_limit,
+										  directory=directory)
+
+	def add(self, password):
+		"""
+		Adds a password to the set. Returns True if it was (probably) already seen.
+		"""
+		return self.filter.add(hashlib.blake2b(password.encode('utf-8'), digest_size=20).digest())
+
+	def __len__(self):
+		return len(self.filter)
+
+	def close(self):
+		self.filter.close()
+
+	@property
+	def size(self):
+		return self.filter.size
+
+
+def get_seen_set(method=DEDUP_METHOD, memory_limit=DEDUP_MEMORY_LIMIT):
+	"""
+	Returns an empty set of seen passwords.
+
+	Args:
+		method (str): One of DEDUP_METHODS.
+		memory_limit (int): Largest size of the set in bytes. Adding passwords past it raises a RuntimeError.
+	"""
+	if method == 'digest':
+		return DigestSet(memory_limit)
+	if method == 'bloom':
+		return BloomSet(memory_limit)
+
+	raise ValueError(f"Unknown deduplication method '{method}', expected one of {DEDUP_METHODS}.")
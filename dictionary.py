@@ -0,0 +1,151 @@
+import os
+import re
+import threading
+
+from settings import ENGLISH_DICTIONARY
+
+# Detachment rules of WordNet's morphy() for each part of speech ('n'oun, 'v'erb, 'a'djective, adve'r'b), mapping
+# inflected endings to the endings of their base forms. A rule only applies when the base form has that part of
+# speech. Adverbs have no rules, but their lemmas are words all the same.
+MORPHY_SUFFIXES = {
+	'n': [('s', ''), ('ses', 's'), ('ves', 'f'), ('xes', 'x'), ('zes', 'z'), ('ches', 'ch'), ('shes', 'sh'),
+		  ('men', 'man'), ('ies', 'y')],
+	'v': [('s', ''), ('ies', 'y'), ('es', 'e'), ('es', ''), ('ed', 'e'), ('ed', ''), ('ing', 'e'), ('ing', '')],
+	'a': [('er', ''), ('est', ''), ('er', 'e'), ('est', 'e')],
+	'r': [],
+}
+
+# Parts of speech of a word whose parts of speech aren't known.
+ALL_POS = ''.join(MORPHY_SUFFIXES)
+
+_letters = re.compile('[a-zA-Z]+')
+
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+class EnglishDictionary:
+	"""
+	Set of English words derived from WordNet, answering the same question as wordnet.synsets(word) being non-empty,
+	without loading the WordNet corpus.
+
+	The set holds all single-word WordNet lemmas, with their parts of speech, and irregular inflections. Regular
+	inflections ('dogs', 'walked') are recognized by applying morphy's suffix rules of each part of speech of the
+	base form to the word, which costs a few dictionary lookups, so 'walked' is a word but 'doged' isn't.
+	"""
+
+	def __init__(self, words):
+		"""
+		Args:
+			words (iterable): Lower case words, or a dict mapping them to their parts of speech, e.g. {'walk': 'nv'}.
+							  Words of a plain iterable may be inflected as any part of speech.
+		"""
+		if not isinstance(words, dict):
+			words = dict.fromkeys(words, ALL_POS)
+
+		# Parts of speech of each word, empty for irregular inflections, which aren't inflected any further.
+		self.pos = words
+		self.words = frozenset(words)
+		self.max_length = max(map(len, self.words), default=0)
+
+	def __len__(self):
+		return len(self.words)
+
+	def __contains__(self, word):
+		return self.is_word(word)
+
+	@classmethod
+	def from_wordnet(cls):
+		"""
+		Builds the dictionary from the nltk WordNet corpus.
+		"""
+		from nltk.corpus import wordnet
+
+		words = {}
+		for pos in MORPHY_SUFFIXES:
+			for word in wordnet.all_lemma_names(pos):
+				if _letters.fullmatch(word):
+					word = word.lower()
+					words[word] = ''.join(sorted(set(words.get(word, '') + pos)))
+
+		# Irregular forms, like 'geese' or 'ran', which morphy() looks up in WordNet's exception lists.
+		for exceptions in getattr(wordnet, '_exception_map', {}).values():
+			for word in exceptions:
+				if _letters.fullmatch(word):
+					words.setdefault(word.lower(), '')
+
+		return cls(words)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Loads a dictionary saved with save(): a word on each line, followed by its parts of speech. Files of plain
+		words, without any parts of speech, are loaded with every part of speech for each word.
+		"""
+		with open(path, 'r') as f:
+			entries = [line.split() for line in f if line.strip()]
+
+		if not any(len(entry) > 1 for entry in entries):
+			return cls(entry[0] for entry in entries)
+
+		return cls({entry[0]: entry[1] if len(entry) > 1 else '' for entry in entries})
+
+	def save(self, path):
+		with open(path, 'w') as f:
+			f.write('\n'.join(f'{word} {self.pos[word]}'.rstrip() for word in sorted(self.words)))
+
+	@classmethod
+	def get(cls, path=ENGLISH_DICTIONARY):
+		"""
+		Returns the dictionary stored at path, loaded once per process. If the file doesn't exist, the dictionary
+		is built from WordNet and saved there first.
+
+		Args:
+			path (str): Path to the dictionary file.
+		"""
+		with _dictionaries_lock:
+			if path not in _dictionaries:
+				if not os.path.exists(path):
+					cls.from_wordnet().save(path)
+				_dictionaries[path] = cls.load(path)
+
+			return _dictionaries[path]
+
+	def is_word(self, word):
+		"""
+		Checks if a word, or its base form, is an English word, regardless of case.
+
+		Args:
+			word (str): Word to be checked.
+		"""
+		word = word.lower()
+		pos = self.pos
+
+		if word in pos:
+			return True
+
+		for part, suffixes in MORPHY_SUFFIXES.items():
+			for suffix, ending in suffixes:
+				if word.endswith(suffix) and part in pos.get(word[:len(word) - len(suffix)] + ending, ''):
+					return True
+
+		return False
+
+	def find_words(self, text, min_length=4):
+		"""
+		Yields (start, end) positions of English words contained in the sequences of letters in the text, including
+		words embedded in longer sequences, e.g. 'house' in 'xhousez'.
+
+		Args:
+			text (str): String to be searched.
+			min_length (int): Length of the shortest words to be found.
+		"""
+		for run in _letters.finditer(text):
+			run_start, run_end = run.span()
+
+			for start in range(run_start, run_end - min_length + 1):
+				# Inflected forms are a few letters longer than the longest base word.
+				last = min(run_end, start + self.max_length + 4)
+				for end in range(start + min_length, last + 1):
+					if self.is_word(text[start:end]):
+						yield start, end
@@ -0,0 +1,447 @@
+import importlib.util
+import math
+import secrets
+import sys
+from collections import Counter
+
+from alphabet import Alphabet
+from settings import DISTRIBUTION_ALPHA, DISTRIBUTION_CHUNK_SIZE, DISTRIBUTION_SAMPLES, FIXED_LEN, USE_NUMPY
+
+# Ways of generating the same passwords, whose distributions are compared. 'reference' is the original generation
+# path, one secrets.choice() of a group and of a character from it for each character, followed by the same repairs.
+# 'default' is the generator as configured, 'python' and 'numpy' draw characters from a new Alphabet with and without
+# NumPy, and 'direct' builds passwords with ConstrainedSampler, which is only expected to match the others with the
+# 'uniform' distribution, as it makes every valid password equally likely.
+ENGINES = ['reference', 'default', 'python', 'numpy', 'direct']
+DEFAULT_ENGINES = ['reference', 'default']
+
+# Smallest expected count of a cell of a chi-square test. Smaller cells are pooled together.
+MIN_EXPECTED = 5
+
+# Number of different characters, used to pack a position or a previous character and a character in one integer.
+CODE_POINTS = sys.maxunicode + 1
+
+_EPSILON = 1e-15
+_TINY = 1e-300
+_MAX_ITERATIONS = 100000
+
+
+def chi_square_sf(statistic, df):
+	"""
+	Returns the probability that a chi-square distributed variable with df degrees of freedom is at least statistic,
+	i.e. the p-value of a chi-square test. Computed as the regularized upper incomplete gamma function Q(df/2, x/2),
+	by its series below a + 1 and by its continued fraction above.
+
+	Args:
+		statistic (float): Value of the chi-square statistic.
+		df (int): Degrees of freedom.
+	"""
+	if df <= 0:
+		raise ValueError('The degrees of freedom must be positive.')
+	if statistic <= 0:
+		return 1.0
+	if math.isinf(statistic):
+		return 0.0
+
+	a = df / 2
+	x = statistic / 2
+	scale = math.exp(a * math.log(x) - x - math.lgamma(a))
+
+	if x < a + 1:
+		term = total = 1 / a
+		for n in range(1, _MAX_ITERATIONS):
+			term *= x / (a + n)
+			total += term
+			if abs(term) < abs(total) * _EPSILON:
+				break
+		return max(0.0, 1.0 - total * scale)
+
+	# Modified Lentz's method.
+	b = x + 1 - a
+	c = 1 / _TINY
+	d = 1 / b
+	result = d
+	for n in range(1, _MAX_ITERATIONS):
+		an = -n * (n - a)
+		b += 2
+		d = an * d + b
+		d = d if abs(d) > _TINY else _TINY
+		c = b + an / c
+		c = c if abs(c) > _TINY else _TINY
+		d = 1 / d
+		delta = d * c
+		result *= delta
+		if abs(delta - 1) < _EPSILON:
+			break
+	return min(1.0, result * scale)
+
+
+def chi_square(columns):
+	"""
+	Returns the (statistic, degrees of freedom) of a chi-square test, or None if fewer than 2 columns are left.
+	Columns whose expected counts are below MIN_EXPECTED are pooled into one, which is merged with the smallest
+	other column if it is still too small.
+
+	Args:
+		columns (list): (observed, expected) pairs of tuples of counts, one count for each row of the column.
+						A goodness of fit test has a single row, a homogeneity test one row for each sample.
+	"""
+	kept = []
+	pooled = None
+
+	for observed, expected in columns:
+		if any(o > 0 and e <= 0 for o, e in zip(observed, expected)):
+			# Something that should never happen happened, which no pooling should hide.
+			return math.inf, max(len(columns) - 1, 1)
+		if min(expected) >= MIN_EXPECTED:
+			kept.append((observed, expected))
+		elif pooled is None:
+			pooled = (list(observed), list(expected))
+		else:
+			for row in range(len(observed)):
+				pooled[0][row] += observed[row]
+				pooled[1][row] += expected[row]
+
+	if pooled is not None:
+		if min(pooled[1]) >= MIN_EXPECTED or not kept:
+			kept.append(pooled)
+		else:
+			smallest = min(range(len(kept)), key=lambda index: sum(kept[index][1]))
+			observed, expected = kept[smallest]
+			kept[smallest] = ([o + p for o, p in zip(observed, pooled[0])], [e + p for e, p in zip(expected, pooled[1])])
+
+	if len(kept) < 2:
+		return None
+
+	statistic = 0.0
+	for observed, expected in kept:
+		for o, e in zip(observed, expected):
+			if e > 0:
+				statistic += (o - e) ** 2 / e
+
+	rows = len(kept[0][0])
+	return statistic, (len(kept) - 1) * max(rows - 1, 1)
+
+
+class FrequencyCounts:
+	"""
+	Counts of the lengths, characters, characters at each position and pairs of consecutive characters (bigrams) of a
+	stream of passwords. Passwords are counted a chunk at a time and then dropped, so memory only grows with the
+	number of distinct characters. With NumPy, each chunk is counted with array operations over the code points of
+	its characters, without a Python loop over the characters.
+	"""
+
+	def __init__(self, use_numpy=USE_NUMPY):
+		"""
+		Args:
+			use_numpy (bool): Determines if NumPy, when it is installed, is used to count the passwords.
+		"""
+		self.passwords = 0
+		self.lengths = Counter()
+		self.chars = Counter()
+		# Counter of the characters at each position.
+		self.positions = []
+		self.bigrams = Counter()
+
+		self._numpy = None
+		if use_numpy:
+			try:
+				import numpy
+				self._numpy = numpy
+			except ImportError:
+				pass
+
+	def consume(self, build, count, chunk_size=DISTRIBUTION_CHUNK_SIZE):
+		"""
+		Counts count passwords made with build(), chunk_size at a time. Returns self.
+
+		Args:
+			build (callable): Function returning a single password.
+			count (int): Number of passwords.
+			chunk_size (int): Number of passwords kept in memory at a time.
+		"""
+		while count > 0:
+			size = min(count, chunk_size)
+			self.update([build() for _ in range(size)])
+			count -= size
+		return self
+
+	def update(self, passwords):
+		"""
+		Counts a list of passwords.
+		"""
+		if not passwords:
+			return
+
+		self.passwords += len(passwords)
+		self.lengths.update(map(len, passwords))
+
+		longest = max(self.lengths)
+		while len(self.positions) < longest:
+			self.positions.append(Counter())
+
+		if self._numpy is not None:
+			self._update_numpy(passwords)
+			return
+
+		self.chars.update(''.join(passwords))
+		for position, counts in enumerate(self.positions):
+			counts.update(''.join(password[position:position + 1] for password in passwords))
+		self.bigrams.update(password[index:index + 2] for password in passwords for index in range(len(password) - 1))
+
+	def _update_numpy(self, passwords):
+		numpy = self._numpy
+		codes = numpy.frombuffer(''.join(passwords).encode('utf-32-le'), dtype='<u4').astype(numpy.int64)
+		lengths = numpy.fromiter(map(len, passwords), dtype=numpy.int64, count=len(passwords))
+		starts = numpy.cumsum(lengths) - lengths
+		positions = numpy.arange(len(codes), dtype=numpy.int64) - numpy.repeat(starts, lengths)
+
+		for code, count in self._unique(codes):
+			self.chars[chr(code)] += count
+
+		for key, count in self._unique(positions * CODE_POINTS + codes):
+			position, code = divmod(key, CODE_POINTS)
+			self.positions[position][chr(code)] += count
+
+		# Pairs whose second character starts a password span two passwords.
+		inside = positions[1:] > 0
+		for key, count in self._unique(codes[:-1][inside] * CODE_POINTS + codes[1:][inside]):
+			first, second = divmod(key, CODE_POINTS)
+			self.bigrams[chr(first) + chr(second)] += count
+
+	def _unique(self, keys):
+		values, counts = self._numpy.unique(keys, return_counts=True)
+		return zip(values.tolist(), counts.tolist())
+
+	def samples(self):
+		"""
+		Returns each tested frequency, ('lengths', 'characters', 'position 0', ... and 'bigrams'), mapped to its counts.
+		"""
+		samples = {'lengths': self.lengths, 'characters': self.chars}
+		for position, counts in enumerate(self.positions):
+			samples[f'position {position}'] = counts
+		samples['bigrams'] = self.bigrams
+		return samples
+
+
+def goodness_of_fit(counts, probabilities, lengths=None):
+	"""
+	Returns (name, statistic, df) for each frequency of counts whose test has at least 2 columns, tested against
+	independent characters drawn with the given probabilities.
+
+	Args:
+		counts (FrequencyCounts): Counted passwords.
+		probabilities (dict): Probability of each character.
+		lengths (dict): Probability of each password length. If not defined, lengths are not tested.
+	"""
+	expected = {'characters': probabilities}
+	if lengths is not None:
+		expected['lengths'] = lengths
+	for position in range(len(counts.positions)):
+		expected[f'position {position}'] = probabilities
+	expected['bigrams'] = {first + second: p * q for first, p in probabilities.items()
+						   for second, q in probabilities.items()}
+
+	tests = []
+	for name, observed in counts.samples().items():
+		if name not in expected:
+			continue
+
+		total = sum(observed.values())
+		keys = set(expected[name]) | set(observed)
+		result = chi_square([((observed.get(key, 0),), (total * expected[name].get(key, 0.0),)) for key in keys])
+		if result is not None:
+			tests.append((name,) + result)
+
+	return tests
+
+
+def homogeneity(baseline, candidate):
+	"""
+	Returns (name, statistic, df) for each frequency whose test has at least 2 columns, testing if the passwords
+	counted in baseline and in candidate come from the same distribution.
+
+	Args:
+		baseline (FrequencyCounts): Passwords of the reference engine.
+		candidate (FrequencyCounts): Passwords of the tested engine.
+	"""
+	candidate_samples = candidate.samples()
+	tests = []
+
+	for name, first in baseline.samples().items():
+		second = candidate_samples.get(name, Counter())
+		first_total = sum(first.values())
+		second_total = sum(second.values())
+		if not first_total or not second_total:
+			continue
+
+		columns = []
+		for key in set(first) | set(second):
+			observed = (first.get(key, 0), second.get(key, 0))
+			share = sum(observed) / (first_total + second_total)
+			columns.append((observed, (first_total * share, second_total * share)))
+
+		result = chi_square(columns)
+		if result is not None:
+			tests.append((name,) + result)
+
+	return tests
+
+
+class DistributionReport:
+	"""
+	Results of the chi-square tests of a distribution check. The check passes when every p-value is at least
+	alpha / len(self.tests), so that a correct engine fails with a probability of at most alpha (Bonferroni).
+	"""
+
+	def __init__(self, samples, engines, tests, alpha=DISTRIBUTION_ALPHA):
+		"""
+		Args:
+			samples (int): Number of passwords generated by each engine.
+			engines (list): Names of the engines.
+			tests (list): (name, statistic, df) of each test.
+			alpha (float): Significance level of all the tests together.
+		"""
+		self.samples = samples
+		self.engines = list(engines)
+		self.alpha = alpha
+		self.tests = [(name, statistic, df, chi_square_sf(statistic, df)) for name, statistic, df in tests]
+
+	@property
+	def threshold(self):
+		"""
+		Smallest p-value of a test which passes.
+		"""
+		return self.alpha / max(len(self.tests), 1)
+
+	@property
+	def failures(self):
+		"""
+		Tests whose p-value is below self.threshold.
+		"""
+		return [test for test in self.tests if test[3] < self.threshold]
+
+	@property
+	def passed(self):
+		return not self.failures
+
+	def to_dict(self):
+		return {
+			'samples': self.samples,
+			'engines': self.engines,
+			'alpha': self.alpha,
+			'threshold': self.threshold,
+			'passed': self.passed,
+			'tests': [{'name': name, 'statistic': statistic, 'df': df, 'p_value': p_value}
+					  for name, statistic, df, p_value in self.tests],
+		}
+
+	def __str__(self):
+		lines = [f"{self.samples} passwords from each of {', '.join(self.engines)}: "
+				 f"{'GO' if self.passed else 'NO-GO'} (every p-value must be at least {self.threshold:.3g})"]
+		for name, statistic, df, p_value in self.tests:
+			flag = '  FAIL' if p_value < self.threshold else ''
+			lines.append(f'{name:<50} chi2 {statistic:>12.2f}  df {df:>6}  p {p_value:.4f}{flag}')
+		return '\n'.join(lines)
+
+
+def _reference_random(usable_chars, distribution):
+	# The original generate_random(): a group, then a character from it, each with its own secrets.choice().
+	groups = [group for group in usable_chars if group]
+	if distribution == 'groups':
+		return lambda pass_length: [secrets.choice(secrets.choice(groups)) for _ in range(pass_length)]
+
+	chars = list(dict.fromkeys(char for group in groups for char in group))
+	return lambda pass_length: [secrets.choice(chars) for _ in range(pass_length)]
+
+
+def get_engine(generator, engine):
+	"""
+	Returns a PyPass generating the same passwords as generator, by the given engine (see ENGINES).
+
+	Args:
+		generator (PyPass): Configured generator.
+		engine (str): One of ENGINES.
+	"""
+	from password import PyPass
+
+	if engine not in ENGINES:
+		raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}.")
+	if engine == 'default':
+		return generator
+	if engine == 'direct':
+		return PyPass(**dict(generator.options, direct_sampling=True))
+
+	engine_generator = PyPass(**dict(generator.options, direct_sampling=False))
+	distribution = generator.policy.char_distribution
+
+	if engine == 'reference':
+		engine_generator.generate_random = _reference_random(generator.usable_chars, distribution)
+	elif engine == 'python':
+		engine_generator.alphabet = Alphabet(generator.usable_chars, distribution=distribution, use_numpy=False)
+	else:
+		if importlib.util.find_spec('numpy') is None:
+			raise ImportError("The 'numpy' engine needs NumPy to be installed.")
+		engine_generator.alphabet = Alphabet(generator.usable_chars, distribution=distribution, use_numpy=True)
+
+	return engine_generator
+
+
+def check_distribution(generator, samples=DISTRIBUTION_SAMPLES, engines=DEFAULT_ENGINES, alpha=DISTRIBUTION_ALPHA,
+					   chunk_size=DISTRIBUTION_CHUNK_SIZE, human=False, remove_repeating=False, remove_english=False,
+					   check_proportions=False, fixed_len=FIXED_LEN):
+	"""
+	Generates samples passwords with each engine and tests their lengths, characters, characters at each position
+	and bigrams with chi-square tests. Every engine is tested for homogeneity with the first one. Without any rules,
+	each engine is also tested for goodness of fit to independent characters drawn from generator.alphabet, or
+	uniformly with direct sampling, and to equally likely lengths. Breaches are not checked. Returns a
+	DistributionReport.
+
+	Args:
+		generator (PyPass): Configured generator.
+		samples (int): Number of passwords generated by each engine.
+		engines (list): Names of the engines, from ENGINES.
+		alpha (float): Significance level of all the tests together.
+		chunk_size (int): Number of passwords kept in memory at a time.
+		human (bool): Determines if the passwords follow the rules of generate_human_password().
+		remove_repeating (bool): Determines if consecutive duplicate chars are removed.
+		remove_english (bool): Determines if English words are removed.
+		check_proportions (bool): Determines if at least one char from each list in usable_chars is used.
+		fixed_len (int): Fixed length of the passwords.
+	"""
+	if not engines:
+		raise ValueError('At least one engine is needed.')
+
+	counts = {}
+	for engine in engines:
+		engine_generator = get_engine(generator, engine)
+		if human:
+			build = lambda: engine_generator.build_human_password(fixed_len=fixed_len)
+		else:
+			build = lambda: engine_generator.build_password(remove_repeating=remove_repeating,
+															remove_english=remove_english,
+															check_proportions=check_proportions, fixed_len=fixed_len)
+		counts[engine] = FrequencyCounts().consume(build, samples, chunk_size)
+
+	tests = []
+
+	# Excluded words are still removed, but they are rare enough not to show in the character frequencies.
+	if not (human or remove_repeating or remove_english or check_proportions):
+		alphabet = generator.alphabet
+		lengths = [fixed_len] if fixed_len else generator.policy.lengths
+		lengths = {length: 1 / len(lengths) for length in lengths}
+
+		for engine, engine_counts in counts.items():
+			if engine == 'direct' or engine == 'default' and generator.direct_sampling:
+				probabilities = {char: 1 / len(alphabet) for char in alphabet.chars}
+			else:
+				probabilities = {char: alphabet.probability(char) for char in alphabet.chars}
+			tests.extend((f'{name} [{engine}]', statistic, df)
+						 for name, statistic, df in goodness_of_fit(engine_counts, probabilities, lengths))
+
+	baseline = engines[0]
+	for engine in engines[1:]:
+		tests.extend((f'{name} [{engine} vs {baseline}]', statistic, df)
+					 for name, statistic, df in homogeneity(counts[baseline], counts[engine]))
+
+	return DistributionReport(samples, engines, tests, alpha)
@@ -0,0 +1,447 @@
+import math
+import string
+from functools import lru_cache
+
+from settings import FIXED_LEN, POLICY_CACHE_SIZE
+
+# Longest run of letters in the passwords counted for the lower bounds of remove_english. English words of more than
+# 3 letters are only looked for in longer runs, so passwords without them keep all their words.
+ENGLISH_FREE_RUN = 3
+
+
+def _bits(count):
+	# Entropy in bits of a uniform choice among count passwords.
+	return math.log2(count) if count > 0 else 0.0
+
+
+def _binary_entropy(probability):
+	if probability <= 0.0 or probability >= 1.0:
+		return 0.0
+	return -probability * math.log2(probability) - (1 - probability) * math.log2(1 - probability)
+
+
+class Entropy:
+	"""
+	Strength of a generator configuration: the Shannon entropy and min-entropy of its passwords in bits, and its
+	keyspace, the number of different passwords it can generate. Each is a (lower, upper) pair of bounds, which are
+	equal when the value is exact. min_entropy is None when no bound is known.
+
+		print(PyPass(direct_sampling=True).entropy(human=True))
+	"""
+
+	def __init__(self, mode, lengths, entropy, keyspace, min_entropy=None, by_length=None):
+		"""
+		Args:
+			mode (str): Description of the generation mode.
+			lengths (tuple): Password lengths, each equally likely. The number of words, for sentences.
+			entropy (tuple): Lower and upper bound of the Shannon entropy in bits.
+			keyspace (tuple): Lower and upper bound of the number of passwords.
+			min_entropy (tuple): Lower and upper bound of the min-entropy in bits, or None.
+			by_length (dict): Lower and upper bound of the entropy of the passwords of each length.
+		"""
+		self.mode = mode
+		self.lengths = tuple(lengths)
+		self.entropy = entropy
+		self.keyspace = keyspace
+		self.min_entropy = min_entropy
+		self.by_length = by_length or {}
+
+	@property
+	def exact(self):
+		return self.entropy[0] == self.entropy[1]
+
+	def to_dict(self):
+		return {
+			'mode': self.mode,
+			'lengths': list(self.lengths),
+			'exact': self.exact,
+			'entropy': list(self.entropy),
+			'min_entropy': list(self.min_entropy) if self.min_entropy is not None else None,
+			'keyspace': list(self.keyspace),
+			'by_length': {str(length): list(bounds) for length, bounds in self.by_length.items()},
+		}
+
+	@staticmethod
+	def format_bounds(bounds, template='{:.2f} bits'):
+		lower, upper = (template.format(bound) for bound in bounds)
+		if bounds[0] == bounds[1]:
+			return f'{lower} (exact)'
+		if lower == upper:
+			return f'{lower} (bounds closer than shown)'
+		if bounds[0] <= 0:
+			return f'at most {upper}'
+		return f'between {lower} and {upper}'
+
+	def __str__(self):
+		if self.mode == 'sentences':
+			description = f'sentences of {self.lengths[0]} words'
+		elif len(self.lengths) == 1:
+			description = f'{self.mode}, length {self.lengths[0]}'
+		else:
+			description = f'{self.mode}, lengths {self.lengths[0]} to {self.lengths[-1]}'
+
+		lines = [
+			f'Mode:        {description}',
+			f'Entropy:     {self.format_bounds(self.entropy)}',
+		]
+		if self.min_entropy is not None:
+			lines.append(f'Min-entropy: {self.format_bounds(self.min_entropy)}')
+		lines.append(f'Keyspace:    {self.format_bounds(tuple(map(_bits, self.keyspace)), "2^{:.2f} passwords")}')
+		return '\n'.join(lines)
+
+
+class KeyspaceCounter:
+	"""
+	Counts the passwords of each length satisfying a set of rules, by dynamic programming over the same constraint
+	automaton ConstrainedSampler builds passwords with: the usable_chars groups already used, the class of the
+	previous character and the node of the excluded words automaton. When the length of letter runs is limited, the
+	current run is followed as well.
+
+	Characters are split into classes of characters which are interchangeable for every rule: they belong to the
+	same groups, normalize to the same character of the excluded words (or to none of them) and are all letters or
+	all not. Each class is followed as a whole, so a step costs the number of classes, not of characters.
+
+	Along with the number of passwords, the counter sums the probability of drawing them one character at a time
+	from the alphabet, and their surprisal weighted by that probability, from which password_entropy() derives the
+	entropy of passwords drawn at random and kept when they satisfy the rules.
+	"""
+
+	def __init__(self, usable_chars, probabilities, matcher=None, no_repeats=False, all_groups=False,
+				 max_letter_run=None):
+		"""
+		Args:
+			usable_chars (list): List of lists of characters to be used in password generation.
+			probabilities (dict): Probability of drawing each character.
+			matcher (WordMatcher): Excluded words, which may not appear in the passwords.
+			no_repeats (bool): Determines if the same character may not follow itself.
+			all_groups (bool): Determines if each non-empty list of usable_chars must be used at least once.
+			max_letter_run (int): Largest number of consecutive letters, or None for no limit.
+		"""
+		groups = [group for group in usable_chars if group]
+		if not groups:
+			raise ValueError('No usable characters.')
+
+		masks = {}
+		for index, group in enumerate(groups):
+			for char in group:
+				masks[str(char)] = masks.get(str(char), 0) | 1 << index
+
+		self.matcher = matcher if matcher else None
+		word_chars = self.matcher.chars if self.matcher is not None else frozenset()
+
+		classes = {}
+		for char, mask in masks.items():
+			normalized = self.matcher.normalize(char) if self.matcher is not None else char
+			letter = max_letter_run is not None and char in string.ascii_letters
+			classes.setdefault((mask, normalized if normalized in word_chars else None, letter), []).append(char)
+
+		# Mask, size, probability of each character, whether they are letters, a character and the surprisal of
+		# each character, for each class. Characters of a class always weigh the same.
+		self.classes = [(mask, len(chars), probabilities[chars[0]], letter, chars[0],
+						 -math.log2(probabilities[chars[0]])) for (mask, normalized, letter), chars in classes.items()]
+
+		self.full_mask = (1 << len(groups)) - 1
+		self.no_repeats = no_repeats
+		self.all_groups = all_groups
+		self.max_letter_run = max_letter_run
+
+		self.by_char = {}
+		for index, (mask, normalized, letter) in enumerate(classes):
+			self.by_char.setdefault(normalized, []).append(index)
+
+		# Nodes of the automaton, parents first.
+		self.order = [0]
+		for node in self.order:
+			self.order.extend(self.children(node).values())
+
+		self._suffix_targets = {}
+
+	def children(self, node):
+		return self.matcher.children(node) if self.matcher is not None else {}
+
+	def count(self, max_length):
+		"""
+		Returns a list with a (count, probability, moment) tuple for each length from 0 to max_length: the number of
+		passwords satisfying the rules, the probability that a random password satisfies them, and the sum over the
+		passwords of their probability times their surprisal, -log2 of the probability.
+
+		Args:
+			max_length (int): Length of the longest passwords.
+		"""
+		# Values of each node of the automaton, by (groups used, class of the previous character, letters in the
+		# current run). Parts which no rule depends on are always 0, so states which only differ by them are merged.
+		states = {0: {(0, -1, 0): (1, 1.0, 0.0)}}
+		results = []
+
+		for length in range(max_length + 1):
+			total = [0, 0.0, 0.0]
+			for substates in states.values():
+				for (used, last, run), values in substates.items():
+					if not self.all_groups or used == self.full_mask:
+						for index in range(3):
+							total[index] += values[index]
+			results.append(tuple(total))
+
+			if length < max_length:
+				states = self.step(states)
+
+		return results
+
+	def step(self, states):
+		"""
+		Returns the values of the states reached by adding a character to the passwords of states.
+
+		Reading a character which doesn't continue a word from a node leads where it leads from the node's suffix,
+		so instead of following every class from every node, the values of each node are added to its suffix, down
+		to node 0, which follows every class. Each node then only corrects the classes continuing its words: their
+		values go to the node's children rather than to where the suffix leads. This costs the number of nodes and
+		edges of the automaton, rather than the number of nodes times the number of classes.
+		"""
+		carried = dict(states)
+		for node in reversed(self.order[1:]):
+			if node in carried:
+				suffix = self.matcher.suffix(node)
+				carried[suffix] = self._merge(carried.get(suffix), carried[node])
+
+		next_states = {}
+		other_chars = [index for normalized, indexes in self.by_char.items() if normalized not in self.children(0)
+					   for index in indexes]
+		for node, substates in carried.items():
+			# Every character of a class can follow any previous class, except the previous character itself, so
+			# values are summed over the previous class first, and the previous character taken back from its class.
+			sums = {}
+			for (used, last, run), values in substates.items():
+				existing = sums.get((used, run))
+				sums[(used, run)] = values if existing is None else tuple(a + b for a, b in zip(existing, values))
+
+			if node == 0:
+				self._add(next_states, 0, sums, substates, other_chars, 1)
+
+			for char, child in self.children(node).items():
+				indexes = self.by_char.get(char)
+				if indexes is None:
+					continue
+
+				self._add(next_states, child, sums, substates, indexes, 1)
+				if node:
+					self._add(next_states, self._suffix_target(node, char), sums, substates, indexes, -1)
+
+		# Differences may leave states no password reaches.
+		return {node: {key: values for key, values in substates.items() if values[0]}
+				for node, substates in next_states.items() if any(values[0] for values in substates.values())}
+
+	def _suffix_target(self, node, char):
+		# Node reached by reading char from the suffix of node.
+		key = (node, char)
+		if key not in self._suffix_targets:
+			self._suffix_targets[key] = self.matcher.advance(self.matcher.suffix(node), char)
+		return self._suffix_targets[key]
+
+	@staticmethod
+	def _merge(substates, other):
+		if not substates:
+			return other
+
+		merged = dict(substates)
+		for key, values in other.items():
+			existing = merged.get(key)
+			merged[key] = values if existing is None else tuple(a + b for a, b in zip(existing, values))
+		return merged
+
+	def _add(self, next_states, node, sums, substates, indexes, sign):
+		# Adds sign times the values of substates, followed by each of the classes, to node. sums holds the values
+		# summed over the previous class.
+		if self.matcher is not None and self.matcher.is_match(node):
+			return
+
+		target = next_states.setdefault(node, {})
+		for (used, run), values in sums.items():
+			for index in indexes:
+				self._push(target, used, run, values, index, sign * self.classes[index][1])
+
+		if self.no_repeats:
+			indexes = set(indexes)
+			for (used, last, run), values in substates.items():
+				if last in indexes:
+					self._push(target, used, run, values, last, -sign)
+
+	def _push(self, target, used, run, values, index, choices):
+		# Adds the values of choices characters of a class following a state to target.
+		mask, size, probability, letter, char, surprisal = self.classes[index]
+
+		next_run = run + 1 if letter else 0
+		if self.max_letter_run is not None and next_run > self.max_letter_run:
+			return
+
+		count, mass, moment = values
+		key = (used | mask if self.all_groups else 0, index if self.no_repeats else -1, next_run)
+		weight = choices * probability
+		existing = target.get(key, (0, 0.0, 0.0))
+		target[key] = (existing[0] + choices * count, existing[1] + weight * mass,
+					   existing[2] + weight * (moment + mass * surprisal))
+
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def count_passwords(policy, no_repeats, all_groups, max_letter_run, max_length):
+	"""
+	Returns KeyspaceCounter.count() for the characters and excluded words of a policy, computed once for each set of
+	rules, as long as it stays among the most recently used ones.
+	"""
+	probabilities = {char: policy.alphabet.probability(char) for char in policy.alphabet.chars}
+	counter = KeyspaceCounter(policy.usable_chars, probabilities, matcher=policy.excluded_matcher,
+							  no_repeats=no_repeats, all_groups=all_groups, max_letter_run=max_letter_run)
+	return tuple(counter.count(max_length))
+
+
+def password_entropy(policy, human=False, remove_repeating=False, remove_english=False, check_proportions=False,
+					 fixed_len=FIXED_LEN, direct_sampling=False):
+	"""
+	Returns the Entropy of the passwords PyPass generates with a policy and a set of rules, as given to
+	iter_passwords(). Lengths are picked uniformly, so the entropy is that of the length plus the average entropy of
+	the passwords of each length. Breach checks and unique only remove a negligible number of passwords and are not
+	counted.
+
+	With direct_sampling, passwords are uniformly distributed over the passwords satisfying the rules, so the entropy
+	is exact. English words can't be counted exactly: passwords without 4 consecutive letters give a lower bound and
+	passwords with any letters an upper bound.
+
+	Otherwise passwords are drawn from the alphabet and repaired. A drawn password satisfying all the rules, with
+	probability p, is kept as it is, so the entropy of the passwords of each length is at least p times the entropy
+	of the drawn passwords satisfying the rules, and at most that plus (1 - p) times the entropy of a uniform choice
+	among all the passwords the repairs can lead to, plus the binary entropy of p. The bounds are tight when few
+	passwords need repairs; direct sampling should be used where an exact value is needed.
+
+	Args:
+		policy (PasswordPolicy): Characters, excluded words and lengths of the passwords.
+		human (bool): Determines if passwords are generated like generate_human_password(), with all the rules.
+		remove_repeating (bool): Determines if consecutive duplicate chars are removed.
+		remove_english (bool): Determines if English words are removed.
+		check_proportions (bool): Determines if at least one char from each list in usable_chars is used.
+		fixed_len (int): Fixed length of the passwords.
+		direct_sampling (bool): Determines if passwords are built with ConstrainedSampler.
+	"""
+	if human:
+		remove_repeating = remove_english = check_proportions = True
+
+	remove_repeating, remove_english, check_proportions = map(bool, (remove_repeating, remove_english,
+																	 check_proportions))
+	lengths = (int(fixed_len),) if fixed_len else policy.lengths
+	max_length = max(lengths)
+
+	# Passwords satisfying every rule, and with no English words for sure if those are removed.
+	strict = count_passwords(policy, remove_repeating, check_proportions,
+							 ENGLISH_FREE_RUN if remove_english else None, max_length)
+
+	if direct_sampling:
+		loose = count_passwords(policy, remove_repeating, check_proportions, None, max_length) \
+			if remove_english else strict
+	else:
+		# Repairs may leave consecutive duplicates and English words, but never excluded words or missing groups.
+		loose = count_passwords(policy, False, check_proportions, None, max_length)
+
+	by_length = {}
+	for length in lengths:
+		if loose[length][0] == 0:
+			raise ValueError(f'No password of length {length} satisfies the rules.')
+
+		if direct_sampling:
+			by_length[length] = (_bits(strict[length][0]), _bits(loose[length][0]))
+			continue
+
+		count, probability, moment = strict[length]
+		kept = moment + probability * math.log2(probability) if probability > 0 else 0.0
+		upper = kept + (1 - probability) * _bits(loose[length][0]) + _binary_entropy(probability)
+		by_length[length] = (kept, min(upper, _bits(loose[length][0])))
+
+	length_bits = math.log2(len(lengths))
+	entropy = tuple(length_bits + sum(bounds[side] for bounds in by_length.values()) / len(lengths)
+					for side in (0, 1))
+	keyspace = (sum(strict[length][0] for length in lengths), sum(loose[length][0] for length in lengths))
+
+	min_entropy = None
+	if direct_sampling:
+		# The most likely passwords are those of the length with the fewest passwords.
+		min_entropy = (length_bits + min(by_length[length][0] for length in lengths),
+					   length_bits + min(by_length[length][1] for length in lengths))
+
+	rules = [name for name, enabled in (('human', human), ('remove_repeating', remove_repeating and not human),
+										('remove_english', remove_english and not human),
+										('check_proportions', check_proportions and not human)) if enabled]
+	mode = ', '.join(['direct sampling' if direct_sampling else 'random'] + rules)
+
+	return Entropy(mode, lengths, entropy, keyspace, min_entropy, by_length)
+
+
+def _following(model, context):
+	# Returns the words following a context, with their probabilities, and the probability that the sentence ends,
+	# after which a new sentence is started.
+	row = model.row(*context)
+	if row is None:
+		return [], 1.0
+
+	start, end = row
+	total = model.cumulative_counts[end - 1]
+	previous = 0
+	words = []
+	reset = 0.0
+
+	for position in range(start, end):
+		count = model.cumulative_counts[position] - previous
+		previous = model.cumulative_counts[position]
+		if model.next_ids[position] == model.end_id:
+			reset = count / total
+		else:
+			words.append((model.next_ids[position], count / total))
+
+	return words, reset
+
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def sentence_entropy(model, words):
+	"""
+	Returns the Entropy of sentences of a number of words drawn from a trigram model, as Language.sample_sentence()
+	draws them. The distribution of the context of each word is followed word by word, and the entropy of the next
+	word, or of the end of the sentence followed by the first word of a new one, is added up. Sentences are made from
+	these words, with special characters removed and cut to their maximum length, so this is an upper bound.
+
+	Args:
+		model (CompactTrigramModel): Model the words are drawn from.
+		words (int): Number of words drawn for each sentence.
+	"""
+	start = (model.start_id, model.start_id)
+	first_words, end = _following(model, start)
+	if not first_words:
+		raise ValueError('The model holds no sentences.')
+	first_words = [(word_id, probability / (1 - end)) for word_id, probability in first_words]
+
+	outcomes = {}
+
+	def next_words(context):
+		# Next contexts and their probabilities, with the entropy of the choice between them.
+		if context not in outcomes:
+			if context == start:
+				following = [((context[1], word_id), probability) for word_id, probability in first_words]
+			else:
+				following, reset = _following(model, context)
+				following = [((context[1], word_id), probability) for word_id, probability in following]
+				following += [((model.start_id, word_id), reset * probability) for word_id, probability in first_words
+							  if reset > 0]
+			outcomes[context] = (following, -sum(probability * math.log2(probability)
+												   for _, probability in following if probability > 0))
+		return outcomes[context]
+
+	contexts = {start: (1.0, 1)}
+	entropy = 0.0
+
+	for position in range(words):
+		next_contexts = {}
+		for context, (mass, count) in contexts.items():
+			following, bits = next_words(context)
+			entropy += mass * bits
+			for next_context, probability in following:
+				next_mass, next_count = next_contexts.get(next_context, (0.0, 0))
+				next_contexts[next_context] = (next_mass + mass * probability, next_count + count)
+		contexts = next_contexts
+
+	keyspace = sum(count for mass, count in contexts.values())
+	return Entropy('sentences', (words,), (0.0, entropy), (0, keyspace), by_length={words: (0.0, entropy)})
@@ -1,12 +1,28 @@
 import os
 import re
+import sys
+import threading
 import _pickle as pickle
-from datetime import datetime, timedelta
+from collections import Counter
 
-import nltk
-from pyhibp import pwnedpasswords as pw
+from breach import get_breach_checker
+from randomness import SYSTEM_RANDOMNESS
+from trigram import CompactTrigramModel
+from settings import ROOT_DIR, MODEL_DIR, TEMPLATE_DIR, MIN_PASS_LEN, EXCLUDED_WORDS, MAX_PASS_LEN, MIN_SENT_LENGTH, \
+	MAX_ATTEMPTS, MODEL_FORMATS
 
-from settings import ROOT_DIR, MODEL_DIR, TEMPLATE_DIR, MIN_PASS_LEN, EXCLUDED_WORDS, MAX_PASS_LEN
+
+# Compact models shared by all Language instances of the process. Keyed by library name, each entry also holds the
+# modification time of the file it was loaded from, so changed files are loaded again.
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+
+def _mtime(path):
+	try:
+		return os.stat(path).st_mtime_ns
+	except FileNotFoundError:
+		return None
 
 
 class ModelManager:
@@ -29,21 +45,38 @@ class ModelManager:
 		Args:
 			model (nltk.lm.MLE instance): trigram model to be saved.
 		"""
-		print(f'Saving model {self.library_name} to {self.library_name}.pk.')
+		print(f'Saving model {self.library_name} to {self.library_name}.pk.', file=sys.stderr)
 
 		with open(f"{MODEL_DIR}/{self.library_name}.pk", 'wb') as f:
 			pickle.dump(model, f)
 		
-		print(f'Model {self.library_name} saved to {self.library_name}.pk.')		
+		print(f'Model {self.library_name} saved to {self.library_name}.pk.', file=sys.stderr)		
 
-	def make_model(self, source):
+	def save_compact(self, model):
+		"""
+		Saves a compact trigram model, which can be memory-mapped, to a .tg file.
+
+		Args:
+			model (CompactTrigramModel instance): trigram model to be saved.
+		"""
+		print(f'Saving model {self.library_name} to {self.library_name}.tg.', file=sys.stderr)
+
+		model.save(os.path.join(MODEL_DIR, self.library_name + '.tg'))
+
+		print(f'Model {self.library_name} saved to {self.library_name}.tg.', file=sys.stderr)
+
+	def make_model(self, source, model_formats=MODEL_FORMATS):
 		"""
 		Generates an nltk trigram model based on a custom text file or already available nltk array of words.
 
 		Args:
 			source (str): Determines if the ModelManager will look for a local text file of an nltk resource.
+			model_formats (list): Formats of the models to be saved, 'pickle' for a pickled nltk.lm.MLE model and
+								  'compact' for a CompactTrigramModel.
 		"""
 
+		import nltk
+
 		# Source is considered to be a local text file.
 		if source == 'l':
 			words = self.read_words_from_text(f'{TEMPLATE_DIR}/{self.library_name}.txt')
@@ -57,14 +90,24 @@ class ModelManager:
 		else:
 			raise ValueError(f'Unknown source {source}')
 
+		if 'compact' in model_formats:
+			print(f'Generating compact model for library {self.library_name}.', file=sys.stderr)
+			# The compact model is made of words, as they are tokenized by nltk.Text when generating sentences.
+			tokens = [word for word in (words.split() if isinstance(words, str) else words) if word not in EXCLUDED_WORDS]
+			sentences = [sent.split(" ") for sent in nltk.sent_tokenize(" ".join(tokens))]
+			self.save_compact(CompactTrigramModel.from_sentences(sentences))
+
+		if 'pickle' not in model_formats:
+			return
+
 		# We will be using the nltk.Text class to generate the trigram model, as it already comes with a method to do this.
 		textClass = nltk.Text(words)
 
-		print('Tokenizing sentences')
+		print('Tokenizing sentences', file=sys.stderr)
 		# Tokenizing sentences means the frequency and relevance of words in a sentence are being determined and recorded.
 		_tokenized_sents = [sent.split(" ") for sent in nltk.sent_tokenize(" ".join(textClass.tokens))] 
 		
-		print(f'Generating model for library {self.library_name}.')
+		print(f'Generating model for library {self.library_name}.', file=sys.stderr)
 		# Trigrams proved most convenient. Could implement option to modify from settings in the future.
 		trigram_model = textClass._train_default_ngram_lm(_tokenized_sents, n=3)
 
@@ -73,9 +116,16 @@ class ModelManager:
 
 	def delete(self):
 		"""
-		Already existing pickle file will be deteleted.
+		Already existing pickle and compact model files will be deteleted.
 		"""
-		os.remove(os.path.join(MODEL_DIR, self.library_name + '.pk'))
+		paths = [os.path.join(MODEL_DIR, self.library_name + extension) for extension in ('.pk', '.tg')]
+		existing = [path for path in paths if os.path.exists(path)]
+
+		if not existing:
+			raise FileNotFoundError(f'No model files found for library {self.library_name}.')
+
+		for path in existing:
+			os.remove(path)
 
 	@staticmethod
 	def read_words_from_text(path_to_file):
@@ -97,7 +147,8 @@ class Language:
 	Class in charge of generating sentences based on nltk models.
 	"""
 
-	def __init__(self, library=None, min_sentence_length=None, max_sentence_length=None, check_breached=True, include_whitespace=True):
+	def __init__(self, library=None, min_sentence_length=None, max_sentence_length=None, check_breached=True, include_whitespace=True,
+				 breach_checker=None, max_attempts=MAX_ATTEMPTS, randomness=SYSTEM_RANDOMNESS):
 		"""
 		Args:
 			library (str): Name of the library to be used for generating sentences.
@@ -105,13 +156,29 @@ class Language:
 			max_sentence_length (int): Maximum length of the sentece to be generated.
 			check_breached (bool): Determines if the genreated sentences will be checked against breached passwords database.
 			include_whitespace (bool): Determines if white spaces will be removed from the generated sentences.
+			breach_checker (BreachChecker): Object used to check sentences against breached passwords. If not defined,
+											the one described by settings.py is used.
+			max_attempts (int): Maximum number of sentences generated by form_sentece() before it fails with a
+								RuntimeError.
+			randomness (SystemRandomness): Source the words are drawn from (see randomness.py). A SeededRandomness
+										   is only meant for tests and benchmarks.
 		"""
 		self.library_name = library
 		self.min_sentence_length = min_sentence_length or MIN_SENT_LENGTH
 		self.max_sentence_length = max_sentence_length or MAX_PASS_LEN
 		self.check_breached = check_breached
 		self.specials = list("""./,<>?\\';|":}{][=-+_)(*&^%$#@!~`""")
+		self.randomness = randomness
+
+		# Translation table removing special characters, and words of the last used model, without them.
+		self._specials_table = str.maketrans('', '', ''.join(self.specials))
+		self._clean_words = (None, {})
 		self.include_whitespace = include_whitespace
+		self.breach_checker = (breach_checker or get_breach_checker()) if check_breached else None
+		self.max_attempts = max_attempts
+
+		# Number of rejected sentences, by reason of rejection.
+		self.rejections = Counter()
 
 	@staticmethod
 	def format_words(words):
@@ -134,87 +201,123 @@ class Language:
 		with open(text_file, 'r') as f:
 			return [word for word in self.format_words(f.read()).split(' ') if word not in EXCLUDED_WORDS]
 
-	def get_words(self, library_name=None):
+	def get_model(self, library_name=None):
 		"""
-		Extracts words from nltk resources or custom text files.
+		Returns the compact trigram model of the library, memory-mapped from its .tg file, which is made first if
+		it doesn't exist. Models are loaded once per process and shared by all Language instances, until the file
+		changes.
 
 		Args:
 			library (str): Name of the nltk resources or custom text file to be used.
 		"""
 		library_name = library_name or self.library_name
+		model_path = os.path.join(MODEL_DIR, library_name + '.tg')
 
-		local_file_name = library_name + '.txt'
-		local_model_name = f"{MODEL_DIR}/{self.library_name}.pk"
-
-		# If the library is in local templates, proceed with extracting from text file.
-		if local_file_name in os.listdir(TEMPLATE_DIR):
-			# If a model does not exist, make one.
-			if local_model_name not in os.listdir(MODEL_DIR):
-				ModelManager(library_name).make_model('l')
+		with _model_cache_lock:
+			cached = _model_cache.get(library_name)
+			if cached is not None and cached[0] == _mtime(model_path):
+				return cached[1]
 
-			return self.read_words_from_text(os.path.join(TEMPLATE_DIR, local_file_name))
+			if not os.path.exists(model_path):
+				source = 'l' if os.path.exists(os.path.join(TEMPLATE_DIR, library_name + '.txt')) else 'nltk'
+				ModelManager(library_name).make_model(source, model_formats=['compact'])
 
-		# If no local template is provided, try locating an nltk resource.
-		try:
-			# Try if nltk library was already downloaded.
-			# If not, download and save a model.
-			words = getattr(nltk.corpus, library_name)
+			model = CompactTrigramModel.load(model_path)
+			_model_cache[library_name] = (_mtime(model_path), model)
+			return model
 
-		except AttributeError:
-			ModelManager(library_name).make_model('nltk')
-			words = getattr(nltk.corpus, library_name)
+	def form_sentece(self, library_name=None):
+		"""
+		Method for generating random sentences, taking into account params of this class instance.
 
-		return words.words()
+		Args:
+			library (str): Name of the library to be used. If not defined, the library of this instance is used.
+		"""
+		return self.form_sentences(1, library_name)[0]
 
-	def get_trigram(self, library_name=None):
+	def form_sentences(self, count, library_name=None):
 		"""
-		Loads already existing trigram model.
+		Generates count random sentences, taking into account params of this class instance. Sentences which are too
+		short, or breached, are replaced, until count sentences are accepted. At most count * self.max_attempts
+		sentences are generated.
 
 		Args:
-			library (str): Name of model, used to locate the pickle file in the MODEL_DIR.
+			count (int): Number of sentences to be generated.
+			library (str): Name of the library to be used. If not defined, the library of this instance is used.
 		"""
-		library_name = library_name or self.library_name
-		local_model_name = f"{MODEL_DIR}/{self.library_name}.pk"
+		model = self.get_model(library_name)
+
+		budget = count * self.max_attempts
+		attempts = 0
+		sentences = []
+
+		while len(sentences) < count:
+			if attempts >= budget:
+				raise RuntimeError(f"Generated only {len(sentences)} of {count} sentences in {attempts} attempts. "
+								   f"Rejected sentences: {dict(self.rejections)}.")
 
-		pickle_file = None
+			batch_size = min(count - len(sentences), budget - attempts)
+			attempts += batch_size
+			candidates = []
 
-		with open(os.path.join(MODEL_DIR, local_model_name), 'rb') as f:
-			pickle_file = pickle.load(f)
-		return pickle_file
+			for number in range(batch_size):
+				sentence = self.sample_sentence(model)
 
-	def form_sentece(self):
+				# Logic for enforcing min length sentence requirements.
+				if len(sentence) < self.min_sentence_length:
+					self.rejections['too_short'] += 1
+				else:
+					candidates.append(sentence)
+
+			if self.check_breached:
+				results = self.breach_checker.check_batch(candidates)
+				self.rejections['breached'] += sum(1 for breached in results if breached != 0)
+				candidates = [sentence for sentence, breached in zip(candidates, results) if breached == 0]
+
+			sentences.extend(candidates)
+
+		return sentences
+
+	def sample_sentence(self, model):
 		"""
-		Method for generating random sentences, taking into account params of this class instance.
+		Forms a single sentence of self.min_sentence_length words. Special characters are removed from each word as
+		it is drawn, and no more words are drawn once the sentence is longer than self.max_sentence_length.
+
+		Args:
+			model (CompactTrigramModel instance): Model the words are drawn from.
 		"""
-		print(f'Generating random text with length {self.min_sentence_length}.')
-		
-		today = datetime.now()
-		self.sent_generator = nltk.Text(self.get_words())
-		# Existing model is loaded instead of making a new one each time a sentence is generated.
-		self.sent_generator._trigram_model = self.get_trigram()
+		if self._clean_words[0] is not model:
+			self._clean_words = (model, {})
+		clean_words = self._clean_words[1]
 
-		sentence = self.sent_generator.generate(length=self.min_sentence_length, random_seed=int(today.second + today.minute))
-		
-		# Removes special characters from the sentence.
-		sentence = self.format_words(''.join([i for i in sentence if i not in self.specials]))
-		if not self.include_whitespace:
-			sentence = "".join([i for i in sentence if i != " "])
+		separator = " " if self.include_whitespace else ""
+		parts = []
+		length = -len(separator)
+
+		# Words are drawn from the operating system's random source by default, so concurrent workers never share a seed.
+		word_ids = model.iter_word_ids(self.randomness.randbelow)
 
-		my_pass_len = len(sentence)
+		for word_id, _ in zip(word_ids, range(self.min_sentence_length)):
+			word = clean_words.get(word_id)
+			if word is None:
+				# Removes special characters from the word.
+				word = clean_words[word_id] = model.word(word_id).translate(self._specials_table)
 
-		# Logic for enforcing min and max length sentence requirements.
-		if my_pass_len < self.min_sentence_length:
-			sentence = self.form_sentece()
-		elif my_pass_len > self.max_sentence_length:
+			if word:
+				parts.append(word)
+				length += len(separator) + len(word)
+				if length >= self.max_sentence_length:
+					break
+
+		sentence = separator.join(parts)
+
+		# Logic for enforcing max length sentence requirements.
+		if len(sentence) > self.max_sentence_length:
 			sentence = sentence[:self.max_sentence_length]
 			# Making sure that the last characther is not a whitespace, which would could make it difficult to see when copying.
 			if sentence[-1] == " ":
 				sentence = sentence[:-1]
 
-		if self.check_breached:
-			if pw.is_password_breached(password=sentence) != 0:
-				sentence = self.form_sentece()
-
 		return sentence
 
 	def gen_random(self, library_name=None):
@@ -226,16 +329,7 @@ class Language:
 		"""
 		library_name = library_name or self.library_name
 
-		words = self.get_words(library_name)
-
-		print('Instantiating generator.')
-		self.sent_generator = nltk.Text(words)
-		print(f'Loading model {library_name}.pk')
-		# Existing model is loaded instead of making a new one each time a sentence is generated.
-		with open(MODEL_DIR + library_name + '.pk', 'rb') as f:
-			self.sent_generator._trigram_model = self.sent_generator.trigram_model = pickle.load(f)
-
-		sentence = self.form_sentece()
+		sentence = self.form_sentece(library_name)
 
 		return sentence
 
@@ -0,0 +1,173 @@
+from collections import deque
+
+# Characters commonly used in place of letters, mapped to the letters they stand for.
+LEET_CHARS = {
+	'0': 'o',
+	'1': 'l',
+	'3': 'e',
+	'4': 'a',
+	'5': 's',
+	'7': 't',
+	'8': 'b',
+	'@': 'a',
+	'$': 's',
+	'!': 'i',
+	'|': 'l',
+	'+': 't',
+}
+
+
+class WordMatcher:
+	"""
+	Aho-Corasick automaton finding all occurrences of a set of words in a string, in a single pass over the string.
+
+	The automaton is a trie of the words, where each node also links to the node of its longest proper suffix that
+	is in the trie, so when the next character doesn't continue the current word, matching continues from that
+	suffix instead of starting over.
+	"""
+
+	def __init__(self, words, ignore_case=False, leet=False):
+		"""
+		Args:
+			words (list): Words (str) to be found.
+			ignore_case (bool): Determines if words are found regardless of upper and lower case.
+			leet (bool): Determines if words are also found when letters are replaced by look-alike characters
+						 (see LEET_CHARS), e.g. 'p4$$w0rd' for 'password'.
+		"""
+		self.ignore_case = ignore_case
+		self.leet = leet
+		self._table = str.maketrans(LEET_CHARS) if leet else None
+
+		self.words = []
+		self._goto = [{}]
+		self._fail = [0]
+		# Lengths of the words ending at each node, including the words ending at its suffix nodes.
+		self._outputs = [()]
+		self._output_words = [()]
+
+		for word in dict.fromkeys(words):
+			word = str(word)
+			if word:
+				self._add(word)
+
+		self._link()
+
+	def __len__(self):
+		return len(self.words)
+
+	def __bool__(self):
+		return bool(self.words)
+
+	@property
+	def chars(self):
+		"""
+		Normalized characters of the words. Reading any other character leads back to node 0.
+		"""
+		return frozenset(char for edges in self._goto for char in edges)
+
+	def normalize(self, text):
+		"""
+		Returns the text as it is matched: with look-alike characters replaced and in lower case, if enabled.
+		Each character is replaced by exactly one character, so positions in the normalized text are the same.
+		"""
+		if self._table is not None:
+			text = text.translate(self._table)
+		if self.ignore_case:
+			text = text.lower()
+		return text
+
+	def _add(self, word):
+		node = 0
+		for char in self.normalize(word):
+			next_node = self._goto[node].get(char)
+			if next_node is None:
+				next_node = len(self._goto)
+				self._goto[node][char] = next_node
+				self._goto.append({})
+				self._fail.append(0)
+				self._outputs.append(())
+				self._output_words.append(())
+			node = next_node
+
+		self._outputs[node] += (len(word),)
+		self._output_words[node] += (word,)
+		self.words.append(word)
+
+	def _link(self):
+		# Suffix links are set breadth first, so the links of shorter prefixes are always known.
+		queue = deque(self._goto[0].values())
+
+		while queue:
+			node = queue.popleft()
+
+			for char, child in self._goto[node].items():
+				queue.append(child)
+
+				suffix = self._fail[node]
+				while suffix and char not in self._goto[suffix]:
+					suffix = self._fail[suffix]
+				self._fail[child] = self._goto[suffix].get(char, 0)
+
+				self._outputs[child] += self._outputs[self._fail[child]]
+				self._output_words[child] += self._output_words[self._fail[child]]
+
+	def finditer(self, text):
+		"""
+		Yields (start, end, word) for every occurrence of every word in the text, ordered by end position.
+
+		Args:
+			text (str): String to be searched.
+		"""
+		goto = self._goto
+		fail = self._fail
+		outputs = self._outputs
+		node = 0
+
+		for end, char in enumerate(self.normalize(text), 1):
+			while node and char not in goto[node]:
+				node = fail[node]
+			node = goto[node].get(char, 0)
+
+			if outputs[node]:
+				for length, word in zip(outputs[node], self._output_words[node]):
+					yield end - length, end, word
+
+	def advance(self, node, char):
+		"""
+		Returns the node of the automaton reached from node by reading char. Used to match a string as it is built,
+		one character at a time, starting from node 0.
+
+		Args:
+			node (int): Current node.
+			char (str): Next character.
+		"""
+		char = self.normalize(char)
+		while node and char not in self._goto[node]:
+			node = self._fail[node]
+		return self._goto[node].get(char, 0)
+
+	def children(self, node):
+		"""
+		Returns the normalized characters continuing a word from node, mapped to the nodes they lead to.
+		"""
+		return self._goto[node]
+
+	def suffix(self, node):
+		"""
+		Returns the node of the longest proper suffix of node's prefix which is in the trie, 0 for the empty one.
+		"""
+		return self._fail[node]
+
+	def is_match(self, node):
+		"""
+		Returns True if any of the words ends at node.
+		"""
+		return bool(self._outputs[node])
+
+	def search(self, text):
+		"""
+		Returns True if the text contains any of the words.
+		"""
+		for _ in self.finditer(text):
+			return True
+		return False
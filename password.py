@@ -1,13 +1,23 @@
-import secrets
+import os
 import string
-import re
-
-from nltk.corpus import wordnet
-from pyhibp import pwnedpasswords as pw
-from pyhibp import set_user_agent
-
-from settings import EXCLUDED_WORDS, USABLE_CHARS, EXCLUDED_CHARS, MAX_PASS_LEN, MIN_PASS_LEN, FIXED_LEN, PSWRD_NO
-from language import Language
+from collections import Counter, deque
+from functools import partial
+
+from breach import get_breach_checker
+from dictionary import EnglishDictionary
+from sampler import ConstrainedSampler
+from policy import PasswordPolicy
+from alphabet import Alphabet
+from randomness import SYSTEM_RANDOMNESS
+from entropy import password_entropy, sentence_entropy
+from dedup import get_seen_set
+from stats import Stats, NullStats
+from settings import EXCLUDED_WORDS, USABLE_CHARS, EXCLUDED_CHARS, MAX_PASS_LEN, MIN_PASS_LEN, FIXED_LEN, PSWRD_NO, \
+	MAX_ATTEMPTS, EXCLUDED_IGNORE_CASE, EXCLUDED_LEET, DIRECT_SAMPLING, CHAR_DISTRIBUTION, \
+	BULK_CHUNK_SIZE, STREAM_BATCH_SIZE, DEDUP_METHOD, DEDUP_MEMORY_LIMIT, COLLECT_STATS
+
+# Methods of PyPass whose calls are timed in self.stats, including calls made by other stages.
+TIMED_STAGES = ['generate_random', 'remove_touching_duplicates', 'filter_words', 'ensure_proportions', 'sample_direct']
 
 class PyPass:
 	"""
@@ -19,7 +29,11 @@ class PyPass:
 
 	def __init__(self, usable_chars=USABLE_CHARS, excluded_chars=EXCLUDED_CHARS, min_pass_len=MIN_PASS_LEN,
 				 max_pass_len=MAX_PASS_LEN, excluded_words=EXCLUDED_WORDS, remove_repeating=False,
-				 remove_english=False, ensure_proportions=False, language_lib=None, include_whitespace=True):
+				 remove_english=False, ensure_proportions=False, language_lib=None, include_whitespace=True,
+				 breach_checker=None, max_attempts=MAX_ATTEMPTS, excluded_ignore_case=EXCLUDED_IGNORE_CASE,
+				 excluded_leet=EXCLUDED_LEET, direct_sampling=DIRECT_SAMPLING, char_distribution=CHAR_DISTRIBUTION,
+				 unique=False, dedup_method=DEDUP_METHOD, dedup_memory_limit=DEDUP_MEMORY_LIMIT,
+				 collect_stats=COLLECT_STATS, policy=None, randomness=SYSTEM_RANDOMNESS):
 		"""
 		Args: 
 			usable_chars (list): list of lists containing arrays of characters to be used in password generation. 
@@ -39,39 +53,125 @@ class PyPass:
 			language_lib (str): Name of the language model to be used in generating language model passwords.
 			include_whitespace (bool): Determines if the whitespaces will be included in the passwords generated by the
 									   language model.
-		"""
-
-		self.excluded_chars = excluded_chars
-
-		"""
-		Usable chars are checked against the excluded characters, and any matching chars are removed before
-		initializing usable_chars property.
-		"""
-		for excl_char in excluded_chars:
-			for usable_char_list in usable_chars:
-				if excl_char in usable_char_list:
-					usable_char_list.remove(excl_char)
-
-		self.usable_chars = usable_chars
-		self.excluded_words = excluded_words
+			breach_checker (BreachChecker): Object used to check passwords against breached passwords. If not defined,
+											a local index is used if BREACH_INDEX is set in settings.py, and the
+											haveibeenpwned API otherwise.
+			max_attempts (int): Maximum number of candidates generated for each requested password. Generation fails
+								with a RuntimeError once all of them are rejected.
+			excluded_ignore_case (bool): Determines if excluded words are found regardless of upper and lower case.
+			excluded_leet (bool): Determines if excluded words are also found when letters are replaced by look-alike
+								  characters, e.g. 'p4$$w0rd' for 'password'.
+			direct_sampling (bool): Determines if passwords are built so that the rules hold by construction (see
+									ConstrainedSampler), instead of repairing random passwords afterwards.
+			char_distribution (str): Distribution of random characters: 'groups' picks a list of usable_chars first
+									 and then a character from it, 'uniform' picks any character with the same
+									 probability.
+			unique (bool): Determines if every password generated by this instance is different from all the others.
+						   Repeated passwords are dropped, counted in self.rejections['duplicate'] and replaced.
+			dedup_method (str): Method used to remember generated passwords: 'digest' or 'bloom' (see dedup.py).
+			dedup_memory_limit (int): Largest size in bytes of the set of generated passwords.
+			collect_stats (bool): Determines if counters and timings of each stage of generation are collected in
+								  self.stats (see stats.py). When disabled, self.stats records nothing.
+			policy (PasswordPolicy): Rules of the generator. If defined, usable_chars, excluded_chars, min_pass_len,
+									 max_pass_len, excluded_words, excluded_ignore_case, excluded_leet and
+									 char_distribution are ignored. If not, a policy is made from them, or reused if
+									 one with the same rules exists.
+			randomness (SystemRandomness): Source of every random choice of this generator and its language model (see
+										   randomness.py). Only tests and benchmarks should pass a SeededRandomness,
+										   which makes the passwords reproducible and therefore useless.
+		"""
+		if policy is None:
+			policy = PasswordPolicy.get(usable_chars, excluded_chars, excluded_words, min_pass_len, max_pass_len,
+										excluded_ignore_case, excluded_leet, char_distribution)
+		self.policy = policy
+
+		# Arguments used to make an identical generator in each worker process of generate_bulk().
+		self.options = dict(policy=policy, max_attempts=max_attempts, direct_sampling=direct_sampling,
+							collect_stats=collect_stats)
+
+		# Usable chars without the excluded characters. The lists given as arguments are left as they are.
+		self.excluded_chars = policy.excluded_chars
+		self.usable_chars = policy.usable_chars
+		self.excluded_words = policy.excluded_words
+
+		# Random characters are drawn in bulk, from one os.urandom() buffer at a time, or from randomness.
+		self.alphabet = policy.alphabet
+
+		# Automaton finding all excluded words in a password in a single pass.
+		self.excluded_matcher = policy.excluded_matcher
+
+		self.direct_sampling = direct_sampling
+		# Samplers used with direct_sampling, for each combination of rules.
+		self.samplers = {}
 
 		# Setting the minimum and maximum length of the generated passwords.
-		self.min_pass_len = min_pass_len
-		self.max_pass_len = max_pass_len
+		self.min_pass_len = policy.min_pass_len
+		self.max_pass_len = policy.max_pass_len
 
 		# Passwords generated with self.generate_human_password will be stored here
 		self.human_passwords = []
 		# Passwords generated with self.generate_password will be stored here
 		self.passwords = []
 
-		self.language_manager = Language(library=language_lib, min_sentence_length=min_pass_len, max_sentence_length=max_pass_len, include_whitespace=include_whitespace) if language_lib is not None else None
+		self.breach_checker = breach_checker or get_breach_checker()
+		self.options['breach_checker'] = self.breach_checker
+
+		# Passwords generated so far, if they have to be unique. Worker processes of generate_bulk() don't keep their
+		# own, the passwords of all workers are checked here.
+		self.dedup_method = dedup_method
+		self.dedup_memory_limit = dedup_memory_limit
+		self.seen = get_seen_set(dedup_method, dedup_memory_limit) if unique else None
+		self.max_attempts = max_attempts
+
+		# Number of rejected candidates, by reason of rejection.
+		self.rejections = Counter()
+		self.stats = Stats() if collect_stats else NullStats()
+
+		# Stages are timed by wrapping them, so they cost nothing extra when stats are disabled. The wrappers refer to
+		# the instance, so they are only made when they are needed.
+		if self.stats.enabled:
+			for stage in TIMED_STAGES:
+				setattr(self, stage, self.stats.timed(stage, getattr(self, stage)))
 
-		set_user_agent(ua="PyPass Python password generator. Demo version.")
+		# Sentences are checked for breaches by this class, together with all other passwords.
+		# The language machinery is only imported when a language model is used, which keeps simple modes quick to start.
+		self.language_manager = None
+		if language_lib is not None:
+			from language import Language
+			self.language_manager = Language(library=language_lib, min_sentence_length=self.min_pass_len, max_sentence_length=self.max_pass_len, include_whitespace=include_whitespace, check_breached=False, max_attempts=max_attempts)
+
+		self.set_randomness(randomness)
 
 
 	def __str__(self):
 		return ' '.join(self.all_passwords)
 
+	def set_randomness(self, randomness):
+		"""
+		Makes every random choice of this generator, and of its language model, from randomness (see randomness.py).
+
+		Args:
+			randomness (SystemRandomness): Source of randomness.
+		"""
+		self.randomness = randomness
+		self.options['randomness'] = randomness
+
+		# The policy's alphabet is shared by all generators of the policy, so other sources get an alphabet of their own.
+		if randomness is SYSTEM_RANDOMNESS:
+			self.alphabet = self.policy.alphabet
+		else:
+			self.alphabet = Alphabet(self.usable_chars, distribution=self.policy.char_distribution, randomness=randomness)
+
+		for sampler in self.samplers.values():
+			sampler.randbelow = randomness.randbelow
+		if self.language_manager is not None:
+			self.language_manager.randomness = randomness
+
+	@property
+	def english(self):
+		# The English dictionary is loaded on first use, as only some of the rules need it.
+		return EnglishDictionary.get()
+
 	@property
 	def all_passwords(self):
 		# Returns combined "human" and "random" passwords.
@@ -85,7 +185,7 @@ class PyPass:
 			pass_length (int): length of random passwords string to be generated.
 		"""
 		
-		return [secrets.choice(self.usable_chars[self.usable_chars.index(secrets.choice(self.usable_chars))]) for e in range(pass_length)]
+		return self.alphabet.sample(pass_length)
 
 	def remove_touching_duplicates(self, my_string_list):
 		"""
@@ -100,7 +200,8 @@ class PyPass:
 		# The -1 range was chosen to avoid index out of range error.
 		for char in range(len(my_string_list[:-1])):
 			if my_string_list[char] == my_string_list[char+1]:
-				new_string_list.append(secrets.choice(self.usable_chars[self.usable_chars.index(secrets.choice(self.usable_chars))]))
+				new_string_list.append(self.alphabet.choice())
+				self.stats.count('touching_duplicates_replaced')
 			else:
 				new_string_list.append(my_string_list[char])
 
@@ -115,124 +216,86 @@ class PyPass:
 		Checks if a string contains any of the words or other char sequences stored in self.excluded_words.
 		"""
 		
-		return any(word in my_string for word in self.excluded_words)
+		return self.excluded_matcher.search(my_string)
 
 
-	def find_letter_sequences(self, my_list):
+	def filter_words(self, my_string_list, english=True, excluded=True, remove_touching=False):
 		"""
-		Used in generate_human_password(). Finds sequences of letters in the password string. Once found, 
-		it checks if the letter sequence corresponds to an English word, or is an excluded word. If such 
-		sequences are found, they are replaced with a random set of characters.
+		Replaces English words of more than 3 letters and excluded words in the password with random characters,
+		in a single stage. Each pass joins the password once, finds its letter runs and its excluded words in one
+		scan each, and regenerates only the offending spans, in place. Passes are repeated while the new characters
+		form other words, at most self.max_attempts times.
 
 		Args:
-			my_list (list): list representation of the password.
+			my_string_list (list): list representation of the password.
+			english (bool): Determines if English words are replaced.
+			excluded (bool): Determines if excluded words are replaced.
+			remove_touching (bool): Determines if touching duplicate characters are removed from the replacements.
 		"""
+		string_members = list(my_string_list)
+		dictionary = self.english if english else None
+		matcher = self.excluded_matcher if excluded and self.excluded_words else None
 
-		pass_string = ''.join(my_list)
-		pattern = re.compile('[a-zA-Z]{2,}')
+		if dictionary is None and matcher is None:
+			return string_members
 
-		"""
-		Replaces English words with new random strings.
-		The process is repeated if the newly generated random string, is also an English word.
-		"""
+		for attempt in range(self.max_attempts):
+			self.stats.count('word_filter_passes')
+			pass_string = ''.join(string_members)
+			# Spans of the words found, as (start, end, word).
+			spans = list(matcher.finditer(pass_string)) if matcher is not None else []
+			excluded_count = len(spans)
 
-		finds = 1
+			if dictionary is not None:
+				spans.extend((match.start(), match.end(), match.group())
+							 for match in self.policy.word_pattern.finditer(pass_string)
+							 if match.end() - match.start() > 3 and dictionary.is_word(match.group()))
 
-		while finds == 1:
-			matches = pattern.findall(pass_string)
-			if len(matches) > 0:
-				for m in matches:
-					if (wordnet.synsets(m.lower()) or self.contains_excluded(m)) and len(m) > 3:
-						pass_string = pass_string.replace(m, self.remove_touching_duplicates(self.generate_random(len(m))))
-						finds = 1
+			if not spans:
+				return string_members
 
-					else:
-						finds = 0
-			else:
-				finds = 0
+			self.stats.count('excluded_replacements', excluded_count)
+			self.stats.count('english_replacements', len(spans) - excluded_count)
 
-		return list(pass_string)
+			# Replacements have the length of the span they replace, so the other spans stay where they are.
+			for start, end, word in spans:
+				replacement = self.generate_random(end - start)
+				if remove_touching:
+					replacement = self.remove_touching_duplicates(replacement)
+				string_members[start:end] = replacement
 
+		raise RuntimeError(f"English or excluded words still found after {self.max_attempts} replacements.")
 
-	def remove_english(self, my_string_list, remove_touching):
+	def find_letter_sequences(self, my_list):
 		"""
-		Used in generate_password(). Finds sequences of letters in the password string. Once found,
-		it checks if the letter sequence corresponds to an English word. If such sequences are found, 
-		they are replaced with a random set of characters.
+		Used in generate_human_password(). Replaces English words and excluded words in the password with random
+		characters without touching duplicates (see filter_words()).
 
 		Args:
-			my_string_list (list): list representation of the password.
-			remove_touching (bool): Determines if touching duplicate characters will be removed.
+			my_list (list): list representation of the password.
 		"""
-		pass_string = ''.join(my_string_list)
-		pattern = re.compile('[a-zA-Z]+')
+		return self.filter_words(my_list, english=True, excluded=True, remove_touching=True)
 
+	def remove_english(self, my_string_list, remove_touching):
 		"""
-		Replaces English words with new random strings.
-		The process is repeated if the newly generated random string, is also an English word.
-		"""
-
-		finds = 1
-
-		while finds == 1:
-			matches = pattern.findall(pass_string)
-			if len(matches) > 0:
-				for m in matches:
-					if wordnet.synsets(m.lower()) and len(m) > 3:
-						if remove_touching:
-							pass_string = pass_string.replace(m,
-															  self.remove_touching_duplicates(self.generate_random(len(m))))
-						else:
-							pass_string = pass_string.replace(m, self.generate_random(len(m)))
-						finds = 1
-
-					else:
-						finds = 0
-			else:
-				finds = 0
-
-		return list(pass_string)
-
+		Replaces English words of more than 3 letters in the password with random characters (see filter_words()).
 
-	def remove_excluded(self, my_string_list, remove_touching):
-		"""
-		Used in generate_password(). Finds sequences of letters in the password string.	Once found, 
-		it checks if the letter sequence corresponds to an item from the excluded words list (self.excluded_words).
-		If such sequences are found, they are replaced with a random set of characters.
 		Args:
 			my_string_list (list): list representation of the password.
 			remove_touching (bool): Determines if touching duplicate characters will be removed.
 		"""
+		return self.filter_words(my_string_list, english=True, excluded=False, remove_touching=remove_touching)
 
-		pass_string = ''.join(my_string_list)
-		pattern = re.compile('[a-zA-Z]+')
-
-		"""
-		Replaces English words with new random strings.
-		The process is repeated if the newly generated random string, is also an English word.
+	def remove_excluded(self, my_string_list, remove_touching):
 		"""
+		Replaces every occurrence of an item from the excluded words list (self.excluded_words) in the password with
+		random characters (see filter_words()).
 
-		finds = 1
-
-		while finds == 1:
-			matches = pattern.findall(pass_string)
-			if len(matches) > 0:
-				for m in matches:
-					if self.contains_excluded(pass_string) and len(m) > 3:
-						if remove_touching:
-							pass_string = pass_string.replace(m,
-															  self.remove_touching_duplicates(
-																  self.generate_random(len(m))))
-						else:
-							pass_string = pass_string.replace(m, self.generate_random(len(m)))
-						finds = 1
-
-					else:
-						finds = 0
-			else:
-				finds = 0
-
-		return list(pass_string)
+		Args:
+			my_string_list (list): list representation of the password.
+			remove_touching (bool): Determines if touching duplicate characters will be removed.
+		"""
+		return self.filter_words(my_string_list, english=False, excluded=True, remove_touching=remove_touching)
 
 	@staticmethod
 	def confirm_proportions(list_dict):
@@ -245,6 +308,23 @@ class PyPass:
 		"""
 		return all(type_freq >= 1 for type_freq in list_dict.values())
 
+	def count_groups(self, string_members):
+		"""
+		Returns the number of characters of the password belonging to each list of usable_chars, found with the
+		char -> groups table of the policy.
+
+		Args:
+			string_members (list): list of characthers representing the password.
+		"""
+		counts = [0] * len(self.usable_chars)
+		char_groups = self.policy.char_groups
+
+		for char in string_members:
+			for group in char_groups.get(char, ()):
+				counts[group] += 1
+
+		return counts
+
 	def generate_new_dict(self, string_members):
 		"""
 		Generates a new dictionary reflecting the number of each char type from usable_chars in the password.
@@ -252,13 +332,16 @@ class PyPass:
 		Args:
 			string_members (list): list of characthers representing the password.
 		"""
-		return {str(self.usable_chars.index(v)): sum(ch in v for ch in string_members) for v in self.usable_chars}
+		return {str(index): count for index, count in enumerate(self.count_groups(string_members))}
 
 	def ensure_proportions(self, string_members):
 		"""
-		Checks if there is at least one of each types of usable_chars in the password string using the confirm_proportions().
-		If the proportion is not fulfilled, it replaces a random character in the password string, with a randomly chosen
-		char from the missing usable_chars type. It continues this check until the confirm_proportions() returns True.
+		Ensures there is at least one character of each list of usable_chars in the password. The number of characters
+		of each group is counted once, and kept up to date as characters are swapped. Each missing group gets a random
+		character, put in place of a random character whose groups all have more than one character, so a repair
+		never takes the last character of another group. Lookups of positions stop after a few random probes in
+		almost all cases, so a repair costs about the same for any password length.
+
 		Does not check for enforcing exclusion of English words or consecutive chars, because this function will insert only
 		a single character from a list, from which not a single member is contained in the generated password. It will check
 		for excluded words, since these might be a sequence of different types of chars.
@@ -266,22 +349,64 @@ class PyPass:
 		Args:
 			string_members (list): list of characthers representing the password.
 		"""
-		string_proportions = self.generate_new_dict(string_members)
+		char_groups = self.policy.char_groups
+		# Empty lists can't be represented, they are left out.
+		groups = [index for index, group in enumerate(self.usable_chars) if group]
+
+		for attempt in range(self.max_attempts):
+			counts = self.count_groups(string_members)
+			missing = [index for index in groups if counts[index] == 0]
+			if not missing:
+				return string_members
+
+			for group in missing:
+				self.stats.count('proportion_repairs')
+				index = self.find_replaceable(string_members, counts)
+
+				for old_group in char_groups.get(string_members[index], ()):
+					counts[old_group] -= 1
+
+				string_members[index] = self.randomness.choice(self.usable_chars[group])
 
-		while not self.confirm_proportions(string_proportions):
-			for item in string_proportions.keys():
+				for new_group in char_groups[string_members[index]]:
+					counts[new_group] += 1
 
-				if string_proportions[item] < 1:
-					index = secrets.choice(list(range(len(string_members))))
-					string_members[index] = secrets.choice(self.usable_chars[int(item)])
+			# If excluded words are defined, the function will remove any contained in the new password. As their
+			# replacements may take the only character of a group, the groups are counted again.
+			if len(self.excluded_words) == 0:
+				return string_members
 
-					# If excluded words are defined, the function will remove any contained in the new password.
-					if len(self.excluded_words) > 0:
-						string_members = self.remove_excluded(string_members, remove_touching=False)
+			string_members = self.remove_excluded(string_members, remove_touching=False)
 
-				string_proportions = self.generate_new_dict(string_members)
+		raise RuntimeError(f"Characters of every group still missing after {self.max_attempts} repairs.")
 
-		return string_members
+	def find_replaceable(self, string_members, counts, probes=32):
+		"""
+		Returns a random position of the password whose character can be replaced without leaving a group of
+		usable_chars with no characters, i.e. all groups of the character have more than one. A few random positions
+		are probed first, and all positions are searched only if none of them fits.
+
+		Args:
+			string_members (list): list of characthers representing the password.
+			counts (list): Number of characters of each group in the password, see count_groups().
+			probes (int): Number of random positions probed before searching all of them.
+		"""
+		char_groups = self.policy.char_groups
+
+		def replaceable(index):
+			return all(counts[group] > 1 for group in char_groups.get(string_members[index], ()))
+
+		for probe in range(probes):
+			index = self.randomness.randbelow(len(string_members))
+			if replaceable(index):
+				return index
+
+		candidates = [index for index in range(len(string_members)) if replaceable(index)]
+		if not candidates:
+			raise ValueError(f"A password of {len(string_members)} characters can't contain a character of each of "
+							 f"the {len(self.usable_chars)} usable_chars lists.")
+
+		return self.randomness.choice(candidates)
 
 	def generate_human_password(self, pass_number=PSWRD_NO, fixed_len=FIXED_LEN):
 		"""
@@ -315,30 +440,175 @@ class PyPass:
 		if pass_number < 1:
 			pass_number = 1
 
-		for number in range(pass_number):
+		self.collect_passwords(lambda: self.build_human_password(fixed_len=fixed_len), pass_number, self.human_passwords)
 
-			if fixed_len:
-				pass_string_list = self.generate_random(fixed_len)
+	def build_human_password(self, fixed_len=FIXED_LEN):
+		"""
+		Generates a single password candidate for generate_human_password(), applying all the rules except the breach check.
 
-			else:
-				pass_len_range = list(range(self.min_pass_len,self.max_pass_len+1))
-				pass_string_list = self.generate_random(secrets.choice(pass_len_range))
+		Args:
+			fixed_len (int): Determines if password needs to be of a designated fixed length.
+		"""
+		if self.direct_sampling:
+			return self.sample_direct(self.pick_length(fixed_len), remove_repeating=True, remove_english=True,
+									  check_proportions=True)
 
+		pass_string_list = self.generate_random(self.pick_length(fixed_len))
 
-			# Removing touching duplicate chars.
-			my_pass = self.find_letter_sequences(self.remove_touching_duplicates(pass_string_list))
+		# Removing touching duplicate chars.
+		my_pass = self.find_letter_sequences(self.remove_touching_duplicates(pass_string_list))
 
-			# Ensuring at least one member of each type from usable_chars is contained in the password string.
-			my_pass = self.ensure_proportions(my_pass)
+		# Ensuring at least one member of each type from usable_chars is contained in the password string.
+		my_pass = self.ensure_proportions(my_pass)
 
-			my_pass = ''.join(my_pass)
+		return ''.join(my_pass)
 
-			# Checking if the generated password was exposed in data breaches. If so, the process is repeated.
-			if pw.is_password_breached(password=my_pass) != 0:
-				self.generate_password()
-			else:
-				self.human_passwords.append(my_pass)
+	def pick_length(self, fixed_len=FIXED_LEN):
+		"""
+		Returns fixed_len if it is set, and a random length between self.min_pass_len and self.max_pass_len otherwise.
+		"""
+		if fixed_len:
+			return fixed_len
+
+		return self.randomness.choice(self.policy.lengths)
+
+	def sample_direct(self, pass_length, remove_repeating=False, remove_english=False, check_proportions=False):
+		"""
+		Builds a password with ConstrainedSampler, so the rules hold by construction. Excluded words are always avoided.
+
+		Args:
+			pass_length (int): Length of the password.
+			remove_repeating (bool): Determines if consecutive duplicate chars are avoided.
+			remove_english (bool): Determines if English words are avoided.
+			check_proportions (bool): Determines if at least one char from each list in usable_chars is used.
+		"""
+		rules = (remove_repeating, remove_english, check_proportions)
+
+		if rules not in self.samplers:
+			self.samplers[rules] = ConstrainedSampler(self.usable_chars, no_repeats=remove_repeating,
+													  all_groups=check_proportions, matcher=self.excluded_matcher,
+													  dictionary=self.english if remove_english else None,
+													  randbelow=self.randomness.randbelow,
+													  max_attempts=self.max_attempts)
+
+		sampler = self.samplers[rules]
+		restarts = sampler.restarts
+		my_pass = ''.join(sampler.sample(pass_length))
+		self.rejections['restarted'] += sampler.restarts - restarts
+		self.stats.count('sampler_restarts', sampler.restarts - restarts)
+
+		return my_pass
 
+	def collect_passwords(self, build, pass_number, passwords):
+		"""
+		Appends pass_number passwords made with build(), and checked for breaches by iter_checked(), to passwords.
+
+		Args:
+			build (callable): Returns a new password candidate.
+			pass_number (int): Number of passwords to be accepted.
+			passwords (list): List the accepted passwords are appended to.
+		"""
+		passwords.extend(self.iter_checked(build, pass_number))
+
+	def iter_checked(self, build, pass_number=None):
+		"""
+		Generates candidates with build() and checks them for breaches in batches of at most STREAM_BATCH_SIZE, so the
+		breach checker can share work between them. Breached candidates are replaced in the next batch. Accepted
+		passwords are yielded, until pass_number passwords are yielded, or endlessly if pass_number is None.
+		At most self.max_attempts candidates are generated for each password.
+
+		Args:
+			build (callable): Returns a new password candidate.
+			pass_number (int): Number of passwords to be accepted, or None for no limit.
+		"""
+		attempts = 0
+		accepted = 0
+
+		while pass_number is None or accepted < pass_number:
+			budget = (accepted + 1 if pass_number is None else pass_number) * self.max_attempts
+			if attempts >= budget:
+				raise RuntimeError(f"Generated only {accepted} of {pass_number or 'unlimited'} passwords in {attempts} "
+								   f"attempts. Rejected candidates: {dict(self.rejections)}.")
+
+			batch_size = min(STREAM_BATCH_SIZE, budget - attempts)
+			if pass_number is not None:
+				batch_size = min(batch_size, pass_number - accepted)
+
+			with self.stats.time('build'):
+				candidates = [build() for number in range(batch_size)]
+			attempts += batch_size
+			self.stats.count('batches')
+			self.stats.count('candidates', batch_size)
+
+			# Checking if the generated passwords were exposed in data breaches. If so, they are replaced.
+			with self.stats.time('breach_check'):
+				results = self.breach_checker.check_batch(candidates)
+			self.stats.count('breach_checks', batch_size)
+
+			for my_pass, breached in zip(candidates, results):
+				if breached != 0:
+					self.rejections['breached'] += 1
+					self.stats.count('breach_hits')
+				elif self.seen is not None and self.seen.add(my_pass):
+					self.rejections['duplicate'] += 1
+					self.stats.count('duplicates')
+				else:
+					accepted += 1
+					self.stats.count('passwords')
+					yield my_pass
+
+	def iter_passwords(self, pass_number=None, human=False, sentences=False, remove_repeating=False,
+					   remove_english=False, check_proportions=False, fixed_len=FIXED_LEN):
+		"""
+		Yields passwords as they are generated and checked for breaches, without storing them, so memory use doesn't
+		depend on the number of passwords. Passwords are made like generate_password(), like
+		generate_human_password() if human is True, or like generate_sentence_pass() if sentences is True.
+
+			for password in PyPass().iter_passwords(1000000):
+				...
+
+		Args:
+			pass_number (int): Number of passwords to be yielded. If left blank, passwords are yielded endlessly.
+			human (bool): Determines if passwords are generated like generate_human_password().
+			sentences (bool): Determines if passwords are generated like generate_sentence_pass().
+			remove_repeating (bool): Determines if consecutive duplicate chars will be removed from the password.
+			remove_english (bool): Designates if English words will be removed from the password.
+			check_proportions (bool): Designates if the password will contain at least one char form each list
+									  in usable_chars.
+			fixed_len (int): Will determine a fixed length of the generated password.
+		"""
+		if sentences:
+			build = self.language_manager.form_sentece
+		elif human:
+			build = partial(self.build_human_password, fixed_len=fixed_len)
+		else:
+			build = partial(self.build_password, remove_repeating=remove_repeating, remove_english=remove_english,
+							check_proportions=check_proportions, fixed_len=fixed_len)
+
+		return self.iter_checked(build, pass_number)
+
+	def entropy(self, human=False, sentences=False, remove_repeating=False, remove_english=False,
+				check_proportions=False, fixed_len=FIXED_LEN):
+		"""
+		Returns the Entropy of the passwords iter_passwords() generates with the same arguments: their entropy,
+		min-entropy and keyspace, computed by counting rather than sampling (see entropy.py). Results are cached for
+		each policy and set of rules, so this is cheap to call for every generator.
+
+		Args:
+			human (bool): Determines if passwords are generated like generate_human_password().
+			sentences (bool): Determines if passwords are generated like generate_sentence_pass().
+			remove_repeating (bool): Determines if consecutive duplicate chars will be removed from the password.
+			remove_english (bool): Designates if English words will be removed from the password.
+			check_proportions (bool): Designates if the password will contain at least one char form each list
+									  in usable_chars.
+			fixed_len (int): Will determine a fixed length of the generated password.
+		"""
+		if sentences:
+			return sentence_entropy(self.language_manager.get_model(), self.language_manager.min_sentence_length)
+
+		return password_entropy(self.policy, human=human, remove_repeating=remove_repeating,
+								remove_english=remove_english, check_proportions=check_proportions,
+								fixed_len=fixed_len, direct_sampling=self.direct_sampling)
 
 	def generate_password(self, pass_number=PSWRD_NO, remove_repeating=False, remove_english=False, check_proportions=False,
 					  fixed_len=FIXED_LEN):
@@ -362,38 +632,221 @@ class PyPass:
 		if pass_number<1:
 			pass_number = 1
 
-		for number in range(pass_number):
-			if fixed_len:
-				pass_string_list = self.generate_random(fixed_len)
+		self.collect_passwords(lambda: self.build_password(remove_repeating=remove_repeating,
+														   remove_english=remove_english,
+														   check_proportions=check_proportions, fixed_len=fixed_len),
+							   pass_number, self.passwords)
 
-			else:
-				pass_len_range = list(range(self.min_pass_len,self.max_pass_len+1))
-				pass_string_list = self.generate_random(secrets.choice(pass_len_range))
+	def build_password(self, remove_repeating=False, remove_english=False, check_proportions=False,
+					   fixed_len=FIXED_LEN):
+		"""
+		Generates a single password candidate for generate_password(), applying all the rules except the breach check.
 
-			# Removing touching duplicate chars, in case the user chose so.
-			if remove_repeating:
-				pass_string_list = self.remove_touching_duplicates(pass_string_list)
+		Args:
+			remove_repeating (bool): Determines if consecutive duplicate chars will be removed from the password.
+			remove_english (bool): Designates if English words will be removed from the password.
+			check_proportions (bool): Designates if the password will contain at least one char form each list
+									  in usable_chars.
+			fixed_len (int): Will determine a fixed length of the generated password.
+		"""
+		if self.direct_sampling:
+			return self.sample_direct(self.pick_length(fixed_len), remove_repeating=remove_repeating,
+									  remove_english=remove_english, check_proportions=check_proportions)
 
-			# Removing English words and excluded words, if the user chose so.
-			if remove_english:
-				pass_string_list = self.remove_english(pass_string_list,remove_repeating)
+		pass_string_list = self.generate_random(self.pick_length(fixed_len))
 
-			# Removing excluded words, if they are designated by the user.
-			if len(self.excluded_words) > 0:
-				pass_string_list = self.remove_excluded(pass_string_list, remove_repeating)
+		# Removing touching duplicate chars, in case the user chose so.
+		if remove_repeating:
+			pass_string_list = self.remove_touching_duplicates(pass_string_list)
 
-			# If the user chose so, ensuring at least one member of each group of characters
-			# from the usable characters lists has been included.
-			if check_proportions:
-				pass_string_list = self.ensure_proportions(pass_string_list)
+		# Removing English words, if the user chose so, and excluded words, if they are designated by the user.
+		pass_string_list = self.filter_words(pass_string_list, english=remove_english, excluded=True,
+											 remove_touching=remove_repeating)
 
-			my_pass = ''.join(pass_string_list)
+		# If the user chose so, ensuring at least one member of each group of characters
+		# from the usable characters lists has been included.
+		if check_proportions:
+			pass_string_list = self.ensure_proportions(pass_string_list)
 
-			if pw.is_password_breached(password=my_pass) != 0:
-				self.generate_password(pass_number=pass_number, remove_repeating=remove_repeating,
-									   remove_english=remove_english, ensure_proportions=check_proportions)
-			else:
-				self.passwords.append(my_pass)
+		return ''.join(pass_string_list)
+
+	async def agenerate_passwords(self, pass_number=PSWRD_NO, concurrency=10, remove_repeating=False,
+								  remove_english=False, check_proportions=False, fixed_len=FIXED_LEN):
+		"""
+		Asynchronous version of generate_password(). Candidates are generated as they are needed, while up to
+		concurrency breach checks run at the same time in worker threads. Passwords are yielded as soon as they
+		pass the check, so their order is not the order in which they were generated. Yielded passwords are not
+		appended to self.passwords.
+
+			async for password in PyPass().agenerate_passwords(100, concurrency=20):
+				...
+
+		Args:
+			pass_number (int): Designates how many passwords are to be created. If left blank, will generate one password.
+			concurrency (int): Maximum number of breach checks in flight.
+			remove_repeating (bool): Determines if consecutive duplicate chars will be removed from the password.
+			remove_english (bool): Designates if English words will be removed from the password.
+			check_proportions (bool): Designates if the password will contain at least one char form each list
+									  in usable_chars.
+			fixed_len (int): Will determine a fixed length of the generated password.
+		"""
+		# Prevents setting password number below 1.
+		if pass_number < 1:
+			pass_number = 1
+
+		import asyncio
+		from concurrent.futures import ThreadPoolExecutor
+
+		loop = asyncio.get_running_loop()
+		executor = ThreadPoolExecutor(max_workers=concurrency)
+
+		async def check(my_pass):
+			breached = await loop.run_in_executor(executor, self.breach_checker.is_password_breached, my_pass)
+			return my_pass, breached
+
+		budget = pass_number * self.max_attempts
+		attempts = 0
+		accepted = 0
+		pending = set()
+
+		try:
+			while accepted < pass_number:
+				# Keeping the number of checks in flight at the limit, without checking more candidates than needed.
+				while len(pending) < concurrency and accepted + len(pending) < pass_number and attempts < budget:
+					with self.stats.time('build'):
+						my_pass = self.build_password(remove_repeating=remove_repeating, remove_english=remove_english,
+													  check_proportions=check_proportions, fixed_len=fixed_len)
+					pending.add(asyncio.ensure_future(check(my_pass)))
+					attempts += 1
+					self.stats.count('candidates')
+
+				if not pending:
+					raise RuntimeError(f"Generated only {accepted} of {pass_number} passwords in {attempts} attempts. "
+									   f"Rejected candidates: {dict(self.rejections)}.")
+
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+				for task in done:
+					my_pass, breached = task.result()
+					self.stats.count('breach_checks')
+					if breached != 0:
+						self.rejections['breached'] += 1
+						self.stats.count('breach_hits')
+					elif self.seen is not None and self.seen.add(my_pass):
+						self.rejections['duplicate'] += 1
+						self.stats.count('duplicates')
+					else:
+						accepted += 1
+						self.stats.count('passwords')
+						yield my_pass
+
+		finally:
+			for task in pending:
+				task.cancel()
+			executor.shutdown(wait=False)
+
+	def generate_bulk(self, pass_number=PSWRD_NO, workers=None, human=False, remove_repeating=False,
+					  remove_english=False, check_proportions=False, fixed_len=FIXED_LEN):
+		"""
+		Generates passwords like generate_password(), or generate_human_password() if human is True, on several CPU
+		cores. The work is split into shards of at most BULK_CHUNK_SIZE passwords, generated by a pool of worker
+		processes, each with its own copy of this generator (alphabet, excluded words automaton, English dictionary
+		and breach checker). Passwords are merged without duplicates, so a password generated twice, or already in
+		the list it is appended to, is replaced by a new one. Generated passwords are appended to self.passwords,
+		or self.human_passwords, and returned.
+
+		Args:
+			pass_number (int): Designates how many passwords are to be created. If left blank, will generate one password.
+			workers (int): Number of worker processes. If not defined, one for each CPU core.
+			human (bool): Determines if passwords are generated like generate_human_password().
+			remove_repeating (bool): Determines if consecutive duplicate chars will be removed from the password.
+			remove_english (bool): Designates if English words will be removed from the password.
+			check_proportions (bool): Designates if the password will contain at least one char form each list
+									  in usable_chars.
+			fixed_len (int): Will determine a fixed length of the generated password.
+		"""
+		passwords = self.human_passwords if human else self.passwords
+		generated = list(self.iter_bulk(pass_number, workers=workers, human=human, remove_repeating=remove_repeating,
+										remove_english=remove_english, check_proportions=check_proportions,
+										fixed_len=fixed_len, exclude=passwords))
+		passwords.extend(generated)
+		return generated
+
+	def iter_bulk(self, pass_number=PSWRD_NO, workers=None, human=False, remove_repeating=False, remove_english=False,
+				  check_proportions=False, fixed_len=FIXED_LEN, exclude=()):
+		"""
+		Yields unique passwords generated by worker processes, like generate_bulk(), as shards are finished, without
+		storing them. A few shards for each worker are in progress at a time, so finished shards don't pile up.
+
+		Args:
+			pass_number (int): Designates how many passwords are to be created. If left blank, will generate one password.
+			workers (int): Number of worker processes. If not defined, one for each CPU core.
+			human (bool): Determines if passwords are generated like generate_human_password().
+			remove_repeating (bool): Determines if consecutive duplicate chars will be removed from the password.
+			remove_english (bool): Designates if English words will be removed from the password.
+			check_proportions (bool): Designates if the password will contain at least one char form each list
+									  in usable_chars.
+			fixed_len (int): Will determine a fixed length of the generated password.
+			exclude (iterable): Passwords which are not yielded, e.g. passwords generated earlier.
+		"""
+		# Prevents setting password number below 1.
+		if pass_number < 1:
+			pass_number = 1
+
+		workers = workers or os.cpu_count() or 1
+		# Several shards for each worker, so workers finishing early pick up the remaining work.
+		chunk_size = max(1, min(BULK_CHUNK_SIZE, -(-pass_number // (workers * 4))))
+
+		if human:
+			rules = dict(fixed_len=fixed_len)
+		else:
+			rules = dict(remove_repeating=remove_repeating, remove_english=remove_english,
+						 check_proportions=check_proportions, fixed_len=fixed_len)
+
+		generate_shard = partial(_generate_shard, human=human, rules=rules)
+		shards = 0
+
+		seen = self.seen if self.seen is not None else get_seen_set(self.dedup_method, self.dedup_memory_limit)
+		for my_pass in exclude:
+			seen.add(my_pass)
+		budget = pass_number * self.max_attempts
+		attempts = 0
+		accepted = 0
+		pending = deque()
+
+		from concurrent.futures import ProcessPoolExecutor
+
+		with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self.options,)) as executor:
+			try:
+				while accepted < pass_number:
+					requested = sum(size for size, future in pending)
+					while len(pending) < workers * 2 and accepted + requested < pass_number and attempts < budget:
+						size = min(chunk_size, pass_number - accepted - requested, budget - attempts)
+						pending.append((size, executor.submit(generate_shard, size, shards)))
+						shards += 1
+						requested += size
+						attempts += size
+
+					if not pending:
+						raise RuntimeError(f"Generated only {accepted} of {pass_number} unique passwords in {attempts} "
+										   f"attempts. Rejected candidates: {dict(self.rejections)}.")
+
+					size, future = pending.popleft()
+					shard, rejections, stats = future.result()
+					self.rejections.update(rejections)
+					self.stats.merge(stats)
+
+					for my_pass in shard:
+						if seen.add(my_pass):
+							self.rejections['duplicate'] += 1
+							self.stats.count('duplicates')
+						else:
+							accepted += 1
+							yield my_pass
+
+			finally:
+				for size, future in pending:
+					future.cancel()
 
 	def generate_sentence_pass(self, pass_number=PSWRD_NO):
 		"""
@@ -403,10 +856,42 @@ class PyPass:
         Args:
 			pass_number (int): Designates how many passwords are to be created. If left blank, will generate one password.		
 		"""
-		for number in range(pass_number):
-			my_pass = self.language_manager.form_sentece()
-			if pw.is_password_breached(password=my_pass) != 0:
-				self.generate_sentence_pass(pass_number=pass_number)
-			else:
-				self.passwords.append(my_pass)
+		# Prevents setting password number below 1.
+		if pass_number < 1:
+			pass_number = 1
+
+		self.collect_passwords(self.language_manager.form_sentece, pass_number, self.passwords)
+
+
+# Generator of a worker process of PyPass.generate_bulk(), made once for each process by _init_worker(), and the
+# randomness it was made with.
+_worker = None
+_worker_randomness = None
+
+
+def _init_worker(options):
+	global _worker, _worker_randomness
+	_worker = PyPass(**options)
+	_worker_randomness = _worker.randomness
+
+
+def _generate_shard(pass_number, shard, human, rules):
+	"""
+	Generates a shard of the passwords of PyPass.generate_bulk() in a worker process. Returns the passwords, the
+	numbers of candidates the worker rejected while generating them and a snapshot of its stats.
+	"""
+	# A seeded generator draws each shard from its own seed, so shards differ, whichever worker they land on.
+	randomness = _worker_randomness.spawn(shard)
+	if randomness is not _worker.randomness:
+		_worker.set_randomness(randomness)
+
+	_worker.rejections.clear()
+	_worker.stats.reset()
+	passwords = []
+
+	if human:
+		_worker.collect_passwords(lambda: _worker.build_human_password(**rules), pass_number, passwords)
+	else:
+		_worker.collect_passwords(lambda: _worker.build_password(**rules), pass_number, passwords)
 
+	return passwords, _worker.rejections, _worker.stats.snapshot()
@@ -0,0 +1,128 @@
+import re
+import threading
+import types
+from collections import OrderedDict
+
+from matcher import WordMatcher
+from alphabet import Alphabet
+from settings import USABLE_CHARS, EXCLUDED_CHARS, EXCLUDED_WORDS, MIN_PASS_LEN, MAX_PASS_LEN, EXCLUDED_IGNORE_CASE, \
+	EXCLUDED_LEET, CHAR_DISTRIBUTION, POLICY_CACHE_SIZE
+
+# Policies made by PasswordPolicy.get(), keyed by their rules, least recently used first.
+_policies = OrderedDict()
+_policies_lock = threading.Lock()
+
+
+class PasswordPolicy:
+	"""
+	Immutable rules of a PyPass instance: its characters, excluded words and password lengths, together with
+	everything derived from them, which is built once: the alphabet with the excluded characters removed, the lookup
+	table of character groups, the automaton finding excluded words, the pattern finding letter runs and the
+	lengths passwords are drawn from.
+
+	Policies are equal, and hash the same, when their rules are. PasswordPolicy.get() returns a cached policy, so
+	PyPass instances with the same rules share one, in any thread:
+
+		policy = PasswordPolicy.get(excluded_chars=['l', '1'], min_pass_len=12)
+		generators = [PyPass(policy=policy) for _ in range(100)]
+	"""
+	__slots__ = ('key', 'usable_chars', 'excluded_chars', 'excluded_words', 'min_pass_len', 'max_pass_len',
+				 'excluded_ignore_case', 'excluded_leet', 'char_distribution', 'char_groups', 'lengths', 'alphabet',
+				 'excluded_matcher', 'word_pattern')
+
+	def __init__(self, usable_chars=USABLE_CHARS, excluded_chars=EXCLUDED_CHARS, excluded_words=EXCLUDED_WORDS,
+				 min_pass_len=MIN_PASS_LEN, max_pass_len=MAX_PASS_LEN, excluded_ignore_case=EXCLUDED_IGNORE_CASE,
+				 excluded_leet=EXCLUDED_LEET, char_distribution=CHAR_DISTRIBUTION):
+		"""
+		Args:
+			usable_chars (list): List of lists of characters to be used in password generation. It isn't modified.
+			excluded_chars (list): Characters removed from usable_chars.
+			excluded_words (list): Words (str) which may not appear in passwords.
+			min_pass_len (int): Minimum length of passwords.
+			max_pass_len (int): Maximum length of passwords.
+			excluded_ignore_case (bool): Determines if excluded words are found regardless of upper and lower case.
+			excluded_leet (bool): Determines if excluded words are also found when letters are replaced by look-alike
+								  characters.
+			char_distribution (str): Distribution of random characters, one of alphabet.DISTRIBUTIONS.
+		"""
+		key = self.make_key(usable_chars, excluded_chars, excluded_words, min_pass_len, max_pass_len,
+							excluded_ignore_case, excluded_leet, char_distribution)
+		usable_chars, excluded_chars, excluded_words = key[:3]
+
+		set_attribute = super().__setattr__
+		set_attribute('key', key)
+		set_attribute('usable_chars', tuple(tuple(char for char in group if char not in excluded_chars)
+											for group in usable_chars))
+		set_attribute('excluded_chars', excluded_chars)
+		set_attribute('excluded_words', excluded_words)
+		set_attribute('min_pass_len', min_pass_len)
+		set_attribute('max_pass_len', max_pass_len)
+		set_attribute('excluded_ignore_case', excluded_ignore_case)
+		set_attribute('excluded_leet', excluded_leet)
+		set_attribute('char_distribution', char_distribution)
+
+		# Indexes of the usable_chars groups each character belongs to, read-only like the other attributes.
+		char_groups = {}
+		for index, group in enumerate(self.usable_chars):
+			for char in group:
+				char_groups[char] = char_groups.get(char, ()) + (index,)
+		set_attribute('char_groups', types.MappingProxyType(char_groups))
+
+		set_attribute('lengths', tuple(range(min_pass_len, max_pass_len + 1)))
+		set_attribute('alphabet', Alphabet(self.usable_chars, distribution=char_distribution))
+		set_attribute('excluded_matcher', WordMatcher(excluded_words, ignore_case=excluded_ignore_case,
+													  leet=excluded_leet))
+
+		# Letter runs checked for English words by PyPass.filter_words().
+		set_attribute('word_pattern', re.compile('[a-zA-Z]+'))
+
+	@staticmethod
+	def make_key(usable_chars, excluded_chars, excluded_words, min_pass_len, max_pass_len, excluded_ignore_case,
+				 excluded_leet, char_distribution):
+		# The rules as a hashable tuple, in the order of the arguments of __init__().
+		return (tuple(tuple(group) for group in usable_chars), tuple(excluded_chars), tuple(excluded_words),
+				min_pass_len, max_pass_len, excluded_ignore_case, excluded_leet, char_distribution)
+
+	@classmethod
+	def get(cls, usable_chars=USABLE_CHARS, excluded_chars=EXCLUDED_CHARS, excluded_words=EXCLUDED_WORDS,
+			min_pass_len=MIN_PASS_LEN, max_pass_len=MAX_PASS_LEN, excluded_ignore_case=EXCLUDED_IGNORE_CASE,
+			excluded_leet=EXCLUDED_LEET, char_distribution=CHAR_DISTRIBUTION):
+		"""
+		Returns the policy with the given rules, made once and then shared, as long as it stays among the
+		POLICY_CACHE_SIZE most recently used policies. Takes the same arguments as PasswordPolicy().
+		"""
+		key = cls.make_key(usable_chars, excluded_chars, excluded_words, min_pass_len, max_pass_len,
+						   excluded_ignore_case, excluded_leet, char_distribution)
+
+		with _policies_lock:
+			policy = _policies.get(key)
+			if policy is not None:
+				_policies.move_to_end(key)
+				return policy
+
+		# Made outside of the lock, so other threads aren't held up by a large list of excluded words.
+		policy = cls(*key)
+
+		with _policies_lock:
+			policy = _policies.setdefault(key, policy)
+			_policies.move_to_end(key)
+			while len(_policies) > POLICY_CACHE_SIZE:
+				_policies.popitem(last=False)
+
+		return policy
+
+	def __setattr__(self, name, value):
+		raise AttributeError(f"PasswordPolicy is immutable, '{name}' can't be set.")
+
+	def __delattr__(self, name):
+		raise AttributeError(f"PasswordPolicy is immutable, '{name}' can't be deleted.")
+
+	def __eq__(self, other):
+		return isinstance(other, PasswordPolicy) and self.key == other.key
+
+	def __hash__(self):
+		return hash(self.key)
+
+	def __reduce__(self):
+		# Unpickled from the cache, e.g. once in each worker process of PyPass.generate_bulk().
+		return PasswordPolicy.get, self.key
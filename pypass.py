@@ -1,15 +1,48 @@
 import ast
+import json
 import string
+import sys
 
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
 from password import PyPass
-from settings import EXCLUDED_WORDS, USABLE_CHARS, EXCLUDED_CHARS, MIN_PASS_LEN, MAX_PASS_LEN, FIXED_LEN
-from language import ModelManager
+from settings import EXCLUDED_WORDS, USABLE_CHARS, EXCLUDED_CHARS, MIN_PASS_LEN, MAX_PASS_LEN, FIXED_LEN, BREACH_INDEX, \
+    BREACH_FILTER, BREACH_FILTER_FP_RATE, EXCLUDED_IGNORE_CASE, EXCLUDED_LEET, DIRECT_SAMPLING, \
+    CHAR_DISTRIBUTION, DEDUP_METHOD, DEDUP_MEMORY_LIMIT, SERVE_HOST, SERVE_PORT, SERVE_SOCKET_MODE, \
+    DISTRIBUTION_SAMPLES, DISTRIBUTION_ALPHA
+from alphabet import DISTRIBUTIONS
+from dedup import DEDUP_METHODS
+from distribution import ENGINES, DEFAULT_ENGINES, check_distribution
+from breach import HASH_TYPES, build_index, build_filter, get_breach_checker
+import bench
 
 module_name = "Pypass: quickly generate passwords with Python."
 __version__ = "0.0.2"
 
+# Size of the buffer passwords are written through with --output.
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+
+"""
+Writes passwords, one per line, to a file or to stdout if path is '-', as they are generated.
+"""
+
+
+def write_passwords(passwords, path):
+    if path == '-':
+        sys.stdout.flush()
+        output = open(sys.stdout.fileno(), 'w', buffering=OUTPUT_BUFFER_SIZE, closefd=False)
+    else:
+        output = open(path, 'w', buffering=OUTPUT_BUFFER_SIZE)
+
+    count = 0
+    with output:
+        for password in passwords:
+            output.write(password + '\n')
+            count += 1
+
+    return count
+
 
 """
 Converts any numbers in a list and its nested lists into a string.
@@ -78,6 +111,31 @@ def main():
                              "If not defined, EXCLUDED_WORDS from settings.py will be used."
                         )
 
+    parser.add_argument("--excluded_ignore_case", "-eic",
+                        action="store_true", dest="excluded_ignore_case",
+                        help="Excluded words will be found regardless of upper and lower case."
+                        )
+
+    parser.add_argument("--excluded_leet", "-el",
+                        action="store_true", dest="excluded_leet",
+                        help="Excluded words will also be found when letters are replaced by look-alike characters, "
+                             "e.g. 'p4$$w0rd' for 'password'."
+                        )
+
+    parser.add_argument("--direct", "-ds",
+                        action="store_true", dest="direct_sampling",
+                        help="Passwords will be built so that the rules hold by construction, instead of being "
+                             "repaired after they are generated. Passwords are uniformly distributed over all the "
+                             "passwords satisfying the rules."
+                        )
+
+    parser.add_argument("--char_distribution", "-cd", metavar='CHAR_DISTRIBUTION',
+                        action="store", dest="char_distribution", default=CHAR_DISTRIBUTION, choices=DISTRIBUTIONS,
+                        help="Distribution of random characters: 'groups' picks a list of usable characters first "
+                             "and then a character from it, 'uniform' picks any character with the same probability. "
+                             "If not defined, CHAR_DISTRIBUTION from settings.py will be used."
+                        )
+
     parser.add_argument("--remove_english", "-re", metavar='REMOVE_ENGLISH',
                         action="store", dest="remove_english", default=False,
                         help="If not False, will cause English words to be removed from the passwords."
@@ -154,22 +212,218 @@ def main():
                         help="Delete nltk trigram model."
                         )
 
+    parser.add_argument("--workers", "-w", metavar='WORKERS',
+                        action="store", dest="workers", type=int, default=None,
+                        help="Number of processes generating passwords in parallel. Generated passwords are unique."
+                        )
+
+    parser.add_argument("--output", "-o", metavar='OUTPUT',
+                        action="store", dest="output", default=None,
+                        help="Path of a file the passwords are written to, one per line, as they are generated, or "
+                             "'-' for stdout. Passwords are not kept in memory, so any number of them can be generated."
+                        )
+
+    parser.add_argument("--unique", "-uq",
+                        action="store_true", dest="unique",
+                        help="Every generated password will be different from all the others. The number of dropped "
+                             "duplicates is reported on stderr."
+                        )
+
+    parser.add_argument("--dedup_method", "-dm", metavar='DEDUP_METHOD',
+                        action="store", dest="dedup_method", default=DEDUP_METHOD, choices=DEDUP_METHODS,
+                        help="Method used to remember generated passwords: 'digest' keeps an 8 byte digest of each "
+                             "password, 'bloom' a Bloom filter of about 2 bytes per password, for batches which don't "
+                             "fit into memory. If not defined, DEDUP_METHOD from settings.py will be used."
+                        )
+
+    parser.add_argument("--dedup_memory", "-dmem", metavar='BYTES',
+                        action="store", dest="dedup_memory", type=int, default=DEDUP_MEMORY_LIMIT,
+                        help="Largest size in bytes of the set of generated passwords. "
+                             "If not defined, DEDUP_MEMORY_LIMIT from settings.py will be used."
+                        )
+
+    parser.add_argument("--stats", "-st", metavar='FORMAT',
+                        action="store", dest="stats", default=None, choices=['json', 'prometheus'],
+                        help="Collects counters and timings of each stage of generation and writes them to stderr "
+                             "once the passwords are generated, as 'json' or 'prometheus' text."
+                        )
+
+    parser.add_argument("--breach_index", "-bi", metavar='BREACH_INDEX',
+                        action="store", dest="breach_index", default=BREACH_INDEX,
+                        help="Path to a local breach index, used instead of the haveibeenpwned API. "
+                             "If not defined, BREACH_INDEX from settings.py will be used."
+                        )
+
+    parser.add_argument("--breach_filter", "-bf", metavar='BREACH_FILTER',
+                        action="store", dest="breach_filter", default=BREACH_FILTER,
+                        help="Path to a Bloom filter of breached passwords, consulted before any other check. "
+                             "If not defined, BREACH_FILTER from settings.py will be used."
+                        )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    build_index_parser = subparsers.add_parser("build-index",
+                                               help="Build a local breach index from a Pwned Passwords dump."
+                                               )
+
+    build_index_parser.add_argument("source", metavar='SOURCE',
+                                    help="Text file with one hash per line, ordered by hash."
+                                    )
+
+    build_index_parser.add_argument("destination", metavar='DESTINATION',
+                                    help="Path of the index file to be written."
+                                    )
+
+    build_index_parser.add_argument("--hash_type", "-ht", metavar='HASH_TYPE',
+                                    action="store", dest="hash_type", default="sha1", choices=sorted(HASH_TYPES),
+                                    help="Type of hashes in the dump, 'sha1' or 'ntlm'."
+                                    )
+
+    build_filter_parser = subparsers.add_parser("build-filter",
+                                                help="Build a Bloom filter from a Pwned Passwords dump."
+                                                )
+
+    build_filter_parser.add_argument("source", metavar='SOURCE',
+                                     help="Text file with one hash per line."
+                                     )
+
+    build_filter_parser.add_argument("destination", metavar='DESTINATION',
+                                     help="Path of the filter file to be written."
+                                     )
+
+    build_filter_parser.add_argument("--fp_rate", "-fp", metavar='FALSE_POSITIVE_RATE',
+                                     action="store", dest="fp_rate", type=float, default=BREACH_FILTER_FP_RATE,
+                                     help="Probability that a password which was never breached is regenerated. "
+                                          "Lower rates make larger filters."
+                                     )
+
+    build_filter_parser.add_argument("--hash_type", "-ht", metavar='HASH_TYPE',
+                                     action="store", dest="hash_type", default="sha1", choices=sorted(HASH_TYPES),
+                                     help="Type of hashes in the dump, 'sha1' or 'ntlm'."
+                                     )
+
+    build_filter_parser.add_argument("--capacity", "-c", metavar='CAPACITY',
+                                     action="store", dest="capacity", type=int, default=None,
+                                     help="Number of hashes in the dump. If not defined, the dump is read twice."
+                                     )
+
+    bench_parser = subparsers.add_parser("bench",
+                                         help="Benchmark every generation mode and filter stage."
+                                         )
+
+    bench.add_arguments(bench_parser)
+
+    serve_parser = subparsers.add_parser("serve",
+                                         help="Keep password generators warm and answer JSON requests over HTTP."
+                                         )
+
+    serve_parser.add_argument("--host", "-ip", metavar='HOST',
+                              action="store", dest="host", default=SERVE_HOST,
+                              help="Address the server listens on."
+                              )
+
+    serve_parser.add_argument("--port", "-po", metavar='PORT',
+                              action="store", dest="port", type=int, default=SERVE_PORT,
+                              help="Port the server listens on."
+                              )
+
+    serve_parser.add_argument("--socket", "-us", metavar='PATH',
+                              action="store", dest="socket", default=None,
+                              help="Path of a Unix socket the server listens on, instead of host and port."
+                              )
+
+    serve_parser.add_argument("--socket_mode", "-um", metavar='MODE',
+                              action="store", dest="socket_mode", type=lambda mode: int(mode, 8),
+                              default=SERVE_SOCKET_MODE,
+                              help="Octal permissions of the Unix socket, e.g. 660 to let its group connect. "
+                                   "Only its owner can connect by default."
+                              )
+
+    serve_parser.add_argument("--warm", "-pw", metavar='REQUEST',
+                              action="append", dest="warm", type=json.loads, default=[],
+                              help="JSON parameters of a request to prepare for before serving, e.g. "
+                                   "'{\"lang_lib\": \"odyssey\"}'. Can be repeated."
+                              )
+
+    entropy_parser = subparsers.add_parser("entropy",
+                                           help="Compute the entropy and keyspace of the configured passwords."
+                                           )
+
+    entropy_parser.add_argument("--json", "-js",
+                                action="store_true", dest="json",
+                                help="Writes the result as JSON, including the entropy of each length."
+                                )
+
+    distribution_parser = subparsers.add_parser("distribution",
+                                                help="Test the character distribution of the configured passwords, "
+                                                     "comparing generation engines."
+                                                )
+
+    distribution_parser.add_argument("--samples", "-ns", metavar='COUNT',
+                                     action="store", dest="samples", type=int, default=DISTRIBUTION_SAMPLES,
+                                     help="Number of passwords generated by each engine."
+                                     )
+
+    distribution_parser.add_argument("--engines", "-en", metavar='ENGINE', nargs='+',
+                                     action="store", dest="engines", choices=ENGINES, default=DEFAULT_ENGINES,
+                                     help=f"Engines compared with the first one, from {ENGINES}."
+                                     )
+
+    distribution_parser.add_argument("--alpha", "-al", metavar='ALPHA',
+                                     action="store", dest="alpha", type=float, default=DISTRIBUTION_ALPHA,
+                                     help="Significance level of all the tests together."
+                                     )
+
+    distribution_parser.add_argument("--json", "-js",
+                                     action="store_true", dest="json",
+                                     help="Writes the result as JSON."
+                                     )
+
     args = parser.parse_args()
 
+    if args.command == "bench":
+        sys.exit(bench.main(args))
+
+    if args.command == "serve":
+        # The server is only imported here, as it loads http.server.
+        from server import PasswordService, serve
+        service = PasswordService(breach_checker=get_breach_checker(args.breach_index, args.breach_filter))
+        serve(service, host=args.host, port=args.port, socket_path=args.socket, warm=args.warm,
+              socket_mode=args.socket_mode)
+        return
+
+    if args.command == "build-index":
+        count = build_index(args.source, args.destination, hash_type=args.hash_type)
+        print(f'{count} hashes written to {args.destination}.')
+        return
+
+    if args.command == "build-filter":
+        bloom_filter = build_filter(args.source, args.destination, false_positive_rate=args.fp_rate,
+                                    hash_type=args.hash_type, capacity=args.capacity)
+        print(f'{len(bloom_filter)} hashes written to {args.destination} ({bloom_filter.size} bytes, '
+              f'expected false positive rate {bloom_filter.false_positive_rate:.6f}).')
+        bloom_filter.close()
+        return
+
     if args.save_model and args.delete_model:
         raise ValueError("Cannot both save and delete a model.")
 
     elif args.delete_model:
         model_name = args.delete_model
+        from language import ModelManager
         ModelManager(model_name).delete()
         return
 
     elif args.save_model:
         model_name = args.save_model
+        from language import ModelManager
         ModelManager(model_name).make_model(source='l')
         return
 
     pass_no = int(args.number_of_passwords)
+    breach_checker = get_breach_checker(args.breach_index, args.breach_filter)
+    options = dict(unique=args.unique, dedup_method=args.dedup_method, dedup_memory_limit=args.dedup_memory,
+                   collect_stats=args.stats is not None)
 
     # Raise an exception in case minimum number of chars is greater than the maximum.
     if int(args.min_pass_len) >= int(args.max_pass_len):
@@ -209,12 +463,16 @@ def main():
 
         password_generator = PyPass(usable_chars=usable_chars, excluded_chars=[],
                                     min_pass_len=int(args.min_pass_len), max_pass_len=int(args.max_pass_len),
-                                    excluded_words=[])
-        password_generator.generate_password(pass_number=pass_no, fixed_len=is_fixed)
+                                    excluded_words=[], breach_checker=breach_checker, **options)
+        arguments = dict(fixed_len=is_fixed)
+
+    elif args.lang_lib is not None:
+        if args.workers:
+            parser.error("--workers/-w cannot be combined with --lang_lib/-ll, sentences are generated by a single "
+                         "process.")
 
-    if args.lang_lib is not None:
-        password_generator = PyPass(min_pass_len=int(args.min_pass_len), max_pass_len=int(args.max_pass_len), language_lib=args.lang_lib, include_whitespace=ast.literal_eval(args.incl_wspace))
-        password_generator.generate_sentence_pass(pass_number=pass_no)
+        password_generator = PyPass(min_pass_len=int(args.min_pass_len), max_pass_len=int(args.max_pass_len), language_lib=args.lang_lib, include_whitespace=ast.literal_eval(args.incl_wspace), breach_checker=breach_checker, **options)
+        arguments = dict(sentences=True)
 
     else:
 
@@ -240,21 +498,58 @@ def main():
         password_generator = PyPass(usable_chars=usable_chars, excluded_chars=excluded_chars,
                                     min_pass_len=int(args.min_pass_len), max_pass_len=int(args.max_pass_len),
                                     excluded_words=excluded_words, remove_repeating=remove_repeating,
-                                    remove_english=remove_english, ensure_proportions=ensure_proportions)
+                                    remove_english=remove_english, ensure_proportions=ensure_proportions,
+                                    breach_checker=breach_checker,
+                                    excluded_ignore_case=args.excluded_ignore_case or EXCLUDED_IGNORE_CASE,
+                                    excluded_leet=args.excluded_leet or EXCLUDED_LEET,
+                                    direct_sampling=args.direct_sampling or DIRECT_SAMPLING,
+                                    char_distribution=args.char_distribution, **options)
+
+        arguments = dict(human=args.human, remove_repeating=remove_repeating, remove_english=remove_english,
+                         check_proportions=ensure_proportions, fixed_len=is_fixed)
+
+    # Computed for the same generator and rules as the passwords would be generated with.
+    if args.command == "entropy":
+        entropy = password_generator.entropy(**arguments)
+        print(json.dumps(entropy.to_dict(), indent=2) if args.json else entropy)
+        return entropy
+
+    # Exits with a non-zero status when any engine's distribution is off, so it can gate changes to the engines.
+    if args.command == "distribution":
+        if args.lang_lib is not None:
+            raise ValueError("Distributions are only tested for random passwords, not sentences.")
+        report = check_distribution(password_generator, samples=args.samples, engines=args.engines, alpha=args.alpha,
+                                    **arguments)
+        print(json.dumps(report.to_dict(), indent=2) if args.json else report)
+        sys.exit(0 if report.passed else 1)
+
+    if args.workers:
+        passwords = password_generator.iter_bulk(pass_number=pass_no, workers=args.workers, **arguments)
+    else:
+        passwords = password_generator.iter_passwords(pass_number=pass_no, **arguments)
 
-        if args.human:
-            password_generator.generate_human_password(pass_number=pass_no, fixed_len=is_fixed)
-        else:
-            password_generator.generate_password(pass_number=pass_no, remove_repeating=remove_repeating,
-                                                 remove_english=remove_english, check_proportions=ensure_proportions,
-                                                 fixed_len=is_fixed)
+    if args.output is not None:
+        count = write_passwords(passwords, args.output)
+    else:
+        passwords = list(passwords)
+
+    if args.unique or args.workers:
+        print(f"{password_generator.rejections['duplicate']} duplicate passwords dropped.", file=sys.stderr)
+
+    if args.stats == 'json':
+        print(password_generator.stats.to_json(indent=2), file=sys.stderr)
+    elif args.stats == 'prometheus':
+        print(password_generator.stats.to_prometheus(), end='', file=sys.stderr)
+
+    if args.output is not None:
+        return count
 
-    if len(password_generator.all_passwords) == 1:
-        print(password_generator.all_passwords[0])
-        return password_generator.all_passwords[0]
+    if len(passwords) == 1:
+        print(passwords[0])
+        return passwords[0]
 
-    print(password_generator.all_passwords)
-    return password_generator.all_passwords
+    print(passwords)
+    return passwords
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import secrets
+import threading
+
+# Number of bytes SeededRandomness derives at a time.
+SEEDED_BLOCK_SIZE = 4096
+
+
+class SystemRandomness:
+	"""
+	Randomness of the operating system, through os.urandom() and secrets. Used by default for all passwords.
+
+	Every source of randomness has the same methods: token_bytes(count), randbelow(n), choice(sequence) and
+	spawn(key), which returns an independent source for a part of the work, e.g. a shard of generate_bulk().
+	"""
+
+	# Determines if the passwords drawn from this source can be used as real passwords.
+	secure = True
+
+	def token_bytes(self, count):
+		"""
+		Returns count random bytes.
+		"""
+		return os.urandom(count)
+
+	def randbelow(self, n):
+		"""
+		Returns a random integer in [0, n).
+		"""
+		return secrets.randbelow(n)
+
+	def choice(self, sequence):
+		"""
+		Returns a random element of a non-empty sequence.
+		"""
+		return secrets.choice(sequence)
+
+	def spawn(self, key):
+		# The operating system never repeats itself, so every part of the work can share it.
+		return self
+
+	def __reduce__(self):
+		# Unpickled as the SYSTEM_RANDOMNESS of the worker process, so it is recognized as the default there as well.
+		return 'SYSTEM_RANDOMNESS'
+
+	def __repr__(self):
+		return 'SystemRandomness()'
+
+
+SYSTEM_RANDOMNESS = SystemRandomness()
+
+
+class SeededRandomness:
+	"""
+	FOR TESTS AND BENCHMARKS ONLY. Its passwords are as predictable as its seed and must never be used.
+
+	Deterministic random bit generator: bytes are derived from the seed in blocks of SEEDED_BLOCK_SIZE, each the
+	SHAKE-256 output of the seed and the block number. The same seed always gives the same bytes, on any platform and
+	Python version, so the same seed makes a generator do the same work: the same passwords, repairs and retries.
+
+		p = PyPass(randomness=SeededRandomness(42))
+	"""
+
+	secure = False
+
+	def __init__(self, seed=0):
+		"""
+		Args:
+			seed: Seed of the generator. Any value with a stable repr(), e.g. an int, str or tuple of them.
+		"""
+		self.seed = seed
+		self._key = hashlib.sha256(repr(seed).encode()).digest()
+		self._block = 0
+		self._buffer = b''
+		self._offset = 0
+		self._lock = threading.Lock()
+
+	def token_bytes(self, count):
+		"""
+		Returns the next count bytes of the generator.
+		"""
+		with self._lock:
+			chunks = []
+			while count > 0:
+				if self._offset == len(self._buffer):
+					self._buffer = hashlib.shake_256(self._key + self._block.to_bytes(8, 'little')).digest(
+						SEEDED_BLOCK_SIZE)
+					self._block += 1
+					self._offset = 0
+
+				chunk = self._buffer[self._offset:self._offset + count]
+				self._offset += len(chunk)
+				count -= len(chunk)
+				chunks.append(chunk)
+
+		return b''.join(chunks)
+
+	def randbelow(self, n):
+		"""
+		Returns an integer in [0, n), read from as many bits as n needs by rejection sampling.
+		"""
+		if n <= 0:
+			raise ValueError('Upper bound must be positive.')
+		if n == 1:
+			return 0
+
+		# Values below n fit in the bits of n - 1, so powers of two are never rejected.
+		bits = (n - 1).bit_length()
+		size = (bits + 7) // 8
+		while True:
+			value = int.from_bytes(self.token_bytes(size), 'little') >> (size * 8 - bits)
+			if value < n:
+				return value
+
+	def choice(self, sequence):
+		"""
+		Returns an element of a non-empty sequence.
+		"""
+		if not sequence:
+			raise IndexError('Cannot choose from an empty sequence')
+		return sequence[self.randbelow(len(sequence))]
+
+	def spawn(self, key):
+		"""
+		Returns a new generator, seeded with this generator's seed and key, whatever was drawn from this one so far.
+		"""
+		return SeededRandomness((self.seed, key))
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['_lock']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._lock = threading.Lock()
+
+	def __repr__(self):
+		return f'SeededRandomness({self.seed!r})'
@@ -0,0 +1,156 @@
+import secrets
+import string
+
+from settings import MAX_ATTEMPTS
+
+
+class ConstrainedSampler:
+	"""
+	Generates passwords left to right, so that the rules hold by construction instead of being repaired afterwards.
+
+	Characters are split into classes of characters belonging to the same usable_chars groups. For every length,
+	the number of valid completions is counted by dynamic programming over the remaining length, the groups already
+	used and the class of the previous character. Each character is then drawn with a probability proportional to the
+	number of valid passwords it leads to, which makes every password satisfying the no-repeat and proportion rules
+	equally likely, and never leads to a dead end.
+
+	Excluded and English words are followed while the password is built, with the excluded words automaton and by
+	looking up the letters ending at each position. A candidate which completes such a word is discarded as soon as
+	it does and started over, which keeps the passwords uniformly distributed over the remaining valid ones.
+	"""
+
+	def __init__(self, usable_chars, no_repeats=False, all_groups=False, matcher=None, dictionary=None,
+				 randbelow=secrets.randbelow, max_attempts=MAX_ATTEMPTS):
+		"""
+		Args:
+			usable_chars (list): List of lists of characters to be used in password generation.
+			no_repeats (bool): Determines if the same character may not follow itself.
+			all_groups (bool): Determines if each non-empty list of usable_chars must be used at least once.
+			matcher (WordMatcher): Excluded words, which may not appear in the password.
+			dictionary (EnglishDictionary): English words of more than 3 letters, which may not appear in the password.
+			randbelow (callable): Returns a random integer in [0, n).
+			max_attempts (int): Maximum number of candidates started for a single password.
+		"""
+		groups = [group for group in usable_chars if group]
+		if not groups:
+			raise ValueError('No usable characters.')
+
+		masks = {}
+		for index, group in enumerate(groups):
+			for char in group:
+				masks[str(char)] = masks.get(str(char), 0) | 1 << index
+
+		classes = {}
+		for char, mask in masks.items():
+			classes.setdefault(mask, []).append(char)
+
+		self.class_masks = list(classes)
+		self.class_chars = [sorted(chars) for chars in classes.values()]
+		self.char_class = {char: index for index, chars in enumerate(self.class_chars) for char in chars}
+		self.full_mask = (1 << len(groups)) - 1
+
+		self.no_repeats = no_repeats
+		self.all_groups = all_groups
+		self.matcher = matcher if matcher else None
+		self.dictionary = dictionary
+		self.randbelow = randbelow
+		self.max_attempts = max_attempts
+
+		# Number of candidates discarded because they formed an excluded or English word.
+		self.restarts = 0
+
+		self._ways = {}
+
+	def count(self, length, used=0, last_class=-1):
+		"""
+		Returns the number of ways to complete a password with length more characters, satisfying the no-repeat and
+		proportion rules, when the groups in the mask used are already in the password and the previous character
+		belongs to class last_class (-1 at the start of the password).
+		"""
+		key = (length, used, last_class)
+		ways = self._ways.get(key)
+
+		if ways is None:
+			if length == 0:
+				ways = int(not self.all_groups or used == self.full_mask)
+			else:
+				ways = sum(self._choices(index, last_class) * self.count(length - 1, used | mask, index)
+						   for index, mask in enumerate(self.class_masks))
+			self._ways[key] = ways
+
+		return ways
+
+	def _choices(self, index, last_class):
+		# Characters of a class which may follow a character of last_class.
+		return len(self.class_chars[index]) - (self.no_repeats and index == last_class)
+
+	def sample(self, length):
+		"""
+		Returns a list of length characters, drawn uniformly from all the passwords satisfying the rules.
+
+		Args:
+			length (int): Length of the password.
+		"""
+		if self.count(length) == 0:
+			raise ValueError(f'No password of length {length} satisfies the rules.')
+
+		for attempt in range(self.max_attempts):
+			password = self._build(length)
+			if password is not None:
+				return password
+			self.restarts += 1
+
+		raise RuntimeError(f"Every password started in {self.max_attempts} attempts formed an excluded word.")
+
+	def _build(self, length):
+		"""
+		Builds a single candidate, or returns None as soon as it forms an excluded or English word.
+		"""
+		password = []
+		used = 0
+		last_class = -1
+		node = 0
+		letters = 0
+
+		for position in range(length):
+			remaining = length - position - 1
+			weights = [self._choices(index, last_class) * self.count(remaining, used | mask, index)
+					   for index, mask in enumerate(self.class_masks)]
+
+			draw = self.randbelow(sum(weights))
+			index = 0
+			while draw >= weights[index]:
+				draw -= weights[index]
+				index += 1
+
+			chars = self.class_chars[index]
+			if self.no_repeats and index == last_class:
+				# Skipping the previous character, which is the only one of its class that can't follow.
+				choice = self.randbelow(len(chars) - 1)
+				if chars[choice] >= password[-1]:
+					choice += 1
+			else:
+				choice = self.randbelow(len(chars))
+
+			char = chars[choice]
+			password.append(char)
+			used |= self.class_masks[index]
+			last_class = index
+
+			if self.matcher is not None:
+				node = self.matcher.advance(node, char)
+				if self.matcher.is_match(node):
+					return None
+
+			if self.dictionary is not None:
+				letters = letters + 1 if char in string.ascii_letters else 0
+				if letters > 3 and self._ends_with_word(password, letters):
+					return None
+
+		return password
+
+	def _ends_with_word(self, password, letters):
+		# Checks every English word of more than 3 letters ending at the last character.
+		longest = min(letters, self.dictionary.max_length + 4)
+		tail = ''.join(password[-longest:])
+		return any(self.dictionary.is_word(tail[-size:]) for size in range(4, longest + 1))
@@ -0,0 +1,382 @@
+import json
+import os
+import re
+import socketserver
+import stat
+import string
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from password import PyPass
+from breach import get_breach_checker
+from settings import USABLE_CHARS, EXCLUDED_CHARS, EXCLUDED_WORDS, MIN_PASS_LEN, MAX_PASS_LEN, FIXED_LEN, \
+	EXCLUDED_IGNORE_CASE, EXCLUDED_LEET, DIRECT_SAMPLING, CHAR_DISTRIBUTION, SERVE_HOST, SERVE_PORT, SERVE_CACHE_SIZE, \
+	SERVE_MAX_PASSWORDS, SERVE_MAX_BATCH, SERVE_MAX_BODY, SERVE_SOCKET_MODE, SERVE_MAX_LEN
+
+# Parameters of a request and their defaults, named after the long options of pypass.py.
+PARAMETERS = {
+	'password_number': 1,
+	'min_len': MIN_PASS_LEN,
+	'max_len': MAX_PASS_LEN,
+	'fix_len': FIXED_LEN,
+	'usable_chars': None,
+	'excluded_chars': None,
+	'excluded_words': None,
+	'excluded_ignore_case': EXCLUDED_IGNORE_CASE,
+	'excluded_leet': EXCLUDED_LEET,
+	'direct': DIRECT_SAMPLING,
+	'char_distribution': CHAR_DISTRIBUTION,
+	'remove_english': False,
+	'remove_repeating': False,
+	'ensure_proportions': False,
+	'human': False,
+	'simple': False,
+	'digi': False,
+	'lower': False,
+	'upper': False,
+	'punct': False,
+	'remove_quote': False,
+	'lang_lib': None,
+	'incl_wspace': True,
+}
+
+# Names of the language libraries a request may use. They name files of MODEL_DIR and TEMPLATE_DIR, so they can't
+# hold a path.
+LIBRARY_NAME = re.compile('[A-Za-z0-9_-]+')
+
+# Character groups of the simple mode, each with the parameter excluding it.
+SIMPLE_GROUPS = [
+	('lower', string.ascii_lowercase),
+	('upper', string.ascii_uppercase),
+	('digi', string.digits),
+	('punct', string.punctuation),
+]
+
+
+def _strings(value):
+	# Numbers in (nested) lists become strings, like convert_to_strings() of pypass.py does.
+	if isinstance(value, list):
+		return [_strings(item) for item in value]
+	return str(value)
+
+
+def parse_request(params):
+	"""
+	Translates the parameters of a request into the options of a PyPass instance and the arguments of its
+	iter_passwords(), the same way pypass.py translates its command line. Raises a ValueError if a parameter is
+	invalid.
+
+	Args:
+		params (dict): Parameters of the request, see PARAMETERS.
+	"""
+	if not isinstance(params, dict):
+		raise ValueError('A request must be a JSON object.')
+
+	unknown = sorted(set(params) - set(PARAMETERS))
+	if unknown:
+		raise ValueError(f"Unknown parameters: {', '.join(unknown)}.")
+
+	params = dict(PARAMETERS, **params)
+
+	number = params['password_number']
+	if not isinstance(number, int) or not 1 <= number <= SERVE_MAX_PASSWORDS:
+		raise ValueError(f'password_number must be an integer from 1 to {SERVE_MAX_PASSWORDS}.')
+
+	min_len, max_len = int(params['min_len']), int(params['max_len'])
+	if min_len >= max_len:
+		raise ValueError('min_len must be lower than max_len.')
+	# Lengths are bounded, as the policy and the passwords of a request grow with them.
+	if min_len < 1 or max_len > SERVE_MAX_LEN:
+		raise ValueError(f'min_len and max_len must be from 1 to {SERVE_MAX_LEN}.')
+
+	options = dict(min_pass_len=min_len, max_pass_len=max_len)
+	arguments = dict(pass_number=number)
+	fixed_len = int(params['fix_len']) if params['fix_len'] else params['fix_len']
+	if fixed_len and not 1 <= fixed_len <= SERVE_MAX_LEN:
+		raise ValueError(f'fix_len must be from 1 to {SERVE_MAX_LEN}.')
+
+	if params['simple']:
+		usable_chars = [list(chars) for flag, chars in SIMPLE_GROUPS if not params[flag]]
+		if not usable_chars:
+			raise ValueError('Cannot exclude all usable characters.')
+		if params['remove_quote'] and not params['punct']:
+			usable_chars[-1].remove("'")
+
+		options.update(usable_chars=usable_chars, excluded_chars=[], excluded_words=[])
+		arguments.update(fixed_len=fixed_len)
+
+	elif params['lang_lib'] is not None:
+		if not isinstance(params['lang_lib'], str) or not LIBRARY_NAME.fullmatch(params['lang_lib']):
+			raise ValueError('lang_lib must be made of letters, digits, underscores and hyphens.')
+		options.update(language_lib=params['lang_lib'], include_whitespace=bool(params['incl_wspace']))
+		arguments.update(sentences=True)
+
+	else:
+		for name in ('usable_chars', 'excluded_chars', 'excluded_words'):
+			if params[name] is not None and not isinstance(params[name], list):
+				raise ValueError(f'{name} must be a list.')
+
+		usable_chars = params['usable_chars']
+		if usable_chars is not None and not all(isinstance(group, list) for group in usable_chars):
+			raise ValueError('usable_chars must be a list of lists of characters.')
+
+		options.update(
+			usable_chars=_strings(usable_chars) if usable_chars is not None else USABLE_CHARS,
+			excluded_chars=_strings(params['excluded_chars'] if params['excluded_chars'] is not None else EXCLUDED_CHARS),
+			excluded_words=_strings(params['excluded_words'] if params['excluded_words'] is not None else EXCLUDED_WORDS),
+			excluded_ignore_case=bool(params['excluded_ignore_case']),
+			excluded_leet=bool(params['excluded_leet']),
+			direct_sampling=bool(params['direct']),
+			char_distribution=params['char_distribution'],
+		)
+		arguments.update(human=bool(params['human']), remove_repeating=bool(params['remove_repeating']),
+						 remove_english=bool(params['remove_english']),
+						 check_proportions=bool(params['ensure_proportions']), fixed_len=fixed_len)
+
+	return options, arguments
+
+
+class PasswordService:
+	"""
+	Answers generation requests with warm PyPass instances, one for each distinct set of options, kept in a least
+	recently used cache. Language models and the English dictionary are loaded once, by the first request needing
+	them. Each instance serves one request at a time, while requests with different options run concurrently.
+
+		service = PasswordService()
+		service.handle({'password_number': 2, 'fix_len': 16})
+		service.handle([{'simple': True}, {'human': True}])
+	"""
+
+	def __init__(self, breach_checker=None, cache_size=SERVE_CACHE_SIZE):
+		"""
+		Args:
+			breach_checker (BreachChecker): Object used to check passwords against breached passwords, shared by all
+											instances. If not defined, the one described by settings.py is used.
+			cache_size (int): Number of PyPass instances kept.
+		"""
+		self.breach_checker = breach_checker or get_breach_checker()
+		self.cache_size = cache_size
+		self.generators = OrderedDict()
+		self._lock = threading.Lock()
+
+	def generator(self, options):
+		"""
+		Returns the lock and the PyPass instance of a set of options, made if it isn't cached.
+
+		Args:
+			options (dict): Arguments of PyPass.
+		"""
+		key = json.dumps(options, sort_keys=True)
+
+		with self._lock:
+			entry = self.generators.get(key)
+			if entry is not None:
+				self.generators.move_to_end(key)
+				return entry
+
+		# Made outside of the lock, so requests with cached options aren't held up.
+		entry = (threading.Lock(), PyPass(breach_checker=self.breach_checker, **options))
+
+		with self._lock:
+			entry = self.generators.setdefault(key, entry)
+			self.generators.move_to_end(key)
+			while len(self.generators) > self.cache_size:
+				self.generators.popitem(last=False)
+
+		return entry
+
+	def generate(self, params):
+		"""
+		Returns the list of passwords asked for by a request.
+
+		Args:
+			params (dict): Parameters of the request, see PARAMETERS.
+		"""
+		options, arguments = parse_request(params)
+		lock, generator = self.generator(options)
+
+		with lock:
+			return list(generator.iter_passwords(**arguments))
+
+	def warm(self, params):
+		"""
+		Makes the PyPass instance of a request and loads everything it needs, e.g. a language model, before the
+		first client asks for it.
+		"""
+		self.generate(dict(params, password_number=1))
+
+	def entropy(self, params):
+		"""
+		Returns the Entropy of the passwords asked for by a request (see PyPass.entropy()), computed once for each
+		policy and set of rules.
+
+		Args:
+			params (dict): Parameters of the request, see PARAMETERS.
+		"""
+		options, arguments = parse_request(params)
+		lock, generator = self.generator(options)
+		del arguments['pass_number']
+		return generator.entropy(**arguments)
+
+	def handle(self, request):
+		"""
+		Answers a request with {'passwords': [...]}, or {'error': message} if it failed. A batch of requests, given
+		as a list, is answered with a list of answers in the same order.
+
+		Args:
+			request (dict or list): Parameters of a request, or a list of them.
+		"""
+		if isinstance(request, list):
+			if len(request) > SERVE_MAX_BATCH:
+				raise ValueError(f'A batch can hold at most {SERVE_MAX_BATCH} requests.')
+			return [self.answer(params) for params in request]
+
+		return self.answer(request)
+
+	def answer(self, params):
+		try:
+			return {'passwords': self.generate(params)}
+		except (ValueError, TypeError, RuntimeError) as error:
+			return {'error': str(error)}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+	"""
+	Answers POST /generate with PasswordService.handle() of the JSON body, POST /entropy with the entropy of the
+	passwords the body asks for, and GET /health. Connections are kept alive, so a client can send many requests over
+	a single connection.
+	"""
+	protocol_version = 'HTTP/1.1'
+
+	# Headers and body are buffered and sent together once the request is handled.
+	wbufsize = 1 << 16
+
+	def do_GET(self):
+		if self.path == '/health':
+			self.reply(200, {'status': 'ok', 'generators': len(self.server.service.generators)})
+		else:
+			self.reply(404, {'error': f'Unknown path {self.path}.'})
+
+	def do_POST(self):
+		if self.path not in ('/generate', '/entropy'):
+			self.reply(404, {'error': f'Unknown path {self.path}.'})
+			return
+
+		length = self.headers.get('Content-Length', '0')
+		length = int(length) if length.isdigit() else -1
+		if length < 0:
+			self.close_connection = True
+			self.reply(400, {'error': 'Content-Length must be a non-negative integer.'})
+			return
+
+		if length > SERVE_MAX_BODY:
+			# The body is left unread, so the connection can't be reused.
+			self.close_connection = True
+			self.reply(413, {'error': f'A request body can hold at most {SERVE_MAX_BODY} bytes.'})
+			return
+
+		try:
+			request = json.loads(self.rfile.read(length))
+			if self.path == '/entropy':
+				response = self.server.service.entropy(request).to_dict()
+			else:
+				response = self.server.service.handle(request)
+		except (ValueError, TypeError) as error:
+			self.reply(400, {'error': str(error)})
+			return
+		except OSError as error:
+			# The breach checker couldn't answer, e.g. haveibeenpwned is unreachable. Errors of requests derive from
+			# OSError as well.
+			self.reply(503, {'error': f'Passwords could not be checked: {error}'})
+			return
+
+		self.reply(400 if isinstance(response, dict) and 'error' in response else 200, response)
+
+	def reply(self, status, body):
+		body = json.dumps(body).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def address_string(self):
+		# Clients of a Unix socket have no address.
+		return self.client_address[0] if self.client_address else 'unix'
+
+	def log_request(self, code='-', size='-'):
+		# Requests aren't logged one by one, errors still are.
+		pass
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+	"""
+	HTTP server listening on a Unix socket, which is removed when the server is closed.
+	"""
+	daemon_threads = True
+
+	def server_close(self):
+		super().server_close()
+		os.remove(self.server_address)
+
+
+def make_server(service, host=SERVE_HOST, port=SERVE_PORT, socket_path=None, socket_mode=SERVE_SOCKET_MODE):
+	"""
+	Returns a server answering requests with service over HTTP, on host and port, or on the Unix socket socket_path
+	if it is defined. Each connection is handled by its own thread.
+
+	Args:
+		service (PasswordService): Service answering the requests.
+		host (str): Address listened on.
+		port (int): Port listened on, 0 for any free port.
+		socket_path (str): Path of the Unix socket listened on. A socket left there by an earlier server is
+						   replaced.
+		socket_mode (int): Permissions of the Unix socket, e.g. 0o600 for its owner only.
+	"""
+	if socket_path is not None:
+		if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+			os.remove(socket_path)
+
+		# The socket is created without the permissions it doesn't get, so it is never open to others, even briefly.
+		umask = os.umask(0o777 & ~socket_mode)
+		try:
+			server = UnixHTTPServer(socket_path, RequestHandler)
+		finally:
+			os.umask(umask)
+		os.chmod(socket_path, socket_mode)
+	else:
+		server = ThreadingHTTPServer((host, port), RequestHandler)
+
+	server.service = service
+	return server
+
+
+def serve(service, host=SERVE_HOST, port=SERVE_PORT, socket_path=None, warm=(), socket_mode=SERVE_SOCKET_MODE):
+	"""
+	Answers requests until interrupted. Used by 'python3 pypass.py serve'.
+
+	Args:
+		service (PasswordService): Service answering the requests.
+		host (str): Address listened on.
+		port (int): Port listened on.
+		socket_path (str): Path of the Unix socket listened on, instead of host and port.
+		warm (list): Parameters of requests whose PyPass instances are made before serving.
+		socket_mode (int): Permissions of the Unix socket.
+	"""
+	for params in warm:
+		service.warm(params)
+		entropy = service.entropy(params)
+		print(f'Warmed {json.dumps(params)}: {entropy.format_bounds(entropy.entropy)} of entropy.', file=sys.stderr)
+
+	server = make_server(service, host, port, socket_path, socket_mode)
+	address = socket_path if socket_path is not None else f'http://{host}:{server.server_address[1]}'
+	print(f'Serving passwords on {address}.', file=sys.stderr)
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
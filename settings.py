@@ -36,3 +36,106 @@ TEMPLATE_DIR = os.path.join(ROOT_DIR, 'templates')
 MODEL_DIR = os.path.join(ROOT_DIR, 'models')
 
 MIN_SENT_LENGTH = 10
+
+# Path to a local breach index, built with 'python3 pypass.py build-index'. Set to None to check
+# passwords online, against the haveibeenpwned API.
+BREACH_INDEX = None
+
+# Path to a Bloom filter of breached passwords, built with 'python3 pypass.py build-filter'. If set, it is
+# consulted before any other check, and passwords it reports are regenerated. Set to None to disable.
+BREACH_FILTER = None
+
+# Default false positive rate of Bloom filters built with 'python3 pypass.py build-filter'.
+BREACH_FILTER_FP_RATE = 0.001
+
+# URL of the haveibeenpwned range API, to which the first 5 characters of the SHA-1 hash of a password are appended.
+HIBP_RANGE_URL = 'https://api.pwnedpasswords.com/range/'
+
+# Maximum number of hash ranges fetched from the range API kept in memory, and the number of seconds each is kept.
+BREACH_CACHE_SIZE = 4096
+BREACH_CACHE_TTL = 3600
+
+# Maximum number of candidates generated for each requested password, before generation fails.
+MAX_ATTEMPTS = 1000
+
+# Formats of the trigram models made by ModelManager: 'compact' saves a CompactTrigramModel (see trigram.py) to a .tg
+# file, which Language memory-maps to generate sentences, 'pickle' exports the nltk.lm.MLE model to a .pk file, which
+# isn't used by PyPass itself.
+MODEL_FORMATS = ['compact']
+
+# Determines if excluded words are found regardless of upper and lower case.
+EXCLUDED_IGNORE_CASE = False
+
+# Determines if excluded words are also found when letters are replaced by look-alike characters, e.g. 'p4$$w0rd'.
+EXCLUDED_LEET = False
+
+# Path to the set of English words used to remove English words from passwords. It is built from the nltk WordNet
+# corpus the first time it is needed.
+ENGLISH_DICTIONARY = os.path.join(MODEL_DIR, 'english.txt')
+
+# Determines if passwords are built so that the rules hold by construction, instead of repairing random passwords.
+DIRECT_SAMPLING = False
+
+# Distribution of random characters: 'groups' picks a list of USABLE_CHARS first and then a character from it,
+# 'uniform' picks any of the characters with the same probability.
+CHAR_DISTRIBUTION = 'groups'
+
+# Number of random characters drawn at a time, from a single os.urandom() call.
+RANDOM_BUFFER_SIZE = 4096
+
+# Determines if NumPy, when it is installed, is used to draw random characters.
+USE_NUMPY = True
+
+# Largest number of passwords a worker process of generate_bulk() generates at a time.
+BULK_CHUNK_SIZE = 10000
+
+# Largest number of password candidates generated and checked for breaches at a time.
+STREAM_BATCH_SIZE = 1000
+
+# Method used to keep generated passwords unique: 'digest' remembers an 8 byte digest of each password, 'bloom' keeps
+# them in a Bloom filter, which takes about 2 bytes per password but drops a few passwords which were never seen.
+DEDUP_METHOD = 'digest'
+
+# Largest size in bytes of the set of seen passwords. Set to None for no limit.
+DEDUP_MEMORY_LIMIT = None
+
+# Highest probability that the 'bloom' method drops a password which was never seen.
+DEDUP_FALSE_POSITIVE_RATE = 0.001
+
+# Directory the Bloom filters of the 'bloom' method are memory-mapped from. Set to None to keep them in memory.
+DEDUP_DIRECTORY = None
+
+# Determines if PyPass collects counters and timings of each stage of password generation (see stats.py).
+COLLECT_STATS = False
+
+# Upper bounds in seconds of the buckets of the stage timing histograms.
+STATS_BUCKETS = [1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 0.1, 1, 10]
+
+# Address 'pypass.py serve' listens on, unless it is given a Unix socket.
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8737
+
+# Permissions of the Unix socket of 'pypass.py serve'. Anyone who can connect to it gets passwords, so by default only
+# its owner can.
+SERVE_SOCKET_MODE = 0o600
+
+# Number of PyPass instances, one for each distinct set of options, kept warm by 'pypass.py serve'.
+SERVE_CACHE_SIZE = 64
+
+# Largest number of passwords in a single request, of requests in a batch, and of bytes in a request body.
+SERVE_MAX_PASSWORDS = 10000
+SERVE_MAX_BATCH = 1000
+SERVE_MAX_BODY = 1 << 20
+
+# Longest password a request to 'pypass.py serve' may ask for, as its max_len or fix_len.
+SERVE_MAX_LEN = 1024
+
+# Number of PasswordPolicy objects, one for each distinct set of rules, kept for reuse by new PyPass instances.
+POLICY_CACHE_SIZE = 128
+
+# Number of passwords generated by each engine of 'pypass.py distribution', and counted at a time.
+DISTRIBUTION_SAMPLES = 1000000
+DISTRIBUTION_CHUNK_SIZE = 10000
+
+# Significance level of all the tests of 'pypass.py distribution' together. Each of n tests fails below alpha / n.
+DISTRIBUTION_ALPHA = 0.001
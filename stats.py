@@ -0,0 +1,223 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from collections import Counter
+
+from settings import STATS_BUCKETS
+
+
+class Histogram:
+	"""
+	Distribution of durations, counted in buckets with fixed upper bounds, like a Prometheus histogram.
+	"""
+
+	def __init__(self, buckets=STATS_BUCKETS):
+		"""
+		Args:
+			buckets (list): Sorted upper bounds of the buckets in seconds. Longer durations fall into a last bucket.
+		"""
+		self.buckets = list(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, seconds):
+		self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+		self.sum += seconds
+		self.count += 1
+
+	def merge(self, snapshot):
+		for index, count in enumerate(snapshot['counts']):
+			self.counts[index] += count
+		self.sum += snapshot['sum']
+		self.count += snapshot['count']
+
+	def snapshot(self):
+		return {'buckets': self.buckets, 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class _Timer:
+	"""
+	Context manager adding the time spent in its block to a stage of a Stats object.
+	"""
+	__slots__ = ('stats', 'stage', 'start')
+
+	def __init__(self, stats, stage):
+		self.stats = stats
+		self.stage = stage
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.stats.observe(self.stage, time.perf_counter() - self.start)
+
+
+class Stats:
+	"""
+	Counters and timing histograms of the stages of password generation, e.g. how many passes filter_words() made,
+	how many characters were replaced, or how long breach checks took. Safe to share between threads.
+
+		p = PyPass(collect_stats=True)
+		p.generate_password(100, remove_english=True)
+		print(p.stats.to_prometheus())
+	"""
+	enabled = True
+
+	def __init__(self, buckets=STATS_BUCKETS):
+		"""
+		Args:
+			buckets (list): Upper bounds of the buckets of the timing histograms in seconds.
+		"""
+		self.buckets = buckets
+		self.counters = Counter()
+		self.timings = {}
+		self._lock = threading.Lock()
+
+	def count(self, name, value=1):
+		"""
+		Adds value to the counter name.
+		"""
+		with self._lock:
+			self.counters[name] += value
+
+	def observe(self, stage, seconds):
+		"""
+		Adds a duration to the timing histogram of stage.
+		"""
+		with self._lock:
+			histogram = self.timings.get(stage)
+			if histogram is None:
+				histogram = self.timings[stage] = Histogram(self.buckets)
+			histogram.observe(seconds)
+
+	def time(self, stage):
+		"""
+		Returns a context manager timing its block as stage:
+
+			with stats.time('remove_english'):
+				...
+		"""
+		return _Timer(self, stage)
+
+	def timed(self, stage, function):
+		"""
+		Returns a wrapper of function, timing each of its calls as stage.
+		"""
+		@functools.wraps(function)
+		def timed_function(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.observe(stage, time.perf_counter() - start)
+
+		return timed_function
+
+	def snapshot(self):
+		"""
+		Returns the counters and histograms as plain dictionaries, which can be pickled or dumped as JSON.
+		"""
+		with self._lock:
+			return {
+				'counters': dict(self.counters),
+				'timings': {stage: histogram.snapshot() for stage, histogram in self.timings.items()},
+			}
+
+	def merge(self, snapshot):
+		"""
+		Adds a snapshot of another Stats object, e.g. of a worker process, to this one.
+		"""
+		with self._lock:
+			self.counters.update(snapshot['counters'])
+			for stage, timing in snapshot['timings'].items():
+				histogram = self.timings.get(stage)
+				if histogram is None:
+					histogram = self.timings[stage] = Histogram(timing['buckets'])
+				histogram.merge(timing)
+
+	def reset(self):
+		with self._lock:
+			self.counters.clear()
+			self.timings.clear()
+
+	def to_json(self, **kwargs):
+		return json.dumps(self.snapshot(), **kwargs)
+
+	def to_prometheus(self, prefix='pypass'):
+		"""
+		Returns the counters and histograms in the Prometheus text exposition format.
+
+		Args:
+			prefix (str): Prefix of the metric names.
+		"""
+		snapshot = self.snapshot()
+		lines = []
+
+		for name, value in sorted(snapshot['counters'].items()):
+			lines.append(f'# TYPE {prefix}_{name}_total counter')
+			lines.append(f'{prefix}_{name}_total {value}')
+
+		if snapshot['timings']:
+			lines.append(f'# TYPE {prefix}_stage_seconds histogram')
+
+		for stage, timing in sorted(snapshot['timings'].items()):
+			cumulative = 0
+			for bound, count in zip(timing['buckets'] + ['+Inf'], timing['counts']):
+				cumulative += count
+				lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+			lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {timing["sum"]}')
+			lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {timing["count"]}')
+
+		return '\n'.join(lines) + '\n'
+
+
+class _NullTimer:
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		pass
+
+
+_null_timer = _NullTimer()
+
+
+class NullStats:
+	"""
+	Stats object which records nothing, used when collection is disabled. Stages aren't wrapped at all, and each
+	counter costs a single method call.
+	"""
+	enabled = False
+
+	def count(self, name, value=1):
+		pass
+
+	def observe(self, stage, seconds):
+		pass
+
+	def time(self, stage):
+		return _null_timer
+
+	def timed(self, stage, function):
+		return function
+
+	def snapshot(self):
+		return {'counters': {}, 'timings': {}}
+
+	def merge(self, snapshot):
+		pass
+
+	def reset(self):
+		pass
+
+	def to_json(self, **kwargs):
+		return json.dumps(self.snapshot(), **kwargs)
+
+	def to_prometheus(self, prefix='pypass'):
+		return ''
@@ -1,13 +1,45 @@
 import unittest
+import unittest.mock
 import itertools
 import os
+import sys
+import subprocess
+import hashlib
+import tempfile
+import threading
+import time
+import json
+import socket
+import http.client
+import asyncio
+import pickle
+import math
+import types
+import struct
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 import nltk
 
-from password import PyPass
+from password import PyPass, TIMED_STAGES
 from language import ModelManager, Language
+import trigram
+from trigram import CompactTrigramModel
+from matcher import WordMatcher
+from dictionary import EnglishDictionary
+from sampler import ConstrainedSampler
+from alphabet import Alphabet
+from dedup import DigestSet, BloomSet
+from bloom import BlockedBloomFilter, ScalableBloomFilter
+from bench import measure, compare
+from stats import Stats, NullStats
+from server import PasswordService, make_server
+from policy import PasswordPolicy
+from randomness import SYSTEM_RANDOMNESS, SeededRandomness
+from entropy import count_passwords, sentence_entropy
+from distribution import FrequencyCounts, chi_square_sf, homogeneity, check_distribution
+from breach import LocalIndexChecker, BloomFilterChecker, HIBPRangeChecker, build_index, build_filter
 from text_for_testing import TEST_TEXT
-from settings import MODEL_DIR, TEMPLATE_DIR
+from settings import MODEL_DIR, TEMPLATE_DIR, USABLE_CHARS, SERVE_MAX_LEN
 
 class TestPassword(unittest.TestCase):
 
@@ -127,18 +159,32 @@ class TestPassword(unittest.TestCase):
 		self.assertFalse(self.hmp3.excluded_chars in self.join_l(self.hmp3.usable_chars))
 		self.assertFalse(self.hmp4.excluded_chars in self.join_l(self.hmp4.usable_chars))
 
+	@staticmethod
+	def remove_file(path):
+		if os.path.exists(path):
+			os.remove(path)
+
+	def make_model(self, model_name, **options):
+		# Models of failed tests are removed as well, so that none is left in MODEL_DIR.
+		for extension in ('.pk', '.tg'):
+			self.addCleanup(self.remove_file, os.path.join(MODEL_DIR, model_name + extension))
+
+		m = ModelManager(model_name)
+		m.make_model("l", **options)
+		return m
+
 	def test_save_and_delete_model(self):
 		model_name = 'odyssey'
-		m = ModelManager(model_name)
-		m.make_model("l")
+		m = self.make_model(model_name, model_formats=['pickle', 'compact'])
 		self.assertTrue(f'{model_name}.pk' in os.listdir(MODEL_DIR))
+		self.assertTrue(f'{model_name}.tg' in os.listdir(MODEL_DIR))
 		m.delete()
 		self.assertFalse(f'{model_name}.pk' in os.listdir(MODEL_DIR))
+		self.assertFalse(f'{model_name}.tg' in os.listdir(MODEL_DIR))
 
 	def test_generate_sentence(self):
 		model_name = 'odyssey'
-		m = ModelManager(model_name)
-		m.make_model("l")
+		m = self.make_model(model_name)
 		lang_pass_gen = PyPass(min_pass_len=50, max_pass_len=80, language_lib=model_name, include_whitespace=True)
 		lang_pass_gen.generate_sentence_pass()
 		password = lang_pass_gen.passwords[0]
@@ -150,8 +196,7 @@ class TestPassword(unittest.TestCase):
 
 	def test_generate_no_whitespace_sentence(self):
 		model_name = 'odyssey'
-		m = ModelManager(model_name)
-		m.make_model("l")
+		m = self.make_model(model_name)
 		lang_pass_gen = PyPass(min_pass_len=50, max_pass_len=80, language_lib=model_name, include_whitespace=False)
 		lang_pass_gen.generate_sentence_pass()
 		password = lang_pass_gen.passwords[0]
@@ -162,6 +207,875 @@ class TestPassword(unittest.TestCase):
 		m.delete()
 
 
+class TestWordMatcher(unittest.TestCase):
+
+	def test_overlapping_matches(self):
+		matcher = WordMatcher(['he', 'she', 'his', 'hers'])
+		self.assertEqual(list(matcher.finditer('ushers')), [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')])
+		self.assertFalse(matcher.search('hi sh'))
+
+	def test_case_and_leet_variants(self):
+		self.assertFalse(WordMatcher(['password']).search('P4$$w0rd'))
+		self.assertFalse(WordMatcher(['password'], leet=True).search('P4$$w0rd'))
+		self.assertEqual(list(WordMatcher(['password'], ignore_case=True, leet=True).finditer('xP4$$w0rd')),
+						 [(1, 9, 'password')])
+
+	def test_remove_excluded(self):
+		p = PyPass(breach_checker=RejectingChecker(0), excluded_words=['qwerty', '123456', 'xyz'])
+		password = p.remove_excluded(list('qwerty123456xyzQwErTy'), remove_touching=True)
+		self.assertEqual(len(password), 21)
+		self.assertFalse(p.contains_excluded(''.join(password)))
+
+	def test_filter_words(self):
+		english = EnglishDictionary(['dragon', 'monkey'])
+		with unittest.mock.patch.object(PyPass, 'english', english):
+			p = PyPass(breach_checker=RejectingChecker(0), excluded_words=['qwerty'])
+			# Only the offending spans are replaced, the characters around them are kept.
+			password = p.filter_words(list('1dragon2qwerty3monkeys4'), remove_touching=True)
+			self.assertEqual(len(password), 23)
+			self.assertEqual(password[0] + password[7] + password[14] + password[22], '1234')
+
+			password = ''.join(password)
+			self.assertFalse(p.contains_excluded(password))
+			self.assertFalse(any(english.is_word(run) for run in p.policy.word_pattern.findall(password)
+								 if len(run) > 3))
+
+			self.assertEqual(p.remove_english(list('dragon!qwerty'), False)[6:], list('!qwerty'))
+			self.assertEqual(p.remove_excluded(list('dragon!qwerty'), False)[:7], list('dragon!'))
+
+
+class TestConstrainedSampler(unittest.TestCase):
+
+	usable_chars = [['a', 'b', 'c'], ['1', '2'], ['!']]
+
+	def is_valid(self, password):
+		return (all(a != b for a, b in zip(password, password[1:])) and
+				all(any(char in group for char in password) for group in self.usable_chars))
+
+	def test_count_matches_enumeration(self):
+		sampler = ConstrainedSampler(self.usable_chars, no_repeats=True, all_groups=True)
+		chars = [char for group in self.usable_chars for char in group]
+		for length in range(6):
+			expected = sum(self.is_valid(p) for p in itertools.product(chars, repeat=length))
+			self.assertEqual(sampler.count(length), expected)
+
+	def test_samples_satisfy_rules(self):
+		matcher = WordMatcher(['ab', '12'])
+		sampler = ConstrainedSampler(self.usable_chars, no_repeats=True, all_groups=True, matcher=matcher)
+		for _ in range(200):
+			password = ''.join(sampler.sample(5))
+			self.assertTrue(self.is_valid(password), password)
+			self.assertFalse(matcher.search(password), password)
+		self.assertRaises(ValueError, sampler.sample, 2)
+
+	def test_direct_sampling(self):
+		p = PyPass(breach_checker=RejectingChecker(0), excluded_words=['qwerty'], direct_sampling=True)
+		p.generate_password(pass_number=20, remove_repeating=True, remove_english=True, check_proportions=True,
+							fixed_len=12)
+		for password in p.passwords:
+			self.assertEqual(len(password), 12)
+			self.assertFalse(p.contains_excluded(password))
+			self.assertFalse(any(a == b for a, b in zip(password, password[1:])))
+
+
+class TestAlphabet(unittest.TestCase):
+
+	usable_chars = [['a', 'b', 'c'], ['1', '2'], ['!']]
+
+	def test_weights(self):
+		groups = Alphabet(self.usable_chars, distribution='groups')
+		self.assertEqual(groups.weights, [2, 2, 2, 3, 3, 6])
+		self.assertAlmostEqual(groups.probability('!'), 1 / 3)
+		uniform = Alphabet(self.usable_chars, distribution='uniform')
+		self.assertAlmostEqual(uniform.probability('!'), 1 / 6)
+		self.assertRaises(ValueError, Alphabet, self.usable_chars, distribution='other')
+
+	def test_sample(self):
+		for use_numpy in (False, True):
+			alphabet = Alphabet(self.usable_chars, buffer_size=64, use_numpy=use_numpy)
+			chars = alphabet.sample(3000) + [alphabet.choice() for _ in range(100)]
+			self.assertEqual(len(chars), 3100)
+			self.assertEqual(set(chars), {'a', 'b', 'c', '1', '2', '!'})
+			self.assertTrue(800 < chars.count('!') < 1270)
+
+	def test_large_alphabet(self):
+		# Groups with pairwise coprime sizes don't fit a lookup table, so characters are found by binary search.
+		usable_chars = [[chr(0x4e00 + i) for i in range(size)] for size in (101, 103, 107)]
+		alphabet = Alphabet(usable_chars, use_numpy=False)
+		self.assertIsNone(alphabet.table)
+		self.assertEqual(len(alphabet.sample(500)), 500)
+
+	def test_huge_weights(self):
+		# The weights add up to more than 2^32, and then to more than 2^64, which no fixed width of draws fits.
+		for sizes, width in (((23, 29, 31, 37, 41, 43, 47), 8), ((23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73), None)):
+			usable_chars = [[chr(0x4e00 + 100 * index + i) for i in range(size)] for index, size in enumerate(sizes)]
+			for use_numpy in (False, True):
+				alphabet = Alphabet(usable_chars, buffer_size=64, use_numpy=use_numpy)
+				self.assertEqual(alphabet.width, width)
+				chars = alphabet.sample(2000) + alphabet.sample(2000)
+				first_group = sum(1 for char in chars if char in usable_chars[0])
+				self.assertTrue(4000 / len(sizes) * 0.7 < first_group < 4000 / len(sizes) * 1.3)
+
+
+class TestEnglishDictionary(unittest.TestCase):
+
+	def setUp(self):
+		self.dictionary = EnglishDictionary(['dog', 'house', 'walk', 'bake', 'goose', 'geese'])
+
+	def test_inflected_words(self):
+		for word in ['Dog', 'dogs', 'HOUSES', 'walked', 'walking', 'baking', 'geese']:
+			self.assertTrue(self.dictionary.is_word(word), word)
+		self.assertFalse(self.dictionary.is_word('xhousez'))
+
+	def test_embedded_words(self):
+		self.assertEqual(list(self.dictionary.find_words('4xhousez!dogs')), [(2, 7), (9, 13)])
+
+	def test_parts_of_speech(self):
+		# Like morphy(), suffix rules only apply to base forms of their part of speech.
+		dictionary = EnglishDictionary({'dog': 'n', 'house': 'n', 'walk': 'nv', 'quick': 'a', 'wolf': 'n', 'geese': ''})
+		for word in ['dogs', 'walked', 'houses', 'walking', 'quicker', 'wolves', 'geese']:
+			self.assertTrue(dictionary.is_word(word), word)
+		for word in ['doged', 'housing', 'housed', 'quicks', 'wolfed', 'geeses']:
+			self.assertFalse(dictionary.is_word(word), word)
+
+		# Parts of speech are saved with the words, and plain word lists still load.
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		path = os.path.join(directory.name, 'english.txt')
+		dictionary.save(path)
+		self.assertEqual(EnglishDictionary.load(path).pos, dictionary.pos)
+		with open(path, 'w') as f:
+			f.write('house\nwalk\n')
+		self.assertTrue(EnglishDictionary.load(path).is_word('housing'))
+
+	def test_matches_wordnet(self):
+		from nltk.corpus import wordnet
+		dictionary = EnglishDictionary.from_wordnet()
+		for word in ['house', 'houses', 'geese', 'running', 'xqzt', 'walked', 'quickly', 'often']:
+			self.assertEqual(dictionary.is_word(word), bool(wordnet.synsets(word)), word)
+
+	def test_adverbs(self):
+		lemmas = {'n': ['dog'], 'v': ['walk'], 'a': ['quick'], 'r': ['quickly', 'often']}
+		wordnet = types.SimpleNamespace(all_lemma_names=lambda pos: lemmas.get(pos, []), _exception_map={})
+		with unittest.mock.patch('nltk.corpus.wordnet', wordnet):
+			dictionary = EnglishDictionary.from_wordnet()
+		for word in ['quickly', 'often', 'quicker']:
+			self.assertTrue(dictionary.is_word(word), word)
+		self.assertFalse(dictionary.is_word('oftens'))
+
+
+class TestCompactTrigramModel(unittest.TestCase):
+
+	def setUp(self):
+		self.sentences = [['the', 'dog', 'barks'], ['the', 'dog', 'sleeps'], ['the', 'cat', 'sleeps']]
+		self.model = CompactTrigramModel.from_sentences(self.sentences)
+
+	def test_counts(self):
+		the, dog = self.model.word_id('the'), self.model.word_id('dog')
+		start, end = self.model.row(the, dog)
+		following = {self.model.word(self.model.next_ids[i]) for i in range(start, end)}
+		self.assertEqual(following, {'barks', 'sleeps'})
+		self.assertEqual(self.model.cumulative_counts[end - 1], 2)
+		self.assertIsNone(self.model.word_id('bird'))
+
+	def test_save_and_load(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = os.path.join(tmp_dir, 'model.tg')
+			self.model.save(path)
+			loaded = CompactTrigramModel.load(path)
+			words = loaded.generate(30, lambda n: 0)
+			self.assertEqual(len(words), 30)
+			self.assertTrue(set(words) <= {'the', 'dog', 'cat', 'barks', 'sleeps'})
+			loaded.close()
+
+	def test_byte_order(self):
+		# Arrays are saved little-endian and read as such on any machine.
+		model = self.model
+		saved = struct.unpack_from(f'<{model.vocab_size + 1}Q', model.buffer, trigram.ARRAYS_OFFSET)
+		self.assertEqual(list(model.word_offsets), list(saved))
+		self.assertEqual(model.word(model.word_id('the')), 'the')
+
+	def test_no_words(self):
+		model = CompactTrigramModel.from_sentences([[], []])
+		self.assertRaises(ValueError, model.generate, 5, lambda n: 0)
+		self.assertRaises(ValueError, CompactTrigramModel.from_sentences([]).generate, 5, lambda n: 0)
+
+
+class TestBreachIndex(unittest.TestCase):
+
+	def setUp(self):
+		self.breached = ['123456', 'password', 'qwerty', 'letmein']
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		dump = os.path.join(self.tmp_dir.name, 'dump.txt')
+		self.index = os.path.join(self.tmp_dir.name, 'index.bin')
+
+		hashes = sorted(hashlib.sha1(p.encode()).hexdigest().upper() for p in self.breached)
+		with open(dump, 'w') as f:
+			f.write('\n'.join(f'{h}:1' for h in hashes))
+
+		build_index(dump, self.index)
+
+	def tearDown(self):
+		self.tmp_dir.cleanup()
+
+	def test_local_index_lookup(self):
+		checker = LocalIndexChecker(self.index)
+		for password in self.breached:
+			self.assertEqual(checker.is_password_breached(password), 1)
+		self.assertEqual(checker.is_password_breached('k7#Tq9!zLm'), 0)
+		checker.close()
+
+	def test_generate_with_local_index(self):
+		checker = LocalIndexChecker(self.index)
+		p = PyPass(breach_checker=checker)
+		p.generate_password(pass_number=3)
+		self.assertEqual(len(p.passwords), 3)
+		checker.close()
+
+	def test_bloom_filter_prescreen(self):
+		dump = os.path.join(self.tmp_dir.name, 'dump.txt')
+		path = os.path.join(self.tmp_dir.name, 'filter.bin')
+		build_filter(dump, path, false_positive_rate=0.01).close()
+
+		checker = BloomFilterChecker(path)
+		for password in self.breached:
+			self.assertEqual(checker.is_password_breached(password), 1)
+		false_positives = sum(checker.is_password_breached(f'k7#Tq9!z{i}') for i in range(1000))
+		self.assertLess(false_positives, 50)
+		checker.close()
+
+
+class StubRangeHandler(BaseHTTPRequestHandler):
+	"""
+	Serves the range API of haveibeenpwned for the hashes in self.server.hashes.
+	"""
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		prefix = self.path.rsplit('/', 1)[-1]
+		self.server.requested.append(prefix)
+		body = '\r\n'.join(f'{h[5:]}:3' for h in self.server.hashes if h.startswith(prefix)).encode()
+
+		self.send_response(200)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class TestRangeChecker(unittest.TestCase):
+
+	def setUp(self):
+		self.breached = ['123456', 'password', 'qwerty']
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubRangeHandler)
+		self.server.hashes = [hashlib.sha1(p.encode()).hexdigest().upper() for p in self.breached]
+		self.server.requested = []
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.checker = HIBPRangeChecker(api_url=f'http://127.0.0.1:{self.server.server_port}/range/')
+
+	def tearDown(self):
+		self.checker.close()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_check_batch(self):
+		results = self.checker.check_batch(self.breached + ['k7#Tq9!zLm'])
+		self.assertEqual(results, [3, 3, 3, 0])
+
+	def test_ranges_fetched_once(self):
+		self.checker.check_batch(['password', 'password', 'qwerty'])
+		self.checker.check_batch(['password', 'qwerty'])
+		self.assertEqual(len(self.server.requested), 2)
+		self.assertEqual(self.checker.requests_made, 2)
+
+	def test_generate_with_range_checker(self):
+		p = PyPass(breach_checker=self.checker)
+		p.generate_password(pass_number=5)
+		self.assertEqual(len(p.passwords), 5)
+		self.assertEqual(len(self.server.requested), self.checker.requests_made)
+
+	def test_shared_between_threads(self):
+		# Threads starting together share a single session, and every request is counted.
+		barrier = threading.Barrier(8)
+		sessions = []
+
+		def check(number):
+			barrier.wait()
+			sessions.append(self.checker.session)
+			self.checker.check_batch([f'password{number}'])
+
+		threads = [threading.Thread(target=check, args=(number,)) for number in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(len(set(map(id, sessions))), 1)
+		self.assertEqual(self.checker.requests_made, len(self.server.requested))
+
+
+class SlowChecker:
+	"""
+	Breach checker which takes a while to answer, and records how many checks run at the same time.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.in_flight = 0
+		self.max_in_flight = 0
+
+	def is_password_breached(self, password):
+		with self.lock:
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		time.sleep(0.02)
+		with self.lock:
+			self.in_flight -= 1
+		return 0
+
+
+class TestAsyncGeneration(unittest.TestCase):
+
+	def collect(self, p, pass_number, concurrency):
+		async def run():
+			return [password async for password in p.agenerate_passwords(pass_number, concurrency=concurrency)]
+		return asyncio.run(run())
+
+	def test_agenerate_passwords(self):
+		checker = SlowChecker()
+		passwords = self.collect(PyPass(breach_checker=checker), 20, 5)
+		self.assertEqual(len(passwords), 20)
+		self.assertEqual(checker.max_in_flight, 5)
+
+	def test_stats(self):
+		# Counted like the passwords of iter_checked().
+		p = PyPass(breach_checker=RejectingChecker(3), collect_stats=True)
+		self.assertEqual(len(self.collect(p, 10, 4)), 10)
+		self.assertEqual(p.stats.counters['candidates'], 13)
+		self.assertEqual(p.stats.counters['passwords'], 10)
+		self.assertEqual(p.stats.counters['breach_hits'], 3)
+
+
+class RejectingChecker:
+	"""
+	Breach checker which reports the first `rejections` passwords it sees as breached.
+	"""
+
+	def __init__(self, rejections):
+		self.rejections = rejections
+
+	def is_password_breached(self, password):
+		self.rejections -= 1
+		return int(self.rejections >= 0)
+
+	def check_batch(self, passwords):
+		return [self.is_password_breached(password) for password in passwords]
+
+
+class TestRetries(unittest.TestCase):
+
+	def test_exact_number_after_rejections(self):
+		p = PyPass(breach_checker=RejectingChecker(7), excluded_words=[])
+		p.generate_password(pass_number=5, fixed_len=12)
+		self.assertEqual(len(p.passwords), 5)
+		self.assertTrue(all(len(password) == 12 for password in p.passwords))
+		self.assertEqual(p.rejections['breached'], 7)
+
+	def test_human_password_retries_itself(self):
+		p = PyPass(breach_checker=RejectingChecker(3))
+		p.generate_human_password(pass_number=2)
+		self.assertEqual(len(p.human_passwords), 2)
+		self.assertEqual(len(p.passwords), 0)
+		self.assertEqual(p.rejections['breached'], 3)
+
+	def test_attempts_are_bounded(self):
+		p = PyPass(breach_checker=RejectingChecker(10 ** 6), excluded_words=[], max_attempts=4)
+		with self.assertRaises(RuntimeError):
+			p.generate_password(pass_number=3)
+		self.assertEqual(p.rejections['breached'], 12)
+
+
+class TestStreaming(unittest.TestCase):
+
+	def test_iter_passwords(self):
+		p = PyPass(breach_checker=RejectingChecker(5), excluded_words=[])
+		passwords = list(itertools.islice(p.iter_passwords(fixed_len=10), 2500))
+		self.assertEqual(len(passwords), 2500)
+		self.assertTrue(all(len(password) == 10 for password in passwords))
+		self.assertEqual(p.passwords, [])
+		self.assertEqual(p.rejections['breached'], 5)
+
+	def test_iter_bulk(self):
+		p = PyPass(breach_checker=RejectingChecker(0), excluded_words=[])
+		passwords = list(p.iter_bulk(pass_number=50, workers=2, human=True))
+		self.assertEqual(len(set(passwords)), 50)
+		self.assertEqual(p.human_passwords, [])
+
+
+class TestDeduplication(unittest.TestCase):
+
+	def test_seen_sets(self):
+		# Bloom filters count every password added, as seen passwords can't be told from false positives.
+		for seen, length in ((DigestSet(), 2), (BloomSet(), 3)):
+			self.assertFalse(seen.add('password1'))
+			self.assertTrue(seen.add('password1'))
+			self.assertFalse(seen.add('password2'))
+			self.assertEqual(len(seen), length)
+
+	def test_memory_limit(self):
+		seen = DigestSet(memory_limit=10000)
+		with self.assertRaises(RuntimeError):
+			for number in range(5000):
+				seen.add(str(number))
+
+	def test_scalable_bloom_filter(self):
+		bloom_filter = ScalableBloomFilter(initial_capacity=1000, false_positive_rate=0.01)
+		keys = [hashlib.sha1(str(number).encode()).digest() for number in range(10000)]
+		self.assertLess(sum(bloom_filter.add(key) for key in keys), 100)
+		self.assertGreater(len(bloom_filter.filters), 3)
+		self.assertTrue(all(key in bloom_filter for key in keys))
+		others = [hashlib.sha1(str(-number).encode()).digest() for number in range(1, 10001)]
+		self.assertLess(sum(key in bloom_filter for key in others), 200)
+		with self.assertRaises(RuntimeError):
+			ScalableBloomFilter(initial_capacity=1000, size_limit=1024)
+
+	def test_false_positives_counted(self):
+		# A single block is soon full, and new keys reported as present still load it.
+		bloom_filter = BlockedBloomFilter(1, 8)
+		keys = [hashlib.sha1(str(number).encode()).digest() for number in range(1000)]
+		self.assertGreater(sum(bloom_filter.add(key) for key in keys), 500)
+		self.assertEqual(len(bloom_filter), 1000)
+		self.assertGreater(bloom_filter.false_positive_rate, 0.9)
+
+	def test_shared_directory(self):
+		# Filters memory-mapped from the same directory keep their files apart, and remove them when closed.
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		first = ScalableBloomFilter(initial_capacity=100, directory=directory.name)
+		second = ScalableBloomFilter(initial_capacity=100, directory=directory.name)
+		self.assertNotEqual(first.path, second.path)
+
+		first.add(b'key')
+		self.assertIn(b'key', first)
+		self.assertNotIn(b'key', second)
+
+		first.close()
+		second.close()
+		self.assertEqual(os.listdir(directory.name), [])
+
+	def test_unique_passwords(self):
+		# Only 8 passwords exist, so most candidates are duplicates which have to be replaced.
+		p = PyPass(usable_chars=[['a', 'b']], excluded_chars=[], excluded_words=[], breach_checker=RejectingChecker(0),
+				   unique=True)
+		p.generate_password(pass_number=5, fixed_len=3)
+		passwords = list(p.iter_passwords(3, fixed_len=3))
+		self.assertEqual(sorted(p.passwords + passwords), sorted(map(''.join, itertools.product('ab', repeat=3))))
+		self.assertGreater(p.rejections['duplicate'], 0)
+		self.assertRaises(RuntimeError, p.generate_password, pass_number=1, fixed_len=3)
+
+
+class TestBulkGeneration(unittest.TestCase):
+
+	def test_generate_bulk(self):
+		p = PyPass(breach_checker=RejectingChecker(0), excluded_words=['qwerty'])
+		passwords = p.generate_bulk(pass_number=200, workers=2, remove_repeating=True, check_proportions=True)
+		self.assertEqual(len(passwords), 200)
+		self.assertEqual(p.passwords, passwords)
+		self.assertFalse(any(p.contains_excluded(password) for password in passwords))
+
+	def test_merged_without_duplicates(self):
+		# Only 8 passwords exist, so most candidates are duplicates which have to be replaced.
+		p = PyPass(usable_chars=[['a', 'b']], excluded_chars=[], excluded_words=[], breach_checker=RejectingChecker(0))
+		passwords = p.generate_bulk(pass_number=8, workers=2, fixed_len=3)
+		self.assertEqual(sorted(passwords), sorted(map(''.join, itertools.product('ab', repeat=3))))
+
+
+class TestRandomness(unittest.TestCase):
+
+	def test_seeded_randomness(self):
+		randomness = SeededRandomness(3)
+		self.assertEqual(randomness.token_bytes(3) + randomness.token_bytes(5000), SeededRandomness(3).token_bytes(5003))
+		self.assertNotEqual(SeededRandomness(3).token_bytes(16), SeededRandomness(4).token_bytes(16))
+		self.assertEqual({randomness.randbelow(5) for _ in range(200)}, set(range(5)))
+		self.assertRaises(IndexError, randomness.choice, [])
+
+		# Powers of two are read from their bits without rejection, and a single value takes no bytes at all.
+		randomness = SeededRandomness(6)
+		self.assertEqual([randomness.randbelow(1) for _ in range(10)], [0] * 10)
+		self.assertEqual(bytes(randomness.randbelow(256) for _ in range(100)), SeededRandomness(6).token_bytes(100))
+
+		# The state is kept by pickling, and the default is recognized in another process.
+		copy = pickle.loads(pickle.dumps(randomness))
+		self.assertEqual(copy.token_bytes(8), randomness.token_bytes(8))
+		self.assertIs(pickle.loads(pickle.dumps(SYSTEM_RANDOMNESS)), SYSTEM_RANDOMNESS)
+		self.assertFalse(randomness.secure)
+
+	def test_reproducible_passwords(self):
+		def generate(seed, **options):
+			p = PyPass(usable_chars=[['a', 'b', 'c'], ['1', '2']], excluded_chars=[], excluded_words=['ab1'],
+					   breach_checker=RejectingChecker(0), randomness=SeededRandomness(seed), **options)
+			p.generate_password(50, remove_repeating=True, check_proportions=True)
+			return p.passwords, p.rejections
+
+		self.assertEqual(generate(1), generate(1))
+		self.assertEqual(generate(1, direct_sampling=True), generate(1, direct_sampling=True))
+		self.assertNotEqual(generate(1)[0], generate(2)[0])
+		# Passwords for real use are never seeded.
+		self.assertIs(PyPass(breach_checker=RejectingChecker(0)).alphabet.randomness, SYSTEM_RANDOMNESS)
+
+	def test_reproducible_bulk(self):
+		def generate():
+			p = PyPass(breach_checker=RejectingChecker(0), randomness=SeededRandomness(5))
+			return p.generate_bulk(pass_number=100, workers=2)
+
+		passwords = generate()
+		self.assertEqual(len(set(passwords)), 100)
+		self.assertEqual(generate(), passwords)
+
+	def test_reproducible_sentences(self):
+		model = CompactTrigramModel.from_sentences([['a', 'b', 'c'], ['a', 'c', 'b'], ['b', 'a', 'c']])
+
+		def generate(seed):
+			language = Language(check_breached=False, min_sentence_length=3, randomness=SeededRandomness(seed))
+			return [language.sample_sentence(model) for _ in range(20)]
+
+		self.assertEqual(generate(1), generate(1))
+		self.assertNotEqual(generate(1), generate(2))
+
+
+class TestStats(unittest.TestCase):
+
+	def test_collect_stats(self):
+		p = PyPass(breach_checker=RejectingChecker(3), excluded_words=['qwerty'], collect_stats=True)
+		p.generate_password(pass_number=10, remove_repeating=True, check_proportions=True)
+		snapshot = p.stats.snapshot()
+		self.assertEqual(snapshot['counters']['breach_hits'], 3)
+		self.assertEqual(snapshot['counters']['passwords'], 10)
+		self.assertEqual(snapshot['counters']['candidates'], 13)
+		self.assertEqual(snapshot['timings']['ensure_proportions']['count'], 13)
+		self.assertIn('pypass_breach_checks_total 13', p.stats.to_prometheus())
+
+	def test_merge_and_export(self):
+		stats = Stats(buckets=[0.001, 0.01])
+		stats.count('english_loops', 2)
+		stats.observe('remove_english', 0.005)
+		other = Stats(buckets=[0.001, 0.01])
+		other.observe('remove_english', 0.5)
+		stats.merge(other.snapshot())
+		self.assertEqual(stats.snapshot()['timings']['remove_english']['counts'], [0, 1, 1])
+		self.assertIn('pypass_stage_seconds_bucket{stage="remove_english",le="+Inf"} 2', stats.to_prometheus())
+
+	def test_disabled(self):
+		p = PyPass(breach_checker=RejectingChecker(0), excluded_words=[])
+		p.generate_password(pass_number=3)
+		self.assertIsInstance(p.stats, NullStats)
+
+		# Stages are the methods of the class, so instances don't refer to themselves.
+		self.assertFalse(set(TIMED_STAGES) & set(vars(p)))
+		self.assertEqual(p.stats.snapshot(), {'counters': {}, 'timings': {}})
+
+
+class TestBenchmark(unittest.TestCase):
+
+	def test_measure(self):
+		result = measure(lambda: sum(range(100)), count=100, repeat=3)
+		self.assertGreater(result['per_sec'], 0)
+		self.assertLessEqual(result['min_us'], result['median_us'])
+
+	def test_compare(self):
+		baseline = {'version': 1, 'results': {'a[]': {'per_sec': 100.0}, 'b[]': {'per_sec': 100.0}, 'c[]': {}}}
+		current = {'version': 1, 'results': {'a[]': {'per_sec': 95.0}, 'b[]': {'per_sec': 80.0}, 'c[]': {}}}
+		changes, regressions = compare(baseline, current, threshold=0.1)
+		self.assertEqual([key for key, *_ in changes], ['a[]', 'b[]'])
+		self.assertEqual(regressions, ['b[]'])
+
+
+class TestPolicy(unittest.TestCase):
+
+	def test_arguments_not_modified(self):
+		usable_chars = [['a', 'b', 'c'], ['1', '2']]
+		default = [list(group) for group in USABLE_CHARS]
+
+		p = PyPass(usable_chars=usable_chars, excluded_chars=['b', '2'], excluded_words=[],
+				   breach_checker=RejectingChecker(0))
+		PyPass(excluded_chars=['a', '1'], breach_checker=RejectingChecker(0))
+
+		self.assertEqual(p.usable_chars, (('a', 'c'), ('1',)))
+		self.assertEqual(usable_chars, [['a', 'b', 'c'], ['1', '2']])
+		self.assertEqual(USABLE_CHARS, default)
+
+	def test_shared(self):
+		policy = PasswordPolicy.get(excluded_chars=['l', '1'], min_pass_len=12)
+		self.assertIs(PasswordPolicy.get(excluded_chars=('l', '1'), min_pass_len=12), policy)
+		self.assertEqual(PasswordPolicy(excluded_chars=['l', '1'], min_pass_len=12), policy)
+		self.assertNotEqual(PasswordPolicy.get(excluded_chars=['l'], min_pass_len=12), policy)
+
+		generators = [PyPass(excluded_chars=['l', '1'], min_pass_len=12, breach_checker=RejectingChecker(0))
+					  for _ in range(3)]
+		self.assertTrue(all(p.policy is policy and p.alphabet is policy.alphabet for p in generators))
+
+		# Unpickled policies, e.g. in worker processes, come from the cache as well.
+		self.assertIs(pickle.loads(pickle.dumps(policy)), policy)
+
+	def test_immutable(self):
+		policy = PasswordPolicy.get()
+		self.assertEqual(policy.char_groups['c'], (0,))
+		self.assertNotIn('a', policy.char_groups)
+		with self.assertRaises(TypeError):
+			policy.char_groups['a'] = (0,)
+		self.assertRaises(AttributeError, setattr, policy, 'min_pass_len', 1)
+		self.assertEqual(hash(policy), hash(PasswordPolicy()))
+
+
+class TestProportions(unittest.TestCase):
+
+	def test_repairs_keep_other_groups(self):
+		usable_chars = [['a', 'b'], ['1', '2'], ['!', '?'], ['X', 'Y']]
+		p = PyPass(usable_chars=usable_chars, excluded_chars=[], excluded_words=[], breach_checker=RejectingChecker(0),
+				   collect_stats=True)
+
+		for _ in range(200):
+			# One character of the first group and none of two others: repairs may only take 'a' or 'b' if both
+			# remain, and never the single '1'.
+			password = p.ensure_proportions(list('aaaaab1'))
+			self.assertTrue(all(count >= 1 for count in p.count_groups(password)))
+			self.assertIn('1', password)
+
+		self.assertEqual(p.stats.counters['proportion_repairs'], 400)
+		self.assertEqual(p.generate_new_dict(list('ab1!')), {'0': 2, '1': 1, '2': 1, '3': 0})
+
+	def test_too_short(self):
+		p = PyPass(usable_chars=[['a'], ['1'], ['!']], excluded_chars=[], excluded_words=[],
+				   breach_checker=RejectingChecker(0))
+		self.assertRaises(ValueError, p.ensure_proportions, list('a1'))
+
+
+class TestEntropy(unittest.TestCase):
+
+	def test_counts_match_enumeration(self):
+		policy = PasswordPolicy.get([['a', 'b', 'c'], ['1', '2'], ['!']], [], ['ab1', 'c!'], 2, 5)
+		chars = [char for group in policy.usable_chars for char in group]
+
+		for no_repeats, all_groups, max_letter_run in itertools.product((False, True), (False, True), (None, 1)):
+			counts = count_passwords(policy, no_repeats, all_groups, max_letter_run, 5)
+			for length in range(6):
+				valid = [password for password in map(''.join, itertools.product(chars, repeat=length))
+						 if not policy.excluded_matcher.search(password)
+						 and not (no_repeats and any(a == b for a, b in zip(password, password[1:])))
+						 and not (all_groups and not all(set(password) & set(group) for group in policy.usable_chars))
+						 and not (max_letter_run and any(a.isalpha() and b.isalpha()
+														 for a, b in zip(password, password[1:])))]
+
+				count, probability, moment = counts[length]
+				self.assertEqual(count, len(valid))
+				self.assertAlmostEqual(probability, sum(
+					math.prod(policy.alphabet.probability(char) for char in password) for password in valid))
+
+	def test_direct_sampling_is_exact(self):
+		p = PyPass(usable_chars=[['a', 'b'], ['1']], excluded_chars=[], excluded_words=['ba'], min_pass_len=2,
+				   max_pass_len=3, direct_sampling=True, breach_checker=RejectingChecker(0))
+		entropy = p.entropy(remove_repeating=True, check_proportions=True)
+
+		# a1 1a b1 1b, and ab1 a1a a1b b1a b1b 1ab 1a1 1b1.
+		self.assertTrue(entropy.exact)
+		self.assertEqual(entropy.keyspace, (12, 12))
+		self.assertAlmostEqual(entropy.entropy[0], 1 + (math.log2(4) + math.log2(8)) / 2)
+		self.assertAlmostEqual(entropy.min_entropy[0], 1 + math.log2(4))
+
+	def test_random_bounds(self):
+		p = PyPass(usable_chars=[['a', 'b', 'c', 'd']], excluded_chars=[], excluded_words=[],
+				   breach_checker=RejectingChecker(0), char_distribution='uniform')
+		entropy = p.entropy(fixed_len=10)
+		self.assertTrue(entropy.exact)
+		self.assertAlmostEqual(entropy.entropy[0], 20)
+
+		# Repairs are bounded, and can't beat a uniform choice among the passwords satisfying the rules.
+		human = PyPass(breach_checker=RejectingChecker(0)).entropy(human=True)
+		direct = PyPass(breach_checker=RejectingChecker(0), direct_sampling=True).entropy(human=True)
+		self.assertLess(0, human.entropy[0])
+		self.assertLess(human.entropy[0], human.entropy[1])
+		self.assertLessEqual(human.entropy[1], direct.entropy[1] + 1e-9)
+
+		# A single character can't hold both groups.
+		p = PyPass(usable_chars=[['a'], ['1']], excluded_chars=[], excluded_words=[], breach_checker=RejectingChecker(0))
+		self.assertRaises(ValueError, p.entropy, check_proportions=True, fixed_len=1)
+
+	def test_sentences(self):
+		model = CompactTrigramModel.from_sentences([['a', 'b'], ['a', 'c']])
+		entropy = sentence_entropy(model, 2)
+		self.assertEqual(entropy.entropy, (0.0, 1.0))
+		self.assertEqual(entropy.keyspace, (0, 2))
+
+
+class TestDistribution(unittest.TestCase):
+
+	def test_chi_square_sf(self):
+		self.assertAlmostEqual(chi_square_sf(3.841458820694124, 1), 0.05)
+		self.assertAlmostEqual(chi_square_sf(18.307038053275146, 10), 0.05)
+		# With 2 degrees of freedom the tail is exp(-x / 2).
+		for statistic in (0.5, 10, 100):
+			self.assertAlmostEqual(chi_square_sf(statistic, 2), math.exp(-statistic / 2))
+		self.assertEqual(chi_square_sf(0, 5), 1.0)
+
+	def test_counts(self):
+		for use_numpy in (False, True):
+			counts = FrequencyCounts(use_numpy=use_numpy)
+			counts.update(['ab', 'ba'])
+			counts.update(['a'])
+			self.assertEqual(counts.passwords, 3)
+			self.assertEqual(counts.lengths, {2: 2, 1: 1})
+			self.assertEqual(counts.chars, {'a': 3, 'b': 2})
+			self.assertEqual(counts.positions, [{'a': 2, 'b': 1}, {'b': 1, 'a': 1}])
+			self.assertEqual(counts.bigrams, {'ab': 1, 'ba': 1})
+
+	def test_engines(self):
+		p = PyPass(usable_chars=[['a', 'b', 'c'], ['1']], excluded_chars=[], excluded_words=[], min_pass_len=3,
+				   max_pass_len=6, breach_checker=RejectingChecker(0))
+		report = check_distribution(p, samples=5000, engines=['reference', 'default', 'python'], alpha=1e-6)
+		self.assertTrue(report.passed, str(report))
+		self.assertIn('bigrams [python vs reference]', [test[0] for test in report.tests])
+
+		report = check_distribution(p, samples=2000, remove_repeating=True, check_proportions=True, alpha=1e-6)
+		self.assertTrue(report.passed, str(report))
+
+		# Direct sampling draws every character alike, not each group alike.
+		report = check_distribution(p, samples=5000, engines=['reference', 'direct'], alpha=1e-6)
+		self.assertFalse(report.passed)
+		self.assertIn('characters [direct vs reference]', [test[0] for test in report.failures])
+
+	def test_detects_skew(self):
+		fair = FrequencyCounts()
+		fair.update(['ab', 'ba'] * 500)
+		skewed = FrequencyCounts()
+		skewed.update(['ab'] * 700 + ['ba'] * 300)
+		tests = dict((name, chi_square_sf(statistic, df)) for name, statistic, df in homogeneity(fair, skewed))
+		self.assertLess(tests['position 0'], 1e-6)
+		self.assertGreater(tests['characters'], 0.5)
+
+
+class TestServer(unittest.TestCase):
+
+	def setUp(self):
+		self.service = PasswordService(breach_checker=RejectingChecker(0))
+
+	def start(self, **options):
+		server = make_server(self.service, **options)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		return server
+
+	def test_handle(self):
+		self.assertEqual(len(self.service.handle({'password_number': 3, 'fix_len': 12})['passwords']), 3)
+		self.assertTrue(self.service.handle({'simple': True, 'lower': True, 'upper': True, 'punct': True,
+											 'fix_len': 10})['passwords'][0].isdigit())
+
+		answers = self.service.handle([{'human': True}, {'bogus': 1}, {'min_len': 20, 'max_len': 10}])
+		self.assertEqual(len(answers[0]['passwords']), 1)
+		self.assertIn('bogus', answers[1]['error'])
+		self.assertIn('error', answers[2])
+
+		# Lengths are bounded.
+		for params in ({'max_len': SERVE_MAX_LEN + 1}, {'min_len': 0}, {'fix_len': SERVE_MAX_LEN + 1},
+					   {'fix_len': -1}):
+			self.assertIn('error', self.service.handle(params), params)
+		self.assertEqual(len(self.service.handle({'fix_len': SERVE_MAX_LEN})['passwords'][0]), SERVE_MAX_LEN)
+
+		# Language libraries are named, never given as paths.
+		for lang_lib in ('../../x', 'models/odyssey', '', 7):
+			self.assertIn('error', self.service.handle({'lang_lib': lang_lib}), lang_lib)
+
+		# Instances are reused by requests with the same options.
+		self.service.handle({'password_number': 2, 'fix_len': 12})
+		self.assertEqual(len(self.service.generators), 2)
+
+	def test_http(self):
+		server = self.start(port=0)
+		connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+		# Several requests over a single connection.
+		for body, status in (({'fix_len': 16}, 200), ([{}, {}], 200), ({'password_number': 0}, 400)):
+			connection.request('POST', '/generate', json.dumps(body))
+			response = connection.getresponse()
+			self.assertEqual(response.status, status)
+			answer = json.loads(response.read())
+
+		self.assertIn('error', answer)
+
+		connection.request('POST', '/entropy', json.dumps({'simple': True, 'fix_len': 10}))
+		response = connection.getresponse()
+		self.assertEqual(response.status, 200)
+		self.assertTrue(json.loads(response.read())['exact'])
+		connection.close()
+
+	def test_http_errors(self):
+		class FailingChecker:
+			def check_batch(self, passwords):
+				raise ConnectionError('haveibeenpwned is unreachable')
+
+		self.service = PasswordService(breach_checker=FailingChecker())
+		server = self.start(port=0)
+		connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+		connection.request('POST', '/generate', json.dumps({'fix_len': 16}))
+		response = connection.getresponse()
+		self.assertEqual(response.status, 503)
+		self.assertIn('unreachable', json.loads(response.read())['error'])
+
+		connection.request('POST', '/generate', '{}', headers={'Content-Length': '-1'})
+		response = connection.getresponse()
+		self.assertEqual(response.status, 400)
+		self.assertIn('Content-Length', json.loads(response.read())['error'])
+		connection.close()
+
+	def test_unix_socket(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		path = os.path.join(directory.name, 'pypass.sock')
+		self.start(socket_path=path)
+
+		body = json.dumps({'password_number': 2}).encode()
+		with socket.socket(socket.AF_UNIX) as client:
+			client.connect(path)
+			client.sendall(b'POST /generate HTTP/1.1\r\nConnection: close\r\nContent-Length: %d\r\n\r\n%s'
+						   % (len(body), body))
+			response = b''.join(iter(lambda: client.recv(65536), b''))
+
+		self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+		self.assertEqual(len(json.loads(response.split(b'\r\n\r\n', 1)[1])['passwords']), 2)
+
+	def test_unix_socket_mode(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+
+		# Other users can't connect, whatever the umask, unless they are let in.
+		for name, mode in (('default.sock', None), ('group.sock', 0o660)):
+			path = os.path.join(directory.name, name)
+			self.start(socket_path=path, **({} if mode is None else {'socket_mode': mode}))
+			self.assertEqual(os.stat(path).st_mode & 0o777, mode or 0o600)
+
+
+class TestStartup(unittest.TestCase):
+
+	def test_lazy_imports(self):
+		# Generating passwords, and importing the command line, doesn't load anything only other modes need.
+		code = ("import sys, pypass\n"
+				"from password import PyPass\n"
+				"class Checker:\n"
+				"	def check_batch(self, passwords):\n"
+				"		return [0] * len(passwords)\n"
+				"PyPass(breach_checker=Checker()).generate_password(10)\n"
+				"print(' '.join(sys.modules))\n")
+		result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+								capture_output=True, text=True, check=True)
+		modules = result.stdout.split()
+
+		self.assertIn('password', modules)
+		for module in ('nltk', 'language', 'pyhibp', 'requests', 'asyncio', 'numpy', 'http.server'):
+			self.assertNotIn(module, modules)
+
 
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
@@ -0,0 +1,264 @@
+import array
+import bisect
+import mmap
+import struct
+import sys
+from collections import defaultdict
+
+MODEL_MAGIC = b'PYPASSTG'
+MODEL_VERSION = 1
+
+# Magic, format version, number of words, number of contexts, number of transitions and the size of the word blob.
+MODEL_HEADER = struct.Struct('<8sB7xQQQQ')
+ARRAYS_OFFSET = 64
+
+START = '<s>'
+END = '</s>'
+
+
+class _WordKeys:
+	"""
+	Sequence of the encoded words of a model, used to binary search the vocabulary without decoding it.
+	"""
+
+	def __init__(self, model):
+		self.model = model
+
+	def __len__(self):
+		return self.model.vocab_size
+
+	def __getitem__(self, word_id):
+		return self.model._word_bytes(word_id)
+
+
+class CompactTrigramModel:
+	"""
+	Trigram model stored as flat arrays, which can be memory-mapped and shared between processes.
+
+	Words are interned into integer ids, in order of their UTF-8 encoding. Each context, a pair of word ids, is
+	stored as a single sorted key. The words following a context are stored in a CSR-like layout: for context i,
+	positions row_starts[i] to row_starts[i + 1] of next_ids hold the ids of the following words, and the same
+	positions of cumulative_counts hold running totals of their counts, so the next word is sampled by binary
+	searching a random number below the total.
+	"""
+
+	def __init__(self, buffer):
+		"""
+		Args:
+			buffer (bytes, mmap): Model, as written by save().
+		"""
+		magic, version, self.vocab_size, self.context_count, self.edge_count, blob_size = \
+			MODEL_HEADER.unpack_from(buffer, 0)
+
+		if magic != MODEL_MAGIC or version != MODEL_VERSION:
+			raise ValueError('Buffer does not hold a PyPass trigram model.')
+
+		self.buffer = buffer
+		view = memoryview(buffer)
+		offset = ARRAYS_OFFSET
+
+		def read_array(typecode, length):
+			nonlocal offset
+			size = struct.calcsize(typecode) * length
+			result = view[offset:offset + size].cast(typecode)
+			offset += size
+
+			# Arrays are saved little-endian. Big-endian machines read a byteswapped copy instead of the buffer itself.
+			if sys.byteorder != 'little':
+				swapped = array.array(typecode, result)
+				swapped.byteswap()
+				result.release()
+				result = swapped
+			return result
+
+		self.word_offsets = read_array('Q', self.vocab_size + 1)
+		self.context_keys = read_array('Q', self.context_count)
+		self.row_starts = read_array('Q', self.context_count + 1)
+		self.next_ids = read_array('I', self.edge_count)
+		self.cumulative_counts = read_array('I', self.edge_count)
+		self.words = view[offset:offset + blob_size]
+
+		self.start_id = self.word_id(START)
+		self.end_id = self.word_id(END)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Memory-maps a model saved with save(). Pages are loaded, and shared with other processes, as they are used.
+		"""
+		with open(path, 'rb') as f:
+			return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			f.write(self.buffer)
+
+	def close(self):
+		# Views of a memory map have to be released before it can be closed.
+		for view in (self.word_offsets, self.context_keys, self.row_starts, self.next_ids, self.cumulative_counts,
+					 self.words):
+			if isinstance(view, memoryview):
+				view.release()
+
+		if isinstance(self.buffer, mmap.mmap):
+			self.buffer.close()
+
+	@classmethod
+	def from_counts(cls, trigram_counts):
+		"""
+		Builds a model from trigram counts.
+
+		Args:
+			trigram_counts (dict): Maps (first word, second word) contexts to dictionaries of following words and
+								   their counts.
+		"""
+		vocabulary = {START, END}
+		for (first, second), following in trigram_counts.items():
+			vocabulary.update((first, second))
+			vocabulary.update(following)
+
+		encoded = sorted(word.encode('utf-8') for word in vocabulary)
+		ids = {word.decode('utf-8'): word_id for word_id, word in enumerate(encoded)}
+		vocab_size = len(encoded)
+
+		word_offsets = [0]
+		for word in encoded:
+			word_offsets.append(word_offsets[-1] + len(word))
+
+		rows = sorted((ids[first] * vocab_size + ids[second], following)
+					  for (first, second), following in trigram_counts.items() if following)
+
+		context_keys = []
+		row_starts = [0]
+		next_ids = []
+		cumulative_counts = []
+
+		for key, following in rows:
+			context_keys.append(key)
+			total = 0
+			for word_id, count in sorted((ids[word], count) for word, count in following.items()):
+				total += count
+				next_ids.append(word_id)
+				cumulative_counts.append(total)
+			row_starts.append(len(next_ids))
+
+		blob = b''.join(encoded)
+		header = MODEL_HEADER.pack(MODEL_MAGIC, MODEL_VERSION, vocab_size, len(context_keys), len(next_ids),
+								   len(blob)).ljust(ARRAYS_OFFSET, b'\0')
+
+		return cls(b''.join([
+			header,
+			struct.pack(f'<{len(word_offsets)}Q', *word_offsets),
+			struct.pack(f'<{len(context_keys)}Q', *context_keys),
+			struct.pack(f'<{len(row_starts)}Q', *row_starts),
+			struct.pack(f'<{len(next_ids)}I', *next_ids),
+			struct.pack(f'<{len(cumulative_counts)}I', *cumulative_counts),
+			blob,
+		]))
+
+	@classmethod
+	def from_sentences(cls, sentences):
+		"""
+		Builds a model from tokenized sentences. Like nltk, sentences are padded with two start and one end symbol.
+
+		Args:
+			sentences (list): List of sentences, each a list of words.
+		"""
+		trigram_counts = defaultdict(lambda: defaultdict(int))
+
+		for sentence in sentences:
+			padded = [START, START] + list(sentence) + [END]
+			for first, second, third in zip(padded, padded[1:], padded[2:]):
+				trigram_counts[(first, second)][third] += 1
+
+		return cls.from_counts(trigram_counts)
+
+	@classmethod
+	def from_mle(cls, model):
+		"""
+		Converts a trigram nltk.lm.MLE model, as made by ModelManager.
+
+		Args:
+			model (nltk.lm.MLE instance): trigram model to be converted.
+		"""
+		return cls.from_counts({tuple(context): dict(following) for context, following in model.counts[3].items()})
+
+	def _word_bytes(self, word_id):
+		return self.words[self.word_offsets[word_id]:self.word_offsets[word_id + 1]].tobytes()
+
+	def word(self, word_id):
+		return self._word_bytes(word_id).decode('utf-8')
+
+	def word_id(self, word):
+		"""
+		Returns the id of a word, or None if it is not in the vocabulary.
+		"""
+		encoded = word.encode('utf-8')
+		word_id = bisect.bisect_left(_WordKeys(self), encoded)
+
+		if word_id < self.vocab_size and self._word_bytes(word_id) == encoded:
+			return word_id
+		return None
+
+	def row(self, first_id, second_id):
+		"""
+		Returns the start and end positions of the words following a context, or None if the context is unknown.
+		"""
+		key = first_id * self.vocab_size + second_id
+		index = bisect.bisect_left(self.context_keys, key)
+
+		if index < self.context_count and self.context_keys[index] == key:
+			return self.row_starts[index], self.row_starts[index + 1]
+		return None
+
+	def sample_next(self, first_id, second_id, randbelow):
+		"""
+		Returns the id of a word drawn from the words following a context, proportionally to their counts, or None
+		if the context is unknown.
+
+		Args:
+			first_id (int): Id of the first word of the context.
+			second_id (int): Id of the second word of the context.
+			randbelow (callable): Returns a random integer in [0, n), e.g. secrets.randbelow.
+		"""
+		row = self.row(first_id, second_id)
+		if row is None:
+			return None
+
+		start, end = row
+		draw = randbelow(self.cumulative_counts[end - 1])
+		return self.next_ids[bisect.bisect_right(self.cumulative_counts, draw, start, end)]
+
+	def iter_word_ids(self, randbelow):
+		"""
+		Endlessly yields ids of sampled words. Like nltk.Text.generate(), a new sentence is started whenever one ends.
+
+		Args:
+			randbelow (callable): Returns a random integer in [0, n), e.g. secrets.randbelow.
+		"""
+		# Sentences are only ever started, so a model without a word following the start would never yield one.
+		row = self.row(self.start_id, self.start_id)
+		if row is None or all(self.next_ids[index] == self.end_id for index in range(*row)):
+			raise ValueError('The model holds no words.')
+
+		context = (self.start_id, self.start_id)
+
+		while True:
+			word_id = self.sample_next(context[0], context[1], randbelow)
+
+			if word_id is None or word_id == self.end_id:
+				context = (self.start_id, self.start_id)
+				continue
+
+			yield word_id
+			context = (context[1], word_id)
+
+	def generate(self, length, randbelow):
+		"""
+		Returns a list of length words.
+
+		Args:
+			length (int): Number of words to be generated.
+			randbelow (callable): Returns a random integer in [0, n), e.g. secrets.randbelow.
+		"""
+		return [self.word(word_id) for word_id, _ in zip(self.iter_word_ids(randbelow), range(length))]